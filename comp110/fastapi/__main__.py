@@ -1,14 +1,17 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 import uvicorn
-import inspect
-from . import demo
+from .dynamic_router import DynamicRouter
 
-app = FastAPI()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    with demo.watch():
+        yield
 
-for name, obj in inspect.getmembers(demo):
-    if inspect.isfunction(obj):
-        app.add_api_route(f"/{name}", obj, methods=["POST"])
+
+app = FastAPI(lifespan=lifespan)
+demo = DynamicRouter(app, f"{__package__}.demo")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,235 @@
+"""DynamicRouter serves a module's functions as POST routes and reloads them in place.
+
+Every function in the module is served at `/<name>`, as `add_api_route` would
+serve it. While the app runs, the module's file is watched. When it is saved the
+module is executed again as a fresh module object, and only the routes whose
+functions changed are rebuilt. A function counts as changed when the source of
+its definition changed, or the source of any top-level definition it names,
+such as a helper, a model, or a constant, changed. The other routes keep their
+request and response models but call the new module's functions, so every route
+shares the module state of the latest load.
+
+The app's route list is replaced in one assignment, so a request is routed
+either entirely before or entirely after a reload. A request already in flight
+keeps running its old handler, whose module is left intact. The OpenAPI schema
+is generated once per reload instead of lazily on the next request for it.
+
+A module that fails to load is reported and the routes it would replace are kept.
+"""
+
+import ast
+import asyncio
+import copy
+import hashlib
+import importlib.util
+import inspect
+import os
+import sys
+from contextlib import contextmanager
+from types import ModuleType
+from typing import Callable, Iterator
+from fastapi import FastAPI
+from fastapi.routing import APIRoute, APIRouter, request_response
+from watchdog.events import FileSystemEvent, FileSystemEventHandler
+from watchdog.observers import Observer
+
+DEBOUNCE_SECONDS = 0.1
+"""Quiet time after a save before reloading, since editors write in steps."""
+
+
+class DynamicRouter:
+    """The routes for one module's functions, kept current with its source."""
+
+    def __init__(self, app: FastAPI, module_name: str):
+        """Load the module and add its routes to the app.
+
+        Args:
+            app: The app to serve the routes from.
+            module_name: The module whose functions are served.
+        """
+        self._app = app
+        self._module_name = module_name
+        self._source: str | None = None
+        self._routes: dict[str, tuple[str, APIRoute]] = {}
+        self._reload_timer: asyncio.TimerHandle | None = None
+        self.reload()
+
+    @property
+    def path(self) -> str:
+        spec = importlib.util.find_spec(self._module_name)
+        assert spec and spec.origin
+        return spec.origin
+
+    def reload(self) -> None:
+        """Load the module again and swap in the routes that changed."""
+        if self._source is None:
+            module, source = self._load()  # A module that fails the first time raises.
+        else:
+            try:
+                module, source = self._load()
+            except Exception as e:
+                print(e)
+                return
+        if source == self._source:
+            return
+        self._swap(module, _definitions(source))
+        self._source = source
+
+    @contextmanager
+    def watch(self) -> Iterator[None]:
+        """Reload whenever the module's file is saved, until the block exits.
+
+        Must be entered on the event loop that serves the app, as in a lifespan."""
+        loop = asyncio.get_running_loop()
+        observer = Observer()
+        observer.schedule(
+            _ModuleFileHandler(
+                self.path, lambda: loop.call_soon_threadsafe(self._saved)
+            ),
+            os.path.dirname(self.path),
+        )
+        observer.start()
+        try:
+            yield
+        finally:
+            if self._reload_timer:
+                self._reload_timer.cancel()
+            observer.stop()
+            observer.join()
+
+    def _saved(self) -> None:
+        if self._reload_timer:
+            self._reload_timer.cancel()
+        loop = asyncio.get_running_loop()
+        self._reload_timer = loop.call_later(DEBOUNCE_SECONDS, self.reload)
+
+    def _load(self) -> tuple[ModuleType, str]:
+        """Execute the module's current source as a new module object.
+
+        The source is compiled directly rather than from cached bytecode, which is
+        validated only to the second."""
+        spec = importlib.util.find_spec(self._module_name)
+        if spec is None or spec.loader is None or spec.origin is None:
+            raise ModuleNotFoundError(f"No module named {self._module_name!r}")
+        with open(spec.origin, encoding="utf-8") as file:
+            source = file.read()
+        module = importlib.util.module_from_spec(spec)
+        exec(compile(source, spec.origin, "exec"), module.__dict__)
+        sys.modules[self._module_name] = module
+        return module, source
+
+    def _swap(self, module: ModuleType, definitions: dict[str, str]) -> None:
+        """Rebuild the routes of changed functions, point the rest at the module's
+        functions, and replace the app's routes."""
+        routes: dict[str, tuple[str, APIRoute]] = {}
+        for name, function in inspect.getmembers(module, inspect.isfunction):
+            fingerprint = _fingerprint(name, definitions)
+            previous = self._routes.get(name)
+            if previous and previous[0] == fingerprint:
+                routes[name] = (fingerprint, _rebind(previous[1], function))
+            else:
+                routes[name] = (fingerprint, _route(f"/{name}", function))
+
+        owned = {id(route) for _, route in self._routes.values()}
+        self._app.router.routes = [
+            route for route in self._app.router.routes if id(route) not in owned
+        ] + [route for _, route in routes.values()]
+        self._routes = routes
+
+        self._app.openapi_schema = None
+        try:
+            self._app.openapi()
+        except Exception as e:
+            # A model the schema cannot describe still serves requests.
+            print(e)
+
+
+_WRITE_EVENTS = frozenset(("created", "modified", "moved", "closed"))
+"""Event types that can change a file, unlike the opens of reloading it."""
+
+
+class _ModuleFileHandler(FileSystemEventHandler):
+    """Calls back when a watched directory's event writes one file."""
+
+    def __init__(self, path: str, on_change: Callable[[], object]):
+        self._path = os.path.abspath(path)
+        self._on_change = on_change
+
+    def on_any_event(self, event: FileSystemEvent) -> None:
+        if event.event_type not in _WRITE_EVENTS:
+            return
+        paths = (event.src_path, getattr(event, "dest_path", ""))
+        for path in paths:
+            if path and os.path.abspath(os.fsdecode(path)) == self._path:
+                self._on_change()
+                return
+
+
+def _route(path: str, function: Callable[..., object]) -> APIRoute:
+    """The route `add_api_route` would add for a function, built on its own."""
+    router = APIRouter()
+    router.add_api_route(path, function, methods=["POST"])
+    route = router.routes[0]
+    assert isinstance(route, APIRoute)
+    return route
+
+
+def _rebind(route: APIRoute, function: Callable[..., object]) -> APIRoute:
+    """A copy of a route that calls `function`, keeping the route's models."""
+    rebound = copy.copy(route)
+    rebound.endpoint = function
+    rebound.dependant = copy.copy(route.dependant)
+    rebound.dependant.call = function
+    rebound.app = request_response(rebound.get_route_handler())
+    return rebound
+
+
+def _definitions(source: str) -> dict[str, str]:
+    """The source of the top-level statements that bind each name."""
+    definitions: dict[str, str] = {}
+    for statement in ast.parse(source).body:
+        segment = ast.get_source_segment(source, statement) or ""
+        for name in _bound_names(statement):
+            definitions[name] = definitions.get(name, "") + segment + "\n"
+    return definitions
+
+
+def _bound_names(statement: ast.stmt) -> list[str]:
+    if isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return [statement.name]
+    if isinstance(statement, (ast.Import, ast.ImportFrom)):
+        return [(a.asname or a.name).split(".")[0] for a in statement.names]
+    if isinstance(statement, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+        if isinstance(statement, ast.Assign):
+            targets = statement.targets
+        else:
+            targets = [statement.target]
+        return [
+            node.id
+            for target in targets
+            for node in ast.walk(target)
+            if isinstance(node, ast.Name)
+        ]
+    return []
+
+
+def _fingerprint(name: str, definitions: dict[str, str]) -> str:
+    """A hash of a name's definition and of every definition it names, in turn."""
+    digest = hashlib.sha256()
+    pending, seen = [name], {name}
+    while pending:
+        segment = definitions.get(pending.pop(), "")
+        digest.update(segment.encode() + b"\0")
+        try:
+            named = {
+                node.id
+                for node in ast.walk(ast.parse(segment))
+                if isinstance(node, ast.Name)
+            }
+        except SyntaxError:
+            named = set()
+        for other in sorted(named - seen):
+            if other in definitions:
+                seen.add(other)
+                pending.append(other)
+    return digest.hexdigest()
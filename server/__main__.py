@@ -1,7 +1,21 @@
-import uvicorn
+import argparse
+import os
 
-from .main import app
+import uvicorn
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)  # type: ignore
+    parser = argparse.ArgumentParser(prog="python -m server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("COMP110_WORKERS", 1)),
+        help="worker processes, e.g. one per core",
+    )
+    args = parser.parse_args()
+    # Workers are separate interpreters that read their settings from the
+    # environment when they import the server.
+    os.environ["COMP110_WORKERS"] = str(args.workers)
+    uvicorn.run("server.main:app", host=args.host, port=args.port, workers=args.workers)
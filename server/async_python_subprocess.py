@@ -1,28 +1,147 @@
 import asyncio
+import json
+import os
 import sys
-import subprocess
-from subprocess import Popen
+import time
+from typing import Any, Callable, Coroutine
+from asyncio import StreamReader, StreamReaderProtocol
+from asyncio.subprocess import Process
 from starlette.websockets import WebSocketState
-from asyncio import StreamReader
 
 from fastapi import WebSocket
 
 from server.web_socket_event import WebSocketEvent
+from .wire import send_event, send_output
+from .interpreter_pool import InterpreterPool, WrapperProcess, open_wrapper_process
+from .output_batcher import OutputBatcher, utf8_boundary
+from .scrollback import Entry, Scrollback
+from .stdin_writer import StdinWriter
+from .wrappers.control import (
+    FRAME_HEADER,
+    PROMPT,
+    EXCEPTION,
+    EVENT,
+    DEPENDENCIES,
+    PROFILE,
+    USAGE,
+)
+from . import config, metrics
+
+
+ExitHandler = Callable[["AsyncPythonSubprocess", int], Coroutine[None, None, None]]
+"""Called with a run and its return code after its output is sent, before EXIT."""
+
+USAGE_FIELDS = (
+    "user_seconds",
+    "system_seconds",
+    "max_rss_bytes",
+    "voluntary_switches",
+    "involuntary_switches",
+)
+"""Resource usage the wrapper reports, or that is read from /proc before a kill."""
+
+USAGE_SAMPLE_SECONDS = 1.0
+"""Interval of /proc samples of a run that may be nearing its CPU time limit."""
 
 
 class AsyncPythonSubprocess:
-    def __init__(self, module: str, client: WebSocket):
+    """A wrapper process running a student module, streamed to a web socket client.
+
+    The child runs on asyncio's subprocess transport, so its pipes are read by the
+    event loop and its exit is reported by the loop's child watcher (a pidfd on
+    modern Linux) rather than by polling.
+
+    stdout and stderr carry only program output. They are read in chunks of
+    whatever is available, so output without a newline (prompts printed with
+    `end=""`, progress bars, `\r` animations) reaches the client within the
+    batcher's flush latency. A chunk is never cut inside a UTF-8 character. Input
+    prompts and the crash report arrive on the wrapper's control pipe. A prompt
+    names how many stdout bytes precede it and is sent once those are forwarded.
+
+    Everything sent to the client is kept in a bounded scrollback with a sequence
+    number. When the client disconnects the run is detached and keeps running,
+    and a client that attaches is sent the scrollback after the last sequence
+    number it saw, then live output.
+
+    Input is queued to a `StdinWriter`. Input that does not fit its buffer is
+    refused with a STDIN_BUFFER_FULL event, and queued input is dropped at exit.
+
+    EXIT carries the run's `usage`: wall time, bytes of stdout and stderr, the
+    time to its first output, and its CPU time, peak memory, and context
+    switches. asyncio reaps the child itself, so the last are not taken from
+    wait4. The wrapper reports them as it ends, and a kill by the server reads
+    them from /proc first. A program killed by its CPU time limit cannot report,
+    so once its wall time reaches that limit it is sampled from /proc every
+    `USAGE_SAMPLE_SECONDS`, and the last sample is its usage. /proc figures are
+    taken less those read as the module was launched, so that like the wrapper's
+    they leave out the interpreter's warm up. They are None for a program that
+    died otherwise, such as by a segfault.
+    """
+
+    def __init__(
+        self,
+        module: str,
+        client: WebSocket | None,
+        pool: InterpreterPool | None = None,
+        limits: dict[str, int] | None = None,
+        profile: dict[str, Any] | None = None,
+        on_exit: ExitHandler | None = None,
+    ):
         self._module = module
         self._client = client
-        self._process = None
+        self._pool = pool
+        self._limits = limits or {}
+        self._profile = profile
+        self._on_exit = on_exit
+        self._process: Process | None = None
+        self._stdin: StdinWriter | None = None
+        self._output = OutputBatcher(self._send_output)
+        self._partial_chars: dict[str, bytes] = {"STDOUT": b"", "STDERR": b""}
+        self._stdout_forwarded = 0
+        self._stdout_closed = False
+        self._stdout_progress = asyncio.Condition()
+        self._exception_report: bytes | None = None
+        self._profile_report: dict[str, Any] | None = None
+        self._usage: dict[str, Any] | None = None
+        self._usage_sample: dict[str, Any] | None = None
+        self._usage_at_launch: dict[str, Any] | None = None
+        self._usage_timer: asyncio.TimerHandle | None = None
+        self._started = 0.0
+        self._first_output: float | None = None
+        self._output_bytes = {"STDOUT": 0, "STDERR": 0}
+        self.usage: dict[str, Any] = {}
+        self._scrollback = Scrollback()
+        self._sent_seq = 0
+        self._prompt_seq: int | None = None
+        self._send_lock = asyncio.Lock()
+        self._started_ns = 0
+        self._dependencies: dict[str, Any] | None = None
+        self._interactive = False
+        self._killed = False
 
     async def start(self):
-        self._process = self._open_child_process()
+        self._started_ns = time.time_ns()
+        self._started = time.perf_counter()
+        wrapper = await self._open_child_process()
+        self._process = wrapper.process
+        self._usage_at_launch = _proc_usage(self._process.pid)
+        control = await self._open_control_pipe(wrapper.control_fd)
 
-        stdout_reader, stderr_reader = await self._connect_output_pipes(self._process)
-        self._stdout_pipe_task = asyncio.create_task(self._stdout_pipe(stdout_reader))
-        self._stderr_pipe_task = asyncio.create_task(self._stderr_pipe(stderr_reader))
+        assert self._process.stdin and self._process.stdout and self._process.stderr
+        self._stdin = StdinWriter(self._process.stdin)
+        self._stdout_pipe_task = asyncio.create_task(
+            self._stdout_pipe(self._process.stdout)
+        )
+        self._stderr_pipe_task = asyncio.create_task(
+            self._output_pipe("STDERR", self._process.stderr)
+        )
+        self._control_pipe_task = asyncio.create_task(self._control_pipe(control))
         self._exit_task = asyncio.create_task(self._exit())
+        if self._limits.get("cpu_seconds", 0) > 0:
+            # CPU time cannot pass the limit before wall time does.
+            self._usage_timer = asyncio.get_running_loop().call_later(
+                self._limits["cpu_seconds"], self._sample_usage
+            )
 
         return self._process.pid
 
@@ -32,139 +151,337 @@ class AsyncPythonSubprocess:
         await asyncio.gather(self._exit_task)
         return self._process.returncode
 
+    @property
+    def client(self) -> WebSocket | None:
+        return self._client
+
+    @property
+    def module(self) -> str:
+        return self._module
+
+    @property
+    def pid(self) -> int | None:
+        return self._process.pid if self._process else None
+
+    @property
+    def started_ns(self) -> int:
+        """Wall clock time the run was started, in nanoseconds."""
+        return self._started_ns
+
+    def replayable_output(self) -> tuple[list[str], list[Entry]] | None:
+        """The workspace files an exited run depended on and everything it sent,
+        if replaying them would be faithful: it read no input, had no side
+        effects, was not killed, and its scrollback is complete."""
+        entries = self._scrollback.since(0)
+        if (
+            self._dependencies is None
+            or self._dependencies["side_effects"]
+            or self._interactive
+            or self._killed
+            or (entries and entries[0].seq != 1)
+        ):
+            return None
+        return self._dependencies["files"], entries
+
     def subprocess_exited(self):
-        return self._process and self._process.poll() is not None
+        return self._process and self._process.returncode is not None
 
     def client_connected(self):
-        return self._client.client_state == WebSocketState.CONNECTED
+        return (
+            self._client is not None
+            and self._client.client_state == WebSocketState.CONNECTED
+        )
 
-    def write(self, data: str) -> None:
-        if self._process and self._process.stdin and not self.subprocess_exited():
-            if not data.endswith("\n"):
-                data += "\n"
-            self._process.stdin.write(data)
-            self._process.stdin.flush()
+    async def attach(self, client: WebSocket, since: int) -> None:
+        """Send a client the scrollback after sequence number `since`, then live
+        output. The previous client, if any, is sent nothing more."""
+        async with self._send_lock:
+            self._client = client
+            self._sent_seq = min(since, self._scrollback.last_seq)
+            entries = self._scrollback.since(self._sent_seq)
+            await send_event(
+                client,
+                WebSocketEvent(
+                    type="ATTACHED",
+                    data={
+                        "pid": self.pid,
+                        "module": self._module,
+                        "from_seq": entries[0].seq if entries else self._sent_seq + 1,
+                        "seq": self._scrollback.last_seq,
+                    },
+                ),
+            )
+        await self._pump()
 
-    def kill(self) -> None:
-        if self._process and not self.subprocess_exited():
-            self._process.kill()
-
-    def _open_child_process(self) -> Popen[str]:
-        """Open the child process with flags for debugging."""
-        return subprocess.Popen(
-            [
-                "python3",
-                "-u",
-                "-Xfrozen_modules=off",
-                "-m",
-                "server.wrappers.module",
-                self._module,
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            stdin=subprocess.PIPE,
-            text=True,
-            bufsize=0,  # Unbuffered
-        )
+    def detach(self) -> None:
+        """Stop sending to the client. Output is still kept in the scrollback."""
+        self._client = None
 
-    async def _connect_output_pipes(
-        self, process: Popen[str]
-    ) -> tuple[StreamReader, StreamReader]:
-        """Establish non-blocking readers on the subprocess' output and error sreams."""
-        # Create StreamReader objects for stdout and stderr
-        loop = asyncio.get_event_loop()
-        stdout_reader = asyncio.StreamReader()
-        stderr_reader = asyncio.StreamReader()
+    async def send_event(self, event: WebSocketEvent) -> None:
+        """Send an event to the client, keeping it in the scrollback."""
+        self._scrollback.append_event(event)
+        await self._pump()
 
-        # Create protocol-pipe pairs
-        stdout_protocol = asyncio.StreamReaderProtocol(stdout_reader)
-        stderr_protocol = asyncio.StreamReaderProtocol(stderr_reader)
+    async def write(self, data: str) -> None:
+        """Queue input for the program, or tell the client it was refused."""
+        if not self._process or not self._stdin or self.subprocess_exited():
+            return
+        if not data.endswith("\n"):
+            data += "\n"
+        encoded = data.encode()
+        if not self._stdin.write(encoded):
+            await self.send_event(
+                WebSocketEvent(
+                    type="STDIN_BUFFER_FULL",
+                    data={
+                        "pid": self._process.pid,
+                        "refused": len(encoded),
+                        "buffered": self._stdin.buffered,
+                        "max_bytes": self._stdin.max_bytes,
+                    },
+                )
+            )
+            return
+        self._prompt_seq = None
+        self._interactive = True
 
-        # Associate pipes with StreamReader via transport
-        await loop.connect_read_pipe(lambda: stdout_protocol, process.stdout)
-        await loop.connect_read_pipe(lambda: stderr_protocol, process.stderr)
-        return (stdout_reader, stderr_reader)
+    def kill(self) -> None:
+        if self._process and not self.subprocess_exited():
+            self._killed = True
+            if self._usage is None:
+                self._usage = _proc_usage(self._process.pid, self._usage_at_launch)
+            try:
+                self._process.kill()
+            except ProcessLookupError:
+                ...
 
-    async def _read_stdout(self, stdout: StreamReader):
-        output = await stdout.readline()
-        is_prompt = False
+    def _sample_usage(self) -> None:
+        """Keep the usage of a run that its CPU time limit may kill unreported."""
+        if not self._process or self.subprocess_exited():
+            return
+        sample = _proc_usage(self._process.pid, self._usage_at_launch)
+        self._usage_sample = sample or self._usage_sample
+        self._usage_timer = asyncio.get_running_loop().call_later(
+            USAGE_SAMPLE_SECONDS, self._sample_usage
+        )
 
-        if output[0:4] == b"\xff\xff\xff\xff":
-            length = int(output[4:].decode())
-            output = await stdout.read(length)
-            is_prompt = True
+    async def _open_child_process(self) -> WrapperProcess:
+        """Open the child process, preferring a pre-started pool interpreter."""
+        if self._pool:
+            return await self._pool.acquire(self._module, self._limits, self._profile)
+        return await open_wrapper_process(self._module, self._limits, self._profile)
 
-        return (output.decode(), is_prompt)
+    async def _open_control_pipe(self, fd: int) -> StreamReader:
+        reader = StreamReader()
+        loop = asyncio.get_running_loop()
+        try:
+            pipe = os.fdopen(fd, "rb", buffering=0)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._control_transport, _ = await loop.connect_read_pipe(
+            lambda: StreamReaderProtocol(reader), pipe
+        )
+        return reader
 
     async def _stdout_pipe(self, stdout: StreamReader):
+        try:
+            await self._output_pipe("STDOUT", stdout)
+        finally:
+            async with self._stdout_progress:
+                self._stdout_closed = True
+                self._stdout_progress.notify_all()
+
+    async def _output_pipe(self, stream: str, pipe: StreamReader):
         while True:
             try:
-                output, is_prompt = await self._read_stdout(stdout)
-                if (
-                    output == "" and self.subprocess_exited()
-                ) or not self.client_connected():
+                output = await pipe.read(config.OUTPUT_CHUNK_BYTES)
+                if output == b"":
+                    await self._flush_partial_char(stream)
                     break
-                if output and self._process:
-                    await self._client.send_text(
-                        WebSocketEvent(
-                            type="STDOUT",
-                            data={
-                                "pid": self._process.pid,
-                                "data": output,
-                                "is_input_prompt": is_prompt,
-                            },
-                        ).model_dump_json()
-                    )
+                read = len(output)
+                self._output_bytes[stream] += read
+                if self._first_output is None:
+                    self._first_output = time.perf_counter() - self._started
+                # Hold back a character split across reads until the rest arrives.
+                output = self._partial_chars[stream] + output
+                end = utf8_boundary(output)
+                self._partial_chars[stream] = output[end:]
+                if end:
+                    await self._output.write(stream, output[:end])
+                if stream == "STDOUT":
+                    # Bytes held back count too: a prompt waiting on them
+                    # flushes them itself.
+                    async with self._stdout_progress:
+                        self._stdout_forwarded += read
+                        self._stdout_progress.notify_all()
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 print(e, sys.stderr)
 
-    async def _stderr_pipe(self, stderr: StreamReader):
-        while True:
-            try:
-                output = (await stderr.readline()).decode()
-                if (
-                    output == "" and self.subprocess_exited()
-                ) or not self.client_connected():
-                    break
+    async def _flush_partial_char(self, stream: str) -> None:
+        partial, self._partial_chars[stream] = self._partial_chars[stream], b""
+        if partial:
+            await self._output.write(stream, partial)
 
-                if output and self._process:
-                    await self._client.send_text(
-                        WebSocketEvent(
-                            type="STDERR",
-                            data={"pid": self._process.pid, "data": output},
-                        ).model_dump_json()
-                    )
-            except asyncio.CancelledError:
-                break
-            except Exception as e:
-                print(e, sys.stderr)
+    async def _control_pipe(self, control: StreamReader):
+        try:
+            while True:
+                header = await control.readexactly(FRAME_HEADER.size)
+                kind, length = FRAME_HEADER.unpack(header)
+                payload = await control.readexactly(length)
+                await self._control_frame(kind, payload)
+        except asyncio.IncompleteReadError:
+            ...
+        except asyncio.CancelledError:
+            ...
+        except Exception as e:
+            print(e, sys.stderr)
+        finally:
+            self._control_transport.close()
 
-    async def _exit(self):
-        while True:
-            if not self._process:
-                break
+    async def _control_frame(self, kind: int, payload: bytes) -> None:
+        if kind == PROMPT:
+            self._interactive = True
+            prompt = json.loads(payload)
+            offset = prompt["stdout_offset"]
+            async with self._stdout_progress:
+                await self._stdout_progress.wait_for(
+                    lambda: self._stdout_forwarded >= offset or self._stdout_closed
+                )
+            # The prompt must follow everything printed before it.
+            await self._flush_partial_char("STDOUT")
+            await self._output.drain()
+            await self._send_output("STDOUT", prompt["prompt"].encode(), True)
+        elif kind == EXCEPTION:
+            self._exception_report = payload
+        elif kind == DEPENDENCIES:
+            self._dependencies = json.loads(payload)
+        elif kind == PROFILE:
+            self._profile_report = json.loads(payload)
+        elif kind == USAGE:
+            self._usage = json.loads(payload)
+        elif kind == EVENT and self._process:
+            event = json.loads(payload)
+            await self.send_event(
+                WebSocketEvent(
+                    type=event["type"],
+                    data={**event["data"], "pid": self._process.pid},
+                )
+            )
 
-            if not self.client_connected():
-                self._process.kill()
+    async def _send_output(
+        self, stream: str, output: bytes, is_input_prompt: bool = False
+    ) -> None:
+        entry = self._scrollback.append_output(stream, output, is_input_prompt)
+        if is_input_prompt:
+            self._prompt_seq = entry.seq
+        await self._pump()
+
+    async def _pump(self) -> None:
+        """Send the client every entry it has not been sent yet, in order."""
+        async with self._send_lock:
+            if not self._process or not self.client_connected():
+                return
+            assert self._client
+            for entry in self._scrollback.since(self._sent_seq):
+                self._sent_seq = entry.seq
+                await self._send_entry(self._client, self._process.pid, entry)
 
-            if self.subprocess_exited():
-                # Let the pipes clear...
-                await asyncio.gather(
-                    self._stdout_pipe_task,
-                    self._stderr_pipe_task,
+    async def _send_entry(self, client: WebSocket, pid: int, entry: Entry) -> None:
+        if entry.event:
+            await send_event(
+                client,
+                WebSocketEvent(
+                    type=entry.event.type, data={**entry.event.data, "seq": entry.seq}
+                ),
+            )
+            return
+        metrics.OUTPUT_FRAMES.inc(label=entry.stream)
+        metrics.OUTPUT_BYTES.inc(len(entry.data), entry.stream)
+        # Only the prompt the program is still waiting on asks for input; an
+        # answered prompt replayed from the scrollback is plain output.
+        is_input_prompt = entry.is_input_prompt and entry.seq == self._prompt_seq
+        await send_output(
+            client, entry.stream, pid, entry.data, is_input_prompt, entry.seq
+        )
+
+    async def _exit(self):
+        if not self._process:
+            return
+
+        returncode = await self._process.wait()
+        exited = time.perf_counter()
+        if self._usage_timer:
+            self._usage_timer.cancel()
+        if self._stdin:
+            await self._stdin.close()
+        # Let the pipes clear...
+        await asyncio.gather(
+            self._stdout_pipe_task,
+            self._stderr_pipe_task,
+            self._control_pipe_task,
+        )
+        await self._output.drain()
+        self.usage = {
+            "wall_seconds": exited - self._started,
+            **{
+                name: (self._usage or self._usage_sample or {}).get(name)
+                for name in USAGE_FIELDS
+            },
+            "stdout_bytes": self._output_bytes["STDOUT"],
+            "stderr_bytes": self._output_bytes["STDERR"],
+            "first_output_seconds": self._first_output,
+        }
+        if self._exception_report is not None:
+            # Sent whole, after all other output, and exempt from the output cap.
+            await self._send_output("STDERR", self._exception_report + b"\n")
+        if self._profile_report is not None:
+            await self.send_event(
+                WebSocketEvent(
+                    type="PROFILE",
+                    data={**self._profile_report, "pid": self._process.pid},
                 )
-                if self.client_connected():
-                    await self._client.send_text(
-                        WebSocketEvent(
-                            type="EXIT",
-                            data={
-                                "pid": self._process.pid,
-                                "returncode": self._process.returncode,
-                            },
-                        ).model_dump_json()
-                    )
-                break
+            )
+        if self._on_exit:
+            await self._on_exit(self, returncode)
+        metrics.RUN_EXIT_SECONDS.observe(time.perf_counter() - exited)
+        await self.send_event(
+            WebSocketEvent(
+                type="EXIT",
+                data={
+                    "pid": self._process.pid,
+                    "returncode": returncode,
+                    "usage": self.usage,
+                },
+            )
+        )
+
 
-            await asyncio.sleep(0.1)
+def _proc_usage(
+    pid: int, since: dict[str, Any] | None = None
+) -> dict[str, Any] | None:
+    """A live process's usage from /proc in the wrapper's terms, less what it had
+    used at `since`. Peak memory is the process's own peak, as the wrapper
+    reports it."""
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            # Fields after the parenthesized command name, from field 3 on.
+            fields = file.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/status") as file:
+            status = dict(line.split(":", 1) for line in file if ":" in line)
+    except (OSError, IndexError, ValueError):
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+    used = {
+        "user_seconds": int(fields[11]) / ticks,
+        "system_seconds": int(fields[12]) / ticks,
+        "max_rss_bytes": int(status.get("VmHWM", "0 kB").split()[0]) * 1024,
+        "voluntary_switches": int(status.get("voluntary_ctxt_switches", 0)),
+        "involuntary_switches": int(status.get("nonvoluntary_ctxt_switches", 0)),
+    }
+    for name, value in (since or {}).items():
+        if name != "max_rss_bytes":
+            used[name] -= value
+    return used
@@ -0,0 +1,185 @@
+"""Load test the web socket run server with simulated clients.
+
+Starts `server.main:app` under uvicorn in a child process, connects N simulated
+clients that run scripted workloads, and reports latency percentiles along with
+the server's CPU and resident memory. Results can be saved as a JSON baseline and
+later runs compared against it:
+
+    python -m server.bench --clients 30 --save bench_baseline.json
+    python -m server.bench --clients 30 --compare bench_baseline.json
+
+Comparing exits with status 1 if any p95 regressed by more than the tolerance.
+"""
+
+__author__ = "Kris Jordan <kris@cs.unc.edu>"
+__copyright__ = "Copyright 2024"
+__license__ = "MIT"
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+from .client import BenchClient, Results
+from .stats import ProcessSampler, summarize
+from .workloads import WORKLOADS, Workload, remove_workloads, write_workloads
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m server.bench")
+    parser.add_argument("--clients", type=int, default=10, help="simulated clients")
+    parser.add_argument(
+        "--rounds", type=int, default=1, help="workload rounds per client"
+    )
+    parser.add_argument(
+        "--workloads",
+        default=",".join(WORKLOADS),
+        help=f"comma separated subset of: {', '.join(WORKLOADS)}",
+    )
+    parser.add_argument("--port", type=int, default=0, help="port, default any free")
+    parser.add_argument("--save", type=Path, help="write results to this JSON file")
+    parser.add_argument("--compare", type=Path, help="compare p95s to this baseline")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="allowed p95 regression as a fraction of the baseline",
+    )
+    args = parser.parse_args()
+
+    workloads = [WORKLOADS[name] for name in args.workloads.split(",") if name]
+    results = asyncio.run(_benchmark(args.clients, args.rounds, workloads, args.port))
+    results["config"]["workloads"] = [workload.name for workload in workloads]
+    _print_results(results)
+
+    if args.save:
+        args.save.write_text(json.dumps(results, indent=2) + "\n")
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        regressions = _regressions(baseline, results, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+async def _benchmark(
+    clients: int, rounds: int, workloads: list[Workload], port: int
+) -> dict[str, Any]:
+    workspace = Path.cwd()
+    write_workloads(workspace)
+    port = port or _free_port()
+    server = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "-m",
+        "uvicorn",
+        "server.main:app",
+        "--port",
+        str(port),
+        "--log-level",
+        "warning",
+    )
+    sampler = ProcessSampler(server.pid)
+    try:
+        await _wait_for_port(port)
+        results = Results()
+        sampler.start()
+        started = time.monotonic()
+        await asyncio.gather(
+            *(
+                BenchClient(f"ws://127.0.0.1:{port}/ws", i, workspace, results).run(
+                    workloads, rounds
+                )
+                for i in range(clients)
+            )
+        )
+        elapsed = time.monotonic() - started
+    finally:
+        await sampler.stop()
+        server.terminate()
+        await server.wait()
+        remove_workloads(workspace)
+
+    metrics = {
+        f"{name}_ms": summarize(samples)
+        for name, samples in sorted(results.samples.items())
+    }
+    metrics["server_cpu_percent"] = summarize(sampler.cpu_percent)
+    metrics["server_rss_mb"] = summarize(sampler.rss_mb)
+    return {
+        "config": {
+            "clients": clients,
+            "rounds": rounds,
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "elapsed_seconds": elapsed,
+        "frames_per_second": results.frames / elapsed if elapsed else 0,
+        "errors": results.errors,
+        "metrics": metrics,
+    }
+
+
+def _regressions(
+    baseline: dict[str, Any], current: dict[str, Any], tolerance: float
+) -> list[str]:
+    """Metrics whose p95 grew past the tolerance, and a drop in frames per second."""
+    regressions = []
+    for name, summary in current["metrics"].items():
+        before = baseline["metrics"].get(name, {}).get("p95")
+        after = summary.get("p95")
+        if before and after is not None and after > before * (1 + tolerance):
+            regressions.append(f"{name} p95 {before:.1f} -> {after:.1f}")
+    before_fps = baseline.get("frames_per_second", 0)
+    if current["frames_per_second"] < before_fps * (1 - tolerance):
+        regressions.append(
+            f"frames_per_second {before_fps:.0f} -> {current['frames_per_second']:.0f}"
+        )
+    return regressions
+
+
+def _print_results(results: dict[str, Any]) -> None:
+    print(
+        f"{results['config']['clients']} clients, {results['elapsed_seconds']:.1f}s, "
+        f"{results['frames_per_second']:.0f} frames/s"
+    )
+    print(f"{'metric':<28}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for name, summary in results["metrics"].items():
+        if not summary["count"]:
+            continue
+        print(
+            f"{name:<28}{summary['count']:>8}"
+            + "".join(f"{summary[key]:>10.1f}" for key in ("p50", "p95", "p99", "max"))
+        )
+    for error in results["errors"]:
+        print(f"error: {error}")
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+async def _wait_for_port(port: int, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+if __name__ == "__main__":
+    main()
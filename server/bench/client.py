@@ -0,0 +1,143 @@
+"""A simulated student: one web socket connection sending scripted traffic."""
+
+__author__ = "Kris Jordan <kris@cs.unc.edu>"
+__copyright__ = "Copyright 2024"
+__license__ = "MIT"
+
+import asyncio
+import json
+from collections import defaultdict
+from pathlib import Path
+from typing import Any
+
+import websockets
+
+from .workloads import Workload
+
+RUN_TIMEOUT = 120.0
+"""Seconds a single run may take before the client gives up on it."""
+
+
+class Results:
+    """Latency samples in milliseconds by metric name, plus frame counts."""
+
+    def __init__(self) -> None:
+        self.samples: defaultdict[str, list[float]] = defaultdict(list)
+        self.frames = 0
+        self.errors: list[str] = []
+
+    def add(self, metric: str, seconds: float) -> None:
+        self.samples[metric].append(seconds * 1000)
+
+
+class BenchClient:
+    """Runs workloads one after another over a single connection."""
+
+    def __init__(self, url: str, index: int, workspace: Path, results: Results):
+        self._url = url
+        self._index = index
+        self._workspace = workspace
+        self._results = results
+        self._request_id = index * 1_000_000
+
+    async def run(self, workloads: list[Workload], rounds: int) -> None:
+        async with websockets.connect(self._url, max_size=None) as socket:
+            for _ in range(rounds):
+                await self._list_files(socket)
+                for workload in workloads:
+                    try:
+                        await asyncio.wait_for(
+                            self._run_workload(socket, workload), RUN_TIMEOUT
+                        )
+                    except asyncio.TimeoutError:
+                        self._results.errors.append(f"{workload.name}: timed out")
+
+    async def _receive(self, socket: Any) -> dict[str, Any]:
+        message = json.loads(await socket.recv())
+        self._results.frames += 1
+        return message
+
+    async def _list_files(self, socket: Any) -> None:
+        loop = asyncio.get_running_loop()
+        sent = loop.time()
+        await socket.send(json.dumps({"type": "LS", "data": {}}))
+        while (await self._receive(socket))["type"] != "LS":
+            ...
+        self._results.add("ls_latency", loop.time() - sent)
+
+    async def _run_workload(self, socket: Any, workload: Workload) -> None:
+        loop = asyncio.get_running_loop()
+        self._request_id += 1
+        request_id = self._request_id
+        sent = loop.time()
+        run = {"module": workload.module, "request_id": request_id}
+        await socket.send(json.dumps({"type": "RUN", "data": run}))
+
+        pid: int | None = None
+        first_output: float | None = None
+        last_frame = sent
+        inputs = 0
+        background: list[asyncio.Task[None]] = []
+        kill_sent: list[float] = []
+        try:
+            while True:
+                message = await self._receive(socket)
+                now = loop.time()
+                data = message.get("data", {})
+                match message["type"]:
+                    case "RUNNING" if data.get("request_id") == request_id:
+                        pid = data["pid"]
+                        self._results.add("spawn_latency", now - sent)
+                        if workload.kill_after is not None:
+                            background.append(
+                                asyncio.create_task(
+                                    self._kill_later(socket, pid, workload, kill_sent)
+                                )
+                            )
+                        if workload.file_saves:
+                            background.append(
+                                asyncio.create_task(self._save_storm(workload))
+                            )
+                    case "STDOUT" | "STDERR" if pid and data.get("pid") == pid:
+                        last_frame = now
+                        if first_output is None and message["type"] == "STDOUT":
+                            first_output = now
+                            self._results.add("first_stdout_latency", now - sent)
+                        if data.get("is_input_prompt") and inputs < workload.inputs:
+                            inputs += 1
+                            stdin = {"pid": pid, "data": str(inputs)}
+                            await socket.send(
+                                json.dumps({"type": "STDIN", "data": stdin})
+                            )
+                    case "EXIT" if pid and data.get("pid") == pid:
+                        exit_from = kill_sent[0] if kill_sent else last_frame
+                        self._results.add("exit_latency", now - exit_from)
+                        self._results.add("run_duration", now - sent)
+                        return
+        finally:
+            for task in background:
+                task.cancel()
+            await asyncio.gather(*background, return_exceptions=True)
+
+    async def _kill_later(
+        self, socket: Any, pid: int, workload: Workload, kill_sent: list[float]
+    ) -> None:
+        assert workload.kill_after is not None
+        await asyncio.sleep(workload.kill_after)
+        kill_sent.append(asyncio.get_running_loop().time())
+        await socket.send(json.dumps({"type": "KILL", "data": {"pid": pid}}))
+
+    async def _save_storm(self, workload: Workload) -> None:
+        """Save, then delete, files in the workspace as an editor would."""
+        directory = self._workspace / workload.module.partition(".")[0]
+        paths = [
+            directory / f"storm_{self._index}_{i}.py"
+            for i in range(workload.file_saves)
+        ]
+        try:
+            for i, path in enumerate(paths):
+                path.write_text(f"value = {i}\n")
+                await asyncio.sleep(0.01)
+        finally:
+            for path in paths:
+                path.unlink(missing_ok=True)
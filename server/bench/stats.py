@@ -0,0 +1,72 @@
+"""Latency percentiles and server process sampling for the benchmark."""
+
+__author__ = "Kris Jordan <kris@cs.unc.edu>"
+__copyright__ = "Copyright 2024"
+__license__ = "MIT"
+
+import asyncio
+import os
+
+PERCENTILES = (50, 95, 99)
+
+
+def summarize(samples: list[float]) -> dict[str, float]:
+    """Count, mean, and p50/p95/p99 of `samples`, using nearest-rank percentiles."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    summary = {"count": len(ordered), "mean": sum(ordered) / len(ordered)}
+    for percentile in PERCENTILES:
+        rank = max(0, -(-percentile * len(ordered) // 100) - 1)
+        summary[f"p{percentile}"] = ordered[rank]
+    summary["max"] = ordered[-1]
+    return summary
+
+
+class ProcessSampler:
+    """Samples a process's CPU utilization and resident memory from /proc."""
+
+    def __init__(self, pid: int, interval: float = 0.1):
+        self._pid = pid
+        self._interval = interval
+        self._ticks_per_second = os.sysconf("SC_CLK_TCK")
+        self._page_size = os.sysconf("SC_PAGE_SIZE")
+        self.cpu_percent: list[float] = []
+        self.rss_mb: list[float] = []
+        self._task: asyncio.Task[None] | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                ...
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        last_ticks, last_time = self._cpu_ticks(), loop.time()
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                ticks, now = self._cpu_ticks(), loop.time()
+                self.rss_mb.append(self._rss_bytes() / 1024 / 1024)
+            except OSError:
+                return
+            seconds = (ticks - last_ticks) / self._ticks_per_second
+            self.cpu_percent.append(100 * seconds / (now - last_time))
+            last_ticks, last_time = ticks, now
+
+    def _cpu_ticks(self) -> int:
+        with open(f"/proc/{self._pid}/stat") as stat:
+            # Fields after the parenthesized command name; utime and stime are
+            # the 14th and 15th fields of the whole line.
+            fields = stat.read().rpartition(")")[2].split()
+        return int(fields[11]) + int(fields[12])
+
+    def _rss_bytes(self) -> int:
+        with open(f"/proc/{self._pid}/statm") as statm:
+            return int(statm.read().split()[1]) * self._page_size
@@ -0,0 +1,91 @@
+"""Generated student programs the benchmark clients run.
+
+Workloads are written as modules of a throwaway package in the server's working
+directory, because the server runs modules by name from there. Each workload
+names its module source and the scripted traffic a client sends while it runs.
+"""
+
+__author__ = "Kris Jordan <kris@cs.unc.edu>"
+__copyright__ = "Copyright 2024"
+__license__ = "MIT"
+
+import shutil
+from dataclasses import dataclass
+from pathlib import Path
+
+PACKAGE = "_bench_workloads"
+"""Package the workload modules are written to."""
+
+
+@dataclass(frozen=True)
+class Workload:
+    """A program to RUN and how a client interacts with it."""
+
+    name: str
+    source: str
+    inputs: int = 0
+    """Input prompts the client answers with STDIN."""
+    kill_after: float | None = None
+    """Seconds after RUNNING the client sends KILL, if set."""
+    file_saves: int = 0
+    """Files the client saves in the workspace while the program runs."""
+
+    @property
+    def module(self) -> str:
+        return f"{PACKAGE}.{self.name}"
+
+
+WORKLOADS: dict[str, Workload] = {
+    workload.name: workload
+    for workload in (
+        Workload(
+            "hello",
+            'print("Hello, world!")\n',
+        ),
+        Workload(
+            "flood",
+            "for i in range(100_000):\n    print(f'line {i}')\n",
+        ),
+        Workload(
+            "input_heavy",
+            "total = 0\n"
+            "for i in range(20):\n"
+            "    total += int(input(f'Number {i}? '))\n"
+            "print(total)\n",
+            inputs=20,
+        ),
+        Workload(
+            "crash_locals",
+            "def explode(items, table):\n"
+            "    raise ValueError('boom')\n"
+            "items = list(range(2_000_000))\n"
+            "table = {str(i): [i] * 10 for i in range(50_000)}\n"
+            "explode(items, table)\n",
+        ),
+        Workload(
+            "spin_kill",
+            "while True:\n    pass\n",
+            kill_after=0.2,
+        ),
+        Workload(
+            "save_storm",
+            "import time\ntime.sleep(1.0)\nprint('saved')\n",
+            file_saves=50,
+        ),
+    )
+}
+"""Workloads by name."""
+
+
+def write_workloads(root: Path) -> Path:
+    """Write every workload module under `root` and return the package directory."""
+    package = root / PACKAGE
+    package.mkdir(exist_ok=True)
+    (package / "__init__.py").write_text("")
+    for workload in WORKLOADS.values():
+        (package / f"{workload.name}.py").write_text(workload.source)
+    return package
+
+
+def remove_workloads(root: Path) -> None:
+    shutil.rmtree(root / PACKAGE, ignore_errors=True)
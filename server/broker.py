@@ -0,0 +1,253 @@
+"""Broker fans events out to every worker process of the server.
+
+Each uvicorn worker keeps its own connections, interpreter pool, and running
+programs. The broker connects the workers so that state which is not theirs
+alone still reaches all of them:
+
+- File changes are watched by one worker, the leader, and published to all.
+- Diagnostics from the leader's precompiler are published to all.
+- KILL and STDIN for a pid a worker does not own are published, and the worker
+  running that pid applies them.
+- ATTACH for a pid a worker does not own is published too. The worker running
+  the pid sends the client's frames back as RELAY events through a
+  `RemoteClient`, and the worker holding the connection sends them on.
+
+`publish` delivers an event to every worker, the publishing worker included,
+in the order it was published.
+
+`InProcessBroker` serves a single worker and is always its leader. It is also a
+stand-in for testing. `UnixSocketBroker` connects workers on one node. The
+first worker to take the lock file becomes the leader and hosts a Unix socket
+that relays every event to every worker. When the leader exits, a surviving
+worker takes the lock and leads in its place.
+"""
+
+__author__ = "Kris Jordan <kris@cs.unc.edu>"
+__copyright__ = "Copyright 2024"
+__license__ = "MIT"
+
+import asyncio
+import base64
+import fcntl
+import os
+from typing import Callable, Coroutine
+from fastapi import WebSocket
+from starlette.websockets import WebSocketState
+
+from .web_socket_event import WebSocketEvent
+from . import config
+
+MessageHandler = Callable[[WebSocketEvent], Coroutine[None, None, None]]
+LeaderHandler = Callable[[], Coroutine[None, None, None]]
+
+LINE_LIMIT = 16 * 1024 * 1024
+"""Largest event relayed between workers, such as a burst of file changes."""
+
+
+class InProcessBroker:
+    """A broker for a single worker, which delivers events to itself."""
+
+    def __init__(self) -> None:
+        self.is_leader = False
+        self._on_message: MessageHandler | None = None
+
+    async def start(self, on_message: MessageHandler, on_leader: LeaderHandler) -> None:
+        """
+        Args:
+            on_message: Called with every published event.
+            on_leader: Called once when this worker becomes the leader.
+        """
+        self._on_message = on_message
+        self.is_leader = True
+        await on_leader()
+
+    async def publish(self, event: WebSocketEvent) -> None:
+        if self._on_message:
+            await self._on_message(event)
+
+    async def stop(self) -> None:
+        self._on_message = None
+
+
+class UnixSocketBroker:
+    """A broker for the workers on one node, relayed by the leader's Unix socket."""
+
+    def __init__(self, path: str, retry_interval: float = 0.1):
+        """
+        Args:
+            path: The socket path. Its lock file is the same path plus `.lock`.
+            retry_interval: Seconds between attempts to reach or become the leader.
+        """
+        self.is_leader = False
+        self._path = path
+        self._retry_interval = retry_interval
+        self._lock_fd: int | None = None
+        self._server: asyncio.AbstractServer | None = None
+        self._peers: set[asyncio.StreamWriter] = set()
+        self._leader: asyncio.StreamWriter | None = None
+        self._connected = asyncio.Event()
+        self._on_message: MessageHandler | None = None
+        self._on_leader: LeaderHandler | None = None
+        self._task: asyncio.Task[None] | None = None
+
+    async def start(self, on_message: MessageHandler, on_leader: LeaderHandler) -> None:
+        """Join the other workers, leading them if no other worker is.
+
+        Args:
+            on_message: Called with every published event.
+            on_leader: Called once when this worker becomes the leader.
+        """
+        self._on_message = on_message
+        self._on_leader = on_leader
+        self._task = asyncio.create_task(self._run())
+        await self._connected.wait()
+
+    async def publish(self, event: WebSocketEvent) -> None:
+        line = event.model_dump_json().encode() + b"\n"
+        if self.is_leader:
+            await self._relay(line)
+        elif self._leader:
+            try:
+                self._leader.write(line)
+                await self._leader.drain()
+            except Exception as e:
+                print(e)
+        else:
+            print(f"Broker: no leader, dropped {event.type}")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        for peer in list(self._peers):
+            peer.close()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            if os.path.exists(self._path):
+                os.unlink(self._path)
+        if self._leader:
+            self._leader.close()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+
+    async def _run(self) -> None:
+        """Follow the leader, and take over leading when it goes away."""
+        while True:
+            if self._try_lock():
+                await self._lead()
+                return
+            try:
+                reader, self._leader = await asyncio.open_unix_connection(
+                    self._path, limit=LINE_LIMIT
+                )
+            except OSError:
+                await asyncio.sleep(self._retry_interval)
+                continue
+            self._connected.set()
+            try:
+                await self._receive(reader)
+            finally:
+                self._leader.close()
+                self._leader = None
+
+    def _try_lock(self) -> bool:
+        fd = os.open(self._path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    async def _lead(self) -> None:
+        if os.path.exists(self._path):
+            os.unlink(self._path)  # Left behind by a leader that did not stop.
+        self._server = await asyncio.start_unix_server(
+            self._serve_peer, self._path, limit=LINE_LIMIT
+        )
+        self.is_leader = True
+        assert self._on_leader
+        await self._on_leader()
+        self._connected.set()
+
+    async def _serve_peer(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self._peers.add(writer)
+        try:
+            while line := await reader.readline():
+                await self._relay(line)
+        except Exception as e:
+            print(e)
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+    async def _relay(self, line: bytes) -> None:
+        """Send an event to every follower, then handle it here."""
+        for peer in list(self._peers):
+            peer.write(line)
+        await asyncio.gather(
+            *(peer.drain() for peer in list(self._peers)), return_exceptions=True
+        )
+        await self._deliver(line)
+
+    async def _receive(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while line := await reader.readline():
+                await self._deliver(line)
+        except Exception as e:
+            print(e)
+
+    async def _deliver(self, line: bytes) -> None:
+        assert self._on_message
+        try:
+            await self._on_message(WebSocketEvent.model_validate_json(line))
+        except Exception as e:
+            print(e)
+
+
+class RemoteClient:
+    """A client connected to another worker, standing in for its WebSocket.
+
+    Frames sent to it are published as RELAY events for the worker that holds
+    the connection, which sends them on with `relay`.
+    """
+
+    def __init__(self, connection: str, broker: "InProcessBroker | UnixSocketBroker"):
+        self.connection = connection
+        self.client_state = WebSocketState.CONNECTED
+        self._broker = broker
+
+    async def send_text(self, text: str) -> None:
+        await self._relay({"text": text})
+
+    async def send_bytes(self, data: bytes) -> None:
+        await self._relay({"bytes": base64.b64encode(data).decode()})
+
+    async def _relay(self, frame: dict[str, str]) -> None:
+        await self._broker.publish(
+            WebSocketEvent(type="RELAY", data={"connection": self.connection, **frame})
+        )
+
+
+def connection_id(client: WebSocket) -> str:
+    """Names a connection uniquely across the workers."""
+    return f"{os.getpid()}:{id(client)}"
+
+
+async def relay(client: WebSocket, event: WebSocketEvent) -> None:
+    """Send a frame another worker published for `client`."""
+    if "text" in event.data:
+        await client.send_text(event.data["text"])
+    else:
+        await client.send_bytes(base64.b64decode(event.data["bytes"]))
+
+
+def create_broker() -> InProcessBroker | UnixSocketBroker:
+    """The broker for the configured number of workers."""
+    if config.WORKERS > 1:
+        return UnixSocketBroker(config.BROKER_PATH)
+    return InProcessBroker()
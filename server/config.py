@@ -0,0 +1,130 @@
+"""Runtime configuration for the introductory programming web server.
+
+Settings are read once from environment variables when the server starts so that
+deployments can tune the server without code changes.
+"""
+
+__author__ = "Kris Jordan <kris@cs.unc.edu>"
+__copyright__ = "Copyright 2024"
+__license__ = "MIT"
+
+import os
+import tempfile
+
+
+def _env_int(name: str, default: int) -> int:
+    """Read an integer setting from the environment."""
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _env_list(name: str, default: tuple[str, ...]) -> tuple[str, ...]:
+    """Read a comma separated list setting from the environment."""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return tuple(item.strip() for item in value.split(",") if item.strip())
+
+
+IGNORED_DIRECTORIES = frozenset(
+    (
+        "node_modules",
+        ".git",
+        ".vscode",
+        ".devcontainer",
+        "__pycache__",
+        ".pytest_cache",
+        ".mypy_cache",
+    )
+)
+"""Directory names that are never listed, watched, or reported as changed."""
+
+INTERPRETER_POOL_SIZE = _env_int("COMP110_POOL_SIZE", 2)
+"""Number of idle, pre-started wrapper interpreters each worker keeps ready."""
+
+INTERPRETER_POOL_PRELOAD = _env_list("COMP110_POOL_PRELOAD", ())
+"""Modules idle interpreters import before waiting (e.g. numpy,pandas,matplotlib)."""
+
+OUTPUT_FLUSH_LATENCY = _env_int("COMP110_OUTPUT_FLUSH_MS", 25) / 1000
+"""Longest time program output waits to be merged into a single frame."""
+
+OUTPUT_FRAME_BYTES = _env_int("COMP110_OUTPUT_FRAME_BYTES", 64 * 1024)
+"""Pending output size that triggers a frame without waiting for the flush latency."""
+
+OUTPUT_CHUNK_BYTES = _env_int("COMP110_OUTPUT_CHUNK_BYTES", 64 * 1024)
+"""Most bytes read from a program's output pipe at once."""
+
+OUTPUT_MAX_BYTES = _env_int("COMP110_OUTPUT_MAX_BYTES", 8 * 1024 * 1024)
+"""Output a single run may forward before the rest is dropped."""
+
+CLIENT_QUEUE_SIZE = _env_int("COMP110_CLIENT_QUEUE_SIZE", 256)
+"""Notifications buffered per client before the oldest are dropped."""
+
+CLIENT_EVICT_AFTER = _env_int("COMP110_CLIENT_EVICT_AFTER_S", 10)
+"""Seconds a client may stay stuck on a single send before it is evicted."""
+
+FILE_EVENT_QUIET_PERIOD = _env_int("COMP110_FILE_EVENT_QUIET_MS", 100) / 1000
+"""File system changes are batched until no new change arrives for this long."""
+
+FILE_EVENT_MAX_DELAY = _env_int("COMP110_FILE_EVENT_MAX_DELAY_MS", 1000) / 1000
+"""Longest a batch of file system changes is held during a continuous burst."""
+
+CLIENT_MAX_IN_FLIGHT = _env_int("COMP110_CLIENT_MAX_IN_FLIGHT", 8)
+"""Requests from one client handled concurrently; control messages are exempt."""
+
+CLIENT_MAX_PENDING = _env_int("COMP110_CLIENT_MAX_PENDING", 64)
+"""Requests from one client handled or waiting before more are refused as BUSY;
+control messages are exempt."""
+
+WORKERS = _env_int("COMP110_WORKERS", 1)
+"""Server worker processes. More than one are connected by a Unix socket broker."""
+
+BROKER_PATH = os.environ.get("COMP110_BROKER_PATH") or os.path.join(
+    tempfile.gettempdir(), f"comp110-broker-{os.getppid()}.sock"
+)
+"""The Unix socket workers relay events through, unique to their parent process."""
+
+RUN_MAX_CONCURRENT = max(
+    1, _env_int("COMP110_RUN_MAX_CONCURRENT", os.cpu_count() or 1) // WORKERS
+)
+"""Programs running at once in each worker; further RUN requests wait in a fair
+queue. The setting is for the whole server and is divided among the workers."""
+
+RUN_CPU_SECONDS = _env_int("COMP110_RUN_CPU_SECONDS", 60)
+"""CPU time limit for each program, zero for unlimited."""
+
+RUN_MEMORY_BYTES = _env_int("COMP110_RUN_MEMORY_MB", 0) * 1024 * 1024
+"""Address space limit for each program, zero for unlimited. Unlimited by
+default because the limit counts address space reserved, not memory used, and
+numpy's BLAS threads alone can reserve gigabytes on a machine with many cores."""
+
+RUN_WALL_SECONDS = _env_int("COMP110_RUN_WALL_SECONDS", 900)
+"""Wall clock limit for each program, including time waiting on input."""
+
+RUN_DETACH_GRACE_SECONDS = _env_int("COMP110_RUN_DETACH_GRACE_S", 60)
+"""How long a program keeps running after its client disconnects, for the client
+to reconnect and ATTACH. Zero kills it on disconnect."""
+
+RUN_SCROLLBACK_BYTES = _env_int("COMP110_RUN_SCROLLBACK_KB", 1024) * 1024
+"""Recent output kept per program for clients that reattach."""
+
+RUN_STDIN_BUFFER_BYTES = _env_int("COMP110_RUN_STDIN_BUFFER_KB", 256) * 1024
+"""Input queued for a program that is not reading it before more is refused."""
+
+RESULT_CACHE_BYTES = _env_int("COMP110_RESULT_CACHE_MB", 64) * 1024 * 1024
+"""Output of recorded runs replayed to RUN requests that opt in, zero to disable."""
+
+RUN_HISTORY_SIZE = _env_int("COMP110_RUN_HISTORY", 1000)
+"""Finished programs kept, with their resource usage, for HISTORY requests."""
+
+TEST_WORKERS = _env_int("COMP110_TEST_WORKERS", min(4, os.cpu_count() or 1))
+"""pytest processes a single TEST request is split across."""
+
+PRECOMPILE_WORKERS = _env_int("COMP110_PRECOMPILE_WORKERS", 2)
+"""Processes compiling saved modules in the background, zero to disable."""
+
+STATIC_CACHE_BYTES = _env_int("COMP110_STATIC_CACHE_MB", 8) * 1024 * 1024
+"""Memory for the bodies of recently served static files."""
+
+STATIC_COMPRESS_MIN_BYTES = _env_int("COMP110_STATIC_COMPRESS_MIN_BYTES", 512)
+"""Static files smaller than this are not worth compressing."""
@@ -0,0 +1,2 @@
+collect_ignore = ["test_runner.py"]
+"""The TEST request's runner, not a test module."""
@@ -1,68 +1,267 @@
-import aiofiles.os
+import asyncio
+import time
+from typing import Any
 from fastapi import WebSocket
+from starlette.websockets import WebSocketState
 from server.web_socket_event import WebSocketEvent
-from .async_python_subprocess import AsyncPythonSubprocess
-from .models import NamespaceTree, Module, Package
+from .broker import RemoteClient, connection_id, create_broker, relay
+from .import_graph import ImportGraph
+from .interpreter_pool import InterpreterPool
+from .namespace_index import NamespaceIndex
+from .result_cache import ResultCache
+from .run_history import RunHistory
+from .run_scheduler import RunScheduler
+from .test_runner import TestRunner
+from .wire import Message, assign_encoding, encoding_for, send, send_event
+from . import config, metrics
 
-subprocesses: dict[int, AsyncPythonSubprocess] = {}
+interpreter_pool = InterpreterPool(
+    config.INTERPRETER_POOL_SIZE, config.INTERPRETER_POOL_PRELOAD
+)
+"""Pre-started wrapper interpreters used to answer RUN requests quickly."""
+
+result_cache = ResultCache(".")
+"""Recorded output of unchanged runs, replayed to RUN requests that opt in."""
+
+run_history = RunHistory()
+"""Finished programs and their resource usage, answering HISTORY requests."""
+
+run_scheduler = RunScheduler(interpreter_pool, result_cache, run_history)
+"""Admits RUN requests under resource limits and tracks the running programs."""
+
+broker = create_broker()
+"""Connects this worker process to the server's other workers."""
+
+namespace_index = NamespaceIndex(".")
+"""In-memory index of the workspace's packages and modules used to answer LS."""
+
+import_graph = ImportGraph(".")
+"""Which workspace modules import which, used to select the tests to run."""
+
+test_runner = TestRunner(import_graph)
+"""Runs the tests affected by recent changes for TEST requests."""
+
+_ls_responses: dict[tuple[str, str | None, int | None], tuple[int, Message]] = {}
+"""Encoded LS responses per encoding, path, and depth, and the index version each
+was built from."""
+
+LS_RESPONSES_CACHED = 256
+"""Distinct LS responses kept encoded before the cache is emptied."""
+
+ATTACH_TIMEOUT = 2.0
+"""Seconds to wait for another worker to answer an ATTACH for a pid it runs."""
+
+_connections: dict[str, WebSocket] = {}
+"""This worker's clients attached to programs on other workers, by connection id."""
+
+_attach_replies: dict[str, asyncio.Event] = {}
+"""Set when another worker first relays a frame to a connection attaching."""
+
+_remote_clients: dict[str, RemoteClient] = {}
+"""Clients of other workers attached to programs this worker runs."""
+
+_background: set[asyncio.Task[None]] = set()
 
 
 async def web_socket_controller(client: WebSocket, event: WebSocketEvent):
     response: WebSocketEvent
     match event.type:
         case "LS":
-            files = await list_files_async(".")
-            response = WebSocketEvent(type="LS", data={"files": files})
+            started = time.perf_counter()
+            await _list_files(
+                client,
+                event.data.get("since_version"),
+                event.data.get("path"),
+                event.data.get("depth"),
+            )
+            metrics.LS_SECONDS.observe(time.perf_counter() - started)
+            return
         case "RUN":
-            request_id = event.data["request_id"]
-            subprocess = AsyncPythonSubprocess(event.data["module"], client)
-            pid = await subprocess.start()
-            subprocesses[pid] = subprocess
-            response = WebSocketEvent(
-                type="RUNNING", data={"pid": pid, "request_id": request_id}
+            # The scheduler responds with QUEUED and/or RUNNING.
+            await run_scheduler.submit(
+                client,
+                event.data["module"],
+                event.data["request_id"],
+                event.data.get("cache", False),
+                _profile_options(event.data.get("profile")),
             )
+            return
         case "KILL":
-            pid = event.data["pid"]
-            if pid in subprocesses:
-                process = subprocesses[pid]
-                if process:
-                    process.kill()
+            if "pid" in event.data:
+                if not await _apply_to_process(event):
+                    # Another worker may be running it.
+                    await broker.publish(event)
+            elif "request_id" in event.data:
+                if not run_scheduler.cancel(client, event.data["request_id"]):
+                    test_runner.cancel(client, event.data["request_id"])
             return
         case "STDIN":
-            pid = event.data["pid"]
-            if pid in subprocesses:
-                process = subprocesses[pid]
-                if process:
-                    process.write(event.data["data"])
+            if not await _apply_to_process(event):
+                await broker.publish(event)
+            return
+        case "ATTACH":
+            await _attach(client, event.data["pid"], event.data.get("since", 0))
             return
+        case "TEST":
+            await test_runner.run(
+                client,
+                event.data.get("path", "."),
+                event.data["request_id"],
+                event.data.get("all", False),
+            )
+            return
+        case "HISTORY":
+            response = WebSocketEvent(
+                type="HISTORY",
+                data=run_history.query(
+                    event.data.get("module"), event.data.get("limit")
+                ),
+            )
+        case "POOL_STATS":
+            response = WebSocketEvent(
+                type="POOL_STATS",
+                data={**interpreter_pool.stats(), **run_scheduler.stats()},
+            )
         case _:
             response = WebSocketEvent(type="??", data={})
 
-    await client.send_text(response.model_dump_json())
-
-
-async def list_files_async(directory: str) -> NamespaceTree:
-    packages: list[Package | Module] = []
-    for entry in await aiofiles.os.scandir(directory):
-        if entry.is_file() and entry.name.endswith(".py"):
-            # If the entry is a .py file, create a Module object.
-            module = Module(name=entry.name, full_path=entry.path)
-            packages.append(module)
-        elif entry.is_dir():
-            if entry.name in (
-                "node_modules",
-                ".git",
-                ".vscode",
-                ".devcontainer",
-                "__pycache__",
-                ".pytest_cache",
-                ".mypy_cache",
+    await send_event(client, response)
+
+
+async def routed_event(event: WebSocketEvent) -> None:
+    """Apply an event routed between workers, if it concerns this worker."""
+    match event.type:
+        case "KILL" | "STDIN":
+            await _apply_to_process(event)
+        case "ATTACH":
+            connection = event.data["connection"]
+            remote = _remote_clients.get(connection) or RemoteClient(connection, broker)
+            assign_encoding(remote, event.data["encoding"])
+            if await run_scheduler.attach(
+                remote,  # type: ignore
+                event.data["pid"],
+                event.data["since"],
             ):
-                continue
-            tree = await list_files_async(entry.path)
-            package = Package(
-                children=tree.children, name=entry.name, full_path=entry.path
+                _remote_clients[connection] = remote
+        case "DETACH":
+            remote = _remote_clients.pop(event.data["connection"], None)
+            if remote:
+                remote.client_state = WebSocketState.DISCONNECTED
+                run_scheduler.disconnect(remote)  # type: ignore
+        case "RELAY":
+            client = _connections.get(event.data["connection"])
+            if client:
+                replied = _attach_replies.get(event.data["connection"])
+                if replied:
+                    replied.set()
+                await relay(client, event)
+
+
+async def _attach(client: WebSocket, pid: int, since: int) -> None:
+    """Resume a program's output from sequence number `since`, on whichever
+    worker runs it."""
+    if await run_scheduler.attach(client, pid, since):
+        return
+    if config.WORKERS > 1:
+        connection = connection_id(client)
+        _connections[connection] = client
+        replied = _attach_replies[connection] = asyncio.Event()
+        await broker.publish(
+            WebSocketEvent(
+                type="ATTACH",
+                data={
+                    "pid": pid,
+                    "since": since,
+                    "connection": connection,
+                    "encoding": encoding_for(client).name,
+                },
+            )
+        )
+        try:
+            await asyncio.wait_for(replied.wait(), ATTACH_TIMEOUT)
+            return
+        except asyncio.TimeoutError:
+            ...
+        finally:
+            _attach_replies.pop(connection, None)
+    await send_event(client, WebSocketEvent(type="ATTACH_FAILED", data={"pid": pid}))
+
+
+def _profile_options(value: Any) -> dict[str, Any] | None:
+    """RUN's `profile` option: true for the default profiler, or its options."""
+    if value is True:
+        return {}
+    return value if isinstance(value, dict) else None
+
+
+async def _apply_to_process(event: WebSocketEvent) -> bool:
+    """Apply KILL or STDIN to a process this worker runs. False if it runs elsewhere."""
+    process = run_scheduler.get(event.data["pid"])
+    if process is None:
+        return False
+    if event.type == "KILL":
+        process.kill()
+    else:
+        await process.write(event.data["data"])
+    return True
+
+
+def web_socket_disconnected(client: WebSocket) -> None:
+    """Drop a disconnected client's queued runs and detach its running processes,
+    here and on other workers, and kill its test runs."""
+    run_scheduler.disconnect(client)
+    test_runner.disconnect(client)
+    connection = connection_id(client)
+    if _connections.pop(connection, None):
+        task = asyncio.create_task(
+            broker.publish(
+                WebSocketEvent(type="DETACH", data={"connection": connection})
+            )
+        )
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+
+
+async def _list_files(
+    client: WebSocket, since: int | None, path: str | None, depth: int | None
+) -> None:
+    """Send the changes to the index since a version the client has, if they are
+    still known, and otherwise the index, or the package at `path`, to `depth`."""
+    changes = None if since is None else namespace_index.changes_since(since)
+    if changes is None:
+        await send(client, _ls_snapshot(client, path, depth))
+        return
+    response = WebSocketEvent(
+        type="LS_DELTA",
+        data={
+            "version": namespace_index.version,
+            "since_version": since,
+            "changes": changes,
+        },
+    )
+    await send_event(client, response)
+
+
+def _ls_snapshot(client: WebSocket, path: str | None, depth: int | None) -> Message:
+    """An LS response, encoded once per version of the index. `files` is None if
+    there is no package at `path`."""
+    encoding = encoding_for(client)
+    key = (encoding.name, path, depth)
+    version, message = _ls_responses.get(key, (-1, ""))
+    if version != namespace_index.version:
+        # The tree is already plain data, so it is not validated again.
+        message = encoding.encode(
+            WebSocketEvent.model_construct(
+                type="LS",
+                data={
+                    "files": namespace_index.tree(path, depth),
+                    "path": path,
+                    "depth": depth,
+                    "version": namespace_index.version,
+                },
             )
-            packages.append(package)
-    packages.sort(key=lambda o: o.name)
-    return NamespaceTree(children=packages)
+        )
+        if len(_ls_responses) >= LS_RESPONSES_CACHED:
+            _ls_responses.clear()
+        _ls_responses[key] = (namespace_index.version, message)
+    return message
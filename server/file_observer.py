@@ -1,104 +1,274 @@
 """FileObserver watches the file system for changes and makes asyncio callbacks.
 
-It specifically is looking for changes to .py files and ignores directory changes
-to some common project directories we can ignore (e.g. __pycache__, .pytest_cache, .git)
+It specifically is looking for changes to .py files and to directories, ignoring
+common project directories we can ignore (e.g. __pycache__, .pytest_cache, .git).
+Heavy ignored directories such as .git and node_modules are pruned from the watch
+itself, so their events are never generated in the first place.
 
-It uses a TTLCache to prevent duplicate events within half a second of each other.
+Changes are debounced on the trailing edge: raw events are gathered until no new
+event has arrived for a quiet period, then delivered as one `files_changed` event.
+The batch is deduplicated per path. A created-then-deleted path cancels out, a
+deleted-then-created path becomes a modification, and chains of moves are folded
+into one move. A continuous burst is still delivered at least once per max delay.
 
 Because watchdog is not asyncio compatible, we run it in a separate thread and
-use run_coroutine_threadsafe to call the callback.
+hop to the event loop once per batch with call_soon_threadsafe.
 """
 
 __author__ = "Kris Jordan <kris@cs.unc.edu>"
 __copyright__ = "Copyright 2023"
 __license__ = "MIT"
 
-import re
+import os
 import asyncio
-import cachetools
+import threading
 import time
-from typing import Callable, Coroutine
+from typing import Any, Callable, Coroutine
 from watchdog.observers import Observer
-from watchdog.observers.api import BaseObserver
+from watchdog.observers.api import BaseObserver, ObservedWatch
 from watchdog.events import FileSystemEventHandler, FileSystemEvent
 from .web_socket_event import WebSocketEvent
+from . import config, metrics
 
 NotifierFn = Callable[[WebSocketEvent], Coroutine[None, None, None]]
 
+_CACHE_DIRECTORIES = frozenset(("__pycache__", ".pytest_cache", ".mypy_cache"))
+"""Ignored directories small enough to leave inside a recursive watch."""
 
-def FileObserver(path: str, notifier: NotifierFn) -> BaseObserver:
+_UNWATCHED_DIRECTORIES = config.IGNORED_DIRECTORIES - _CACHE_DIRECTORIES
+"""Ignored directories pruned from the watch itself."""
+
+
+def FileObserver(
+    path: str,
+    notifier: NotifierFn,
+    quiet_period: float = config.FILE_EVENT_QUIET_PERIOD,
+    max_delay: float = config.FILE_EVENT_MAX_DELAY,
+) -> BaseObserver:
     """Create a file observer that watches for changes to .py files.
 
     Args:
         path: The path to watch for changes.
-        notifier: The aysnc function to call when a change is detected.
+        notifier: The aysnc function to call with each batch of changes.
+        quiet_period: Seconds without new changes before a batch is delivered.
+        max_delay: Longest a batch is held while changes keep arriving.
 
     Returns:
         A watchdog observer instance that has started. It is the caller's responsibility
         to call stop() on the observer when it is no longer needed."""
     observer = Observer()
-    event_handler = _FileChangeHandler(notifier, asyncio.get_running_loop())
-    observer.schedule(event_handler, path, recursive=True)
+    event_handler = _FileChangeHandler(
+        notifier, asyncio.get_running_loop(), observer, quiet_period, max_delay
+    )
+    event_handler.watch(path)
     observer.start()
     return observer
 
 
 class _FileChangeHandler(FileSystemEventHandler):
-    def __init__(self, notifier: NotifierFn, loop: asyncio.AbstractEventLoop):
+    def __init__(
+        self,
+        notifier: NotifierFn,
+        loop: asyncio.AbstractEventLoop,
+        observer: BaseObserver,
+        quiet_period: float,
+        max_delay: float,
+    ):
         self._notify_func = notifier
         self._loop = loop
-        self._file_pattern = re.compile(r".*\.py$")
-        self._directory_anti_pattern = re.compile(
-            r".*(__pycache__|\.pytest_cache|\.git).*"
-        )
-        self._cache: cachetools.TTLCache[str, float] = cachetools.TTLCache(
-            maxsize=1000, ttl=0.5
+        self._observer = observer
+        self._quiet_period = quiet_period
+        self._max_delay = max_delay
+        self._watches: dict[str, ObservedWatch] = {}
+        self._lock = threading.Lock()
+        self._pending: list[FileSystemEvent] = []
+        self._first_event_time = 0.0
+        self._last_event_time = 0.0
+        self._flush_scheduled = False
+        self._notify_tasks: set[asyncio.Task[None]] = set()
+
+    def watch(self, path: str) -> None:
+        """Watch a directory tree, pruning unwatched directories from the watch.
+
+        A subtree without unwatched directories gets one recursive watch. A
+        directory containing one is watched on its own and its children are
+        planned individually."""
+        if _contains_unwatched(path):
+            self._schedule(path, recursive=False)
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir() and entry.name not in config.IGNORED_DIRECTORIES:
+                        self.watch(entry.path)
+        else:
+            self._schedule(path, recursive=True)
+
+    def on_any_event(self, event: FileSystemEvent):
+        metrics.FILE_EVENTS_RECEIVED.inc()
+        if event.event_type not in ("created", "modified", "moved", "deleted"):
+            return
+        if not self._event_filter(event):
+            return
+        if event.is_directory and event.event_type != "modified":
+            self._update_watches(event)
+
+        now = time.monotonic()
+        with self._lock:
+            self._pending.append(event)
+            self._last_event_time = now
+            if self._flush_scheduled:
+                return
+            self._first_event_time = now
+            self._flush_scheduled = True
+        self._loop.call_soon_threadsafe(
+            self._loop.call_later, self._quiet_period, self._flush
         )
 
-    def _event_filter(self, event: FileSystemEvent):
-        current_time = time.time()
-        last_time: float | None = self._cache.get(event.src_path)
-        if last_time is not None and current_time - last_time < self._cache.ttl:
-            return False
+    def _event_filter(self, event: FileSystemEvent) -> bool:
+        paths = [event.src_path, getattr(event, "dest_path", "") or ""]
+        for path in paths:
+            if path and not _is_ignored(path):
+                if event.is_directory or path.endswith(".py"):
+                    return True
+        return False
 
-        if self._file_pattern.match(event.src_path):
-            self._cache[event.src_path] = current_time
-            return True
-        elif event.is_directory and not self._directory_anti_pattern.match(
-            event.src_path
-        ):
-            self._cache[event.src_path] = current_time
-            return True
+    def _flush(self) -> None:
+        """Deliver pending changes once they have been quiet for a full period."""
+        now = time.monotonic()
+        with self._lock:
+            quiet_for = now - self._last_event_time
+            waited = now - self._first_event_time
+            if quiet_for < self._quiet_period and waited < self._max_delay:
+                delay = min(self._quiet_period - quiet_for, self._max_delay - waited)
+                self._loop.call_later(delay, self._flush)
+                return
+            events, self._pending = self._pending, []
+            self._flush_scheduled = False
+
+        changes = _coalesce(events)
+        if changes:
+            metrics.FILE_EVENTS_FORWARDED.inc(len(changes))
+            ws_event = WebSocketEvent(type="files_changed", data={"changes": changes})
+            task = self._loop.create_task(self._notify_func(ws_event))
+            self._notify_tasks.add(task)
+            task.add_done_callback(self._notify_tasks.discard)
+
+    def _update_watches(self, event: FileSystemEvent) -> None:
+        """Keep pruned watches current as directories come and go."""
+        if event.event_type in ("deleted", "moved"):
+            self._unschedule_tree(event.src_path)
+        if event.event_type in ("created", "moved"):
+            path = event.dest_path if event.event_type == "moved" else event.src_path
+            if _is_ignored(path) or self._is_watched(path):
+                return
+            try:
+                self.watch(path)
+            except OSError:
+                ...
+
+    def _is_watched(self, path: str) -> bool:
+        """Whether a recursive watch already covers `path`."""
+        path = os.path.normpath(path)
+        for watched, watch in self._watches.items():
+            watched = os.path.normpath(watched)
+            if watch.is_recursive and path.startswith(watched + os.sep):
+                return True
         return False
 
-    def on_created(self, event: FileSystemEvent):
-        if self._event_filter(event):
-            type = "directory" if event.is_directory else "file"
-            ws_event = WebSocketEvent(
-                type=f"{type}_created", data={"path": event.src_path}
-            )
-            asyncio.run_coroutine_threadsafe(self._notify_func(ws_event), self._loop)
-
-    def on_modified(self, event: FileSystemEvent):
-        if self._event_filter(event):
-            type = "directory" if event.is_directory else "file"
-            ws_event = WebSocketEvent(
-                type=f"{type}_modified", data={"path": event.src_path}
-            )
-            asyncio.run_coroutine_threadsafe(self._notify_func(ws_event), self._loop)
-
-    def on_moved(self, event: FileSystemEvent):
-        if self._event_filter(event):
-            type = "directory" if event.is_directory else "file"
-            ws_event = WebSocketEvent(
-                type=f"{type}_moved", data={"path": event.src_path}
-            )
-            asyncio.run_coroutine_threadsafe(self._notify_func(ws_event), self._loop)
-
-    def on_deleted(self, event: FileSystemEvent):
-        if self._event_filter(event):
-            type = "directory" if event.is_directory else "file"
-            ws_event = WebSocketEvent(
-                type=f"{type}_deleted", data={"path": event.src_path}
-            )
-            asyncio.run_coroutine_threadsafe(self._notify_func(ws_event), self._loop)
+    def _schedule(self, path: str, recursive: bool) -> None:
+        self._watches[path] = self._observer.schedule(self, path, recursive=recursive)
+
+    def _unschedule_tree(self, path: str) -> None:
+        path = os.path.normpath(path)
+        for watched in list(self._watches):
+            normalized = os.path.normpath(watched)
+            if normalized == path or normalized.startswith(path + os.sep):
+                try:
+                    self._observer.unschedule(self._watches.pop(watched))
+                except KeyError:
+                    ...
+
+
+def _is_ignored(path: str) -> bool:
+    return any(part in config.IGNORED_DIRECTORIES for part in path.split(os.sep))
+
+
+def _contains_unwatched(path: str) -> bool:
+    """Whether any directory beneath `path` must be pruned from a watch."""
+    for _, directories, _ in os.walk(path):
+        if any(name in _UNWATCHED_DIRECTORIES for name in directories):
+            return True
+        directories[:] = [d for d in directories if d not in _CACHE_DIRECTORIES]
+    return False
+
+
+def is_directory_change(change: dict[str, Any]) -> bool:
+    """Whether a change in a `files_changed` event is to a directory."""
+    return change["type"].startswith("directory_")
+
+
+def _change(action: str, event: FileSystemEvent, path: str) -> dict[str, Any]:
+    kind = "directory" if event.is_directory else "file"
+    return {"type": f"{kind}_{action}", "path": path}
+
+
+def _in_view(event: FileSystemEvent, path: str) -> bool:
+    """Whether a moved event's path is one changes are reported for."""
+    return not _is_ignored(path) and (event.is_directory or path.endswith(".py"))
+
+
+def _action(change: dict[str, Any]) -> str:
+    return change["type"].rsplit("_", 1)[1]
+
+
+def _coalesce(events: list[FileSystemEvent]) -> list[dict[str, Any]]:
+    """Reduce raw events to at most one change per path, in order of last change.
+
+    Moves are keyed by their destination and keep their original source path."""
+    changes: dict[str, dict[str, Any]] = {}
+    for event in events:
+        src = event.src_path
+        match event.event_type:
+            case "created":
+                previous = changes.pop(src, None)
+                if previous and _action(previous) == "deleted":
+                    changes[src] = _change("modified", event, src)
+                else:
+                    changes[src] = _change("created", event, src)
+            case "modified":
+                previous = changes.get(src)
+                if previous is None or _action(previous) == "deleted":
+                    changes.pop(src, None)
+                    changes[src] = _change("modified", event, src)
+            case "deleted":
+                previous = changes.pop(src, None)
+                if previous is None or _action(previous) in ("modified", "deleted"):
+                    changes[src] = _change("deleted", event, src)
+                elif _action(previous) == "moved":
+                    origin = previous["path"]
+                    changes.pop(origin, None)
+                    changes[origin] = _change("deleted", event, origin)
+            case "moved":
+                dest = event.dest_path
+                if not _in_view(event, dest):
+                    # Moved out of view, e.g. renamed to a non-Python file.
+                    changes.pop(src, None)
+                    changes[src] = _change("deleted", event, src)
+                    continue
+                if not _in_view(event, src):
+                    # Moved into view, e.g. an editor's temporary file saved in place.
+                    changes.pop(dest, None)
+                    changes[dest] = _change("created", event, dest)
+                    continue
+                previous = changes.pop(src, None)
+                changes.pop(dest, None)
+                if previous and _action(previous) == "created":
+                    changes[dest] = _change("created", event, dest)
+                elif previous and _action(previous) == "moved":
+                    origin = previous["path"]
+                    if origin == dest:
+                        changes[dest] = _change("modified", event, dest)
+                    else:
+                        changes[dest] = {**previous, "dest_path": dest}
+                else:
+                    changes[dest] = {**_change("moved", event, src), "dest_path": dest}
+    return list(changes.values())
@@ -1,4 +1,4 @@
-import {useState, useEffect, useCallback, PropsWithChildren} from 'react';
+import {useState, useEffect, useRef, PropsWithChildren} from 'react';
 import useWebSocket, { ReadyState } from './useWebSocket';
 import { Message, parseJsonMessage } from './Message';
 
@@ -12,6 +12,7 @@ export interface Package {
     name: string
     full_path: string
     children: (Package | Module)[];
+    collapsed?: boolean
 }
 
 export interface Module {
@@ -20,6 +21,27 @@ export interface Module {
     full_path: string
 }
 
+/** Packages below this depth are listed when they are opened. */
+const LIST_DEPTH = 1;
+
+function replacePackage(tree: Tree | Package, listed: Package): Tree | Package {
+    return {
+        ...tree,
+        children: tree.children.map((item) => {
+            if (item.ns_type !== 'package') {
+                return item;
+            }
+            if (item.full_path === listed.full_path) {
+                return listed;
+            }
+            if (listed.full_path.startsWith(item.full_path + '/')) {
+                return replacePackage(item, listed) as Package;
+            }
+            return item;
+        }),
+    };
+}
+
 interface NamespaceTreeProps {
     selectModule: (module: Module) => void;
 }
@@ -27,16 +49,37 @@ interface NamespaceTreeProps {
 function NamespaceTree(props: PropsWithChildren<NamespaceTreeProps>) {
     const { lastMessage, readyState, sendJsonMessage } = useWebSocket();
     const [files, setFiles] = useState<Tree>({ns_type: 'tree', children: []});
+    const opened = useRef<Set<string>>(new Set());
+
+    const list = (path: string) => {
+        sendJsonMessage({ type: "LS", data: { path, depth: LIST_DEPTH } });
+    };
+
+    const listAll = () => {
+        list("/");
+        for (let path of opened.current) {
+            list(path);
+        }
+    };
 
     useEffect(() => {
         let message = parseJsonMessage(lastMessage);
         if (message) {
             switch(message.type) {
                 case 'LS':
-                    setFiles(message.data.files);
+                    if (message.data.path === "/") {
+                        setFiles(message.data.files);
+                    } else if (message.data.files) {
+                        const listed: Package = message.data.files;
+                        setFiles((files) => replacePackage(files, listed) as Tree);
+                    } else {
+                        opened.current.delete(message.data.path);
+                    }
                     break;
-                case 'directory_modified':
-                    sendJsonMessage({ type: "LS", data: { path: "/" }});
+                case 'files_changed':
+                    if (message.data.changes.some((change: { type: string }) => change.type !== 'file_modified')) {
+                        listAll();
+                    }
                     break;
             }
         }
@@ -44,10 +87,21 @@ function NamespaceTree(props: PropsWithChildren<NamespaceTreeProps>) {
 
     useEffect(() => {
         if (readyState === ReadyState.OPEN) {
-            sendJsonMessage({ type: "LS", data: { path: "/" } });
+            listAll();
         }
     }, [readyState]);
 
+    const toggle = (item: Package, open: boolean) => {
+        if (!open) {
+            opened.current.delete(item.full_path);
+        } else if (!opened.current.has(item.full_path)) {
+            opened.current.add(item.full_path);
+            if (item.collapsed) {
+                list(item.full_path);
+            }
+        }
+    };
+
     let buildTree = (tree: { children: (Module | Package)[] }) => {
       let children = [];
       for (let item of tree.children) {
@@ -56,7 +110,7 @@ function NamespaceTree(props: PropsWithChildren<NamespaceTreeProps>) {
                   children.push(<li key={item.full_path + item.name} onClick={() => props.selectModule(item as Module)}><a>{item.name}</a></li>);
                   break;
               case 'package':
-                  children.push(<li key={item.full_path + item.name}><details><summary><a>{item.name}</a></summary>{buildTree(item)}</details></li>)
+                  children.push(<li key={item.full_path + item.name}><details open={opened.current.has(item.full_path)} onToggle={(e) => toggle(item as Package, (e.target as HTMLDetailsElement).open)}><summary><a>{item.name}</a></summary>{buildTree(item)}</details></li>)
                   break;
           }
       }
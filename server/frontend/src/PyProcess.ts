@@ -1,7 +1,8 @@
 export enum PyProcessState {
     STARTING = 0,
     RUNNING = 1,
-    EXITED = 2
+    EXITED = 2,
+    QUEUED = 3
 }
 
 export interface PyProcess {
@@ -9,4 +10,5 @@ export interface PyProcess {
     module: string;
     requestId: number;
     pid?: number;
+    queuePosition?: number;
 }
\ No newline at end of file
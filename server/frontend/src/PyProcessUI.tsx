@@ -1,10 +1,21 @@
-import React, { PropsWithChildren, useCallback, useEffect, useState } from "react";
+import React, { PropsWithChildren, useCallback, useEffect, useRef, useState } from "react";
 import { PyProcess, PyProcessState } from "./PyProcess";
-import useWebSocket from "./useWebSocket";
+import useWebSocket, { ReadyState } from "./useWebSocket";
 import { parseJsonMessage } from "./Message";
 import { StdErrMessage } from "./StdErrMessage";
 import { StdOutGroupContainer } from "./StdOutGroupContainer";
-import { StdIn, StdOutGroup, StdIO } from "./StdIOTypes";
+import { StdErr, StdIn, StdOut, StdOutGroup, StdIO, visibleLine } from "./StdIOTypes";
+
+/* Output arrives in frames that may hold many lines, or end partway through one.
+   Split a frame into lines, continuing `openLine` if the previous frame left one. */
+function splitLines(data: string, openLine?: string): { lines: string[], open: boolean } {
+    const lines = ((openLine ?? '') + data).split('\n');
+    const open = lines[lines.length - 1] !== '';
+    if (!open) {
+        lines.pop();
+    }
+    return { lines, open };
+}
 
 interface PyProcessUIProps {
     pyProcess: PyProcess
@@ -15,11 +26,25 @@ export function PyProcessUI(props: PropsWithChildren<PyProcessUIProps>) {
     const [pyProcess, setPyProcess] = useState(props.pyProcess);
     const [stdio, setStdIO] = useState<StdIO[]>([]);
     const [stdinValue, setStdinValue] = useState<string>("");
+    const lastSeq = useRef(0);
+    const disconnected = useRef(false);
 
     useEffect(() => {
         let message = parseJsonMessage(lastMessage);
         if (message) {
+            if (message.data.pid === pyProcess.pid && typeof message.data.seq === 'number') {
+                lastSeq.current = message.data.seq;
+            }
             switch (message.type) {
+                case 'QUEUED':
+                    if (message.data.request_id === pyProcess.requestId) {
+                        setPyProcess(prev => {
+                            prev.queuePosition = message?.data.position;
+                            prev.state = PyProcessState.QUEUED;
+                            return prev;
+                        });
+                    }
+                    break;
                 case 'RUNNING':
                     if (message.data.request_id === pyProcess.requestId) {
                         setPyProcess(prev => {
@@ -31,21 +56,34 @@ export function PyProcessUI(props: PropsWithChildren<PyProcessUIProps>) {
                     break;
                 case 'STDOUT':
                     if (!message.data.is_input_prompt) {
+                        const data: string = message.data.data;
                         setStdIO((prev) => {
                             let time = Date.now();
                             let prevLine = prev[prev.length - 1];
 
                             if (prevLine?.type === 'stdout_group') {
+                                const children = [...prevLine.children];
+                                const last = children[children.length - 1];
+                                const split = splitLines(data, last?.open ? children.pop()?.line : undefined);
+                                const lines: StdOut[] = split.lines.map(line => ({ type: 'stdout', line }));
+                                if (split.open) {
+                                    lines[lines.length - 1].open = true;
+                                }
                                 let updatedGroup: StdOutGroup = {
                                     type: 'stdout_group',
-                                    children: [...prevLine.children, { type: 'stdout', line: message?.data.data }],
+                                    children: [...children, ...lines],
                                     startTime: prevLine.startTime,
                                     endTime: time
                                 }
                                 return [...(prev.slice(0, -1)), updatedGroup];
                             }
 
-                            return prev.concat({ type: 'stdout_group', children: [{ type: 'stdout', line: message?.data.data }], endTime: time, startTime: time });
+                            const split = splitLines(data);
+                            const lines: StdOut[] = split.lines.map(line => ({ type: 'stdout', line }));
+                            if (split.open) {
+                                lines[lines.length - 1].open = true;
+                            }
+                            return prev.concat({ type: 'stdout_group', children: lines, endTime: time, startTime: time });
                         });
                     } else {
                         setStdIO((prev) => prev.concat({ type: 'stdin', prompt: message?.data.data }))
@@ -53,7 +91,36 @@ export function PyProcessUI(props: PropsWithChildren<PyProcessUIProps>) {
                     break;
                 case 'STDERR':
                     if (!message.data.is_input_prompt) {
-                        setStdIO((prev) => prev.concat({ type: 'stderr', line: message?.data.data }))
+                        const data: string = message.data.data;
+                        setStdIO((prev) => {
+                            let prevLine = prev[prev.length - 1];
+                            let openLine: string | undefined = undefined;
+                            if (prevLine?.type === 'stderr' && prevLine.open) {
+                                openLine = prevLine.line;
+                                prev = prev.slice(0, -1);
+                            }
+                            const split = splitLines(data, openLine);
+                            const lines: StdErr[] = split.lines.map(line => ({ type: 'stderr', line }));
+                            if (split.open) {
+                                lines[lines.length - 1].open = true;
+                            }
+                            return prev.concat(lines);
+                        });
+                    }
+                    break;
+                case 'LIMIT_EXCEEDED':
+                    if (message.data.pid === pyProcess.pid) {
+                        const line = `Stopped: ${message.data.limit} limit of ${message.data.value} exceeded`;
+                        setStdIO((prev) => prev.concat({ type: 'stderr', line }));
+                    }
+                    break;
+                case 'ATTACH_FAILED':
+                    if (message.data.pid === pyProcess.pid) {
+                        setStdIO((prev) => prev.concat({ type: 'stderr', line: 'Lost connection to the program' }));
+                        setPyProcess(prev => {
+                            prev.state = PyProcessState.EXITED;
+                            return prev;
+                        })
                     }
                     break;
                 case 'EXIT':
@@ -68,11 +135,25 @@ export function PyProcessUI(props: PropsWithChildren<PyProcessUIProps>) {
         }
     }, [lastMessage, pyProcess]);
 
+    useEffect(() => {
+        // Resume the program's output after reconnecting, from the last frame seen.
+        if (readyState !== ReadyState.OPEN) {
+            disconnected.current = true;
+        } else if (disconnected.current) {
+            disconnected.current = false;
+            if (pyProcess.state === PyProcessState.RUNNING && pyProcess.pid) {
+                sendJsonMessage({ type: "ATTACH", data: { pid: pyProcess.pid, since: lastSeq.current } });
+            }
+        }
+    }, [readyState]);
+
     useEffect(() => {
         // This is clean-up only...
         return () => {
             if (pyProcess.state !== PyProcessState.EXITED && pyProcess.pid) {
                 sendJsonMessage({ type: "KILL", data: { pid: pyProcess.pid } })
+            } else if (pyProcess.state === PyProcessState.QUEUED) {
+                sendJsonMessage({ type: "KILL", data: { request_id: pyProcess.requestId } })
             }
         };
     }, [pyProcess])
@@ -82,6 +163,9 @@ export function PyProcessUI(props: PropsWithChildren<PyProcessUIProps>) {
         case PyProcessState.STARTING:
             status = 'Starting...';
             break;
+        case PyProcessState.QUEUED:
+            status = `Waiting to run (#${pyProcess.queuePosition} in line)...`;
+            break;
         case PyProcessState.RUNNING:
             status = 'Running';
             break;
@@ -132,7 +216,7 @@ export function PyProcessUI(props: PropsWithChildren<PyProcessUIProps>) {
                         </p>
                     }
                 case 'stderr':
-                    return <StdErrMessage key={idx} line={line.line} />;
+                    return <StdErrMessage key={idx} line={visibleLine(line.line)} />;
                 case 'stdout_group':
                     return <StdOutGroupContainer key={idx} group={line} minGroupSize={10} groupAfterRatePerSecond={10} />
             }
@@ -28,8 +28,23 @@ function valueToJSX(value: any): JSX.Element {
         if (value instanceof Array) {
             return <span>{JSON.stringify(value)}</span>
         } else if (value instanceof Object && value.hasOwnProperty('type')) {
+            /* Summaries of values too large or too deep to send in full. */
+            let size = '';
+            if (value.shape) {
+                size = ` ${value.shape.join('×')}`;
+            } else if (value.length !== undefined) {
+                size = ` of ${value.length}`;
+            }
+            let detail: JSX.Element = <span>Object (See in Debugger)</span>;
+            if (value.preview !== undefined) {
+                detail = <span>{valueToJSX(value.preview)} ...</span>;
+            } else if (value.fields !== undefined) {
+                detail = valueToJSX(value.fields);
+            } else if (value.repr !== undefined || value.name !== undefined) {
+                detail = <span>{value.repr ?? value.name}</span>;
+            }
             return <div>
-                <div><strong>{value.type}</strong> Object (See in Debugger)</div>
+                <div><strong>{value.type}</strong>{size} {detail}</div>
             </div>
         }
     }
@@ -1,11 +1,14 @@
+/* `open` lines have not seen their newline yet; the next output continues them. */
 export type StdOut = {
     type: 'stdout';
     line: string;
+    open?: boolean;
 }
 
 export type StdErr = {
     type: 'stderr';
     line: string;
+    open?: boolean;
 }
 
 export type StdIn = {
@@ -21,4 +24,15 @@ export type StdOutGroup = {
     startTime: number;
 }
 
-export type StdIO = StdErr | StdIn | StdOutGroup;
\ No newline at end of file
+export type StdIO = StdErr | StdIn | StdOutGroup;
+
+/* The visible text of a line: a carriage return starts it over, as in a terminal. */
+export function visibleLine(line: string): string {
+    const segments = line.split('\r');
+    for (let i = segments.length - 1; i > 0; i--) {
+        if (segments[i] !== '') {
+            return segments[i];
+        }
+    }
+    return segments[0];
+}
@@ -1,5 +1,5 @@
 import { PropsWithChildren, useState } from "react";
-import { StdOutGroup, StdOut } from "./StdIOTypes";
+import { StdOutGroup, StdOut, visibleLine } from "./StdIOTypes";
 
 interface StdOutProps {
     group: StdOutGroup,
@@ -18,7 +18,7 @@ export function StdOutGroupContainer(props: PropsWithChildren<StdOutProps>) {
         && (lines.length / (stdoutGroup.endTime - stdoutGroup.startTime)) > convertedRatePerMS;
 
     function stdOutLine(childLine: StdOut, idx: number) {
-        return <p key={idx}>{childLine.line}</p>
+        return <p key={idx}>{visibleLine(childLine.line)}</p>
     };
 
     return <>
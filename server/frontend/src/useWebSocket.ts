@@ -3,7 +3,9 @@ import * as reactUseWebSocket from 'react-use-websocket';
 const WS_ENDPOINT = 'ws://localhost:8000/ws';
 
 export default function useWebSocket() {
-    return reactUseWebSocket.default(WS_ENDPOINT, { share: true, });
+    // A running program outlives a dropped connection for a grace period, and
+    // its output is resumed with ATTACH once reconnected.
+    return reactUseWebSocket.default(WS_ENDPOINT, { share: true, shouldReconnect: () => true, });
 }
 
 export const ReadyState = reactUseWebSocket.ReadyState;
\ No newline at end of file
@@ -0,0 +1,150 @@
+"""ImportGraph knows which workspace modules import which, to select tests.
+
+Every workspace `.py` file is parsed once, in a thread, for its `import` and
+`from ... import` statements. Each imported name is resolved to the workspace
+files it could load. A name is tried against the workspace root and against the
+importing file's own directory, which is where pytest finds a test's siblings.
+Names that resolve to no workspace file, such as the standard library, are
+dropped. The graph is built on first use and then kept current from FileObserver
+batches, re-parsing only the files that changed.
+
+`affected` answers which test files must run after a set of files changed: the
+tests that import a changed file, directly or through other modules.
+"""
+
+__author__ = "Kris Jordan <kris@cs.unc.edu>"
+__copyright__ = "Copyright 2024"
+__license__ = "MIT"
+
+import ast
+import asyncio
+import os
+
+from .file_observer import is_directory_change
+from .web_socket_event import WebSocketEvent
+from . import config
+
+
+class ImportGraph:
+    """Workspace files and the workspace files each one imports."""
+
+    def __init__(self, root: str = "."):
+        """
+        Args:
+            root: The workspace directory. Paths are relative to it.
+        """
+        self._root = root
+        self._imports: dict[str, set[str]] | None = None
+        self._lock = asyncio.Lock()
+
+    async def files(self) -> set[str]:
+        """Every Python file in the workspace."""
+        imports = await self._graph()
+        return set(imports)
+
+    async def affected(self, tests: set[str], changed: set[str]) -> set[str]:
+        """The test files that are, or transitively import, a changed file."""
+        imports = await self._graph()
+        importers: dict[str, set[str]] = {}
+        for path, imported in imports.items():
+            for dependency in imported:
+                importers.setdefault(dependency, set()).add(path)
+
+        reached = set(changed)
+        frontier = list(changed)
+        while frontier:
+            for importer in importers.get(frontier.pop(), ()):
+                if importer not in reached:
+                    reached.add(importer)
+                    frontier.append(importer)
+        return tests & reached
+
+    async def apply(self, event: WebSocketEvent) -> None:
+        """Re-parse the files in a FileObserver batch, once the graph is built."""
+        async with self._lock:
+            if self._imports is None:
+                return
+            for change in event.data["changes"]:
+                if is_directory_change(change):
+                    # A package appeared or moved: parse the workspace again.
+                    self._imports = None
+                    return
+                await self._reparse(self.relative(change["path"]))
+                if change.get("dest_path"):
+                    await self._reparse(self.relative(change["dest_path"]))
+
+    async def _graph(self) -> dict[str, set[str]]:
+        async with self._lock:
+            if self._imports is None:
+                self._imports = await asyncio.to_thread(self._parse_workspace)
+            return self._imports
+
+    async def _reparse(self, path: str) -> None:
+        assert self._imports is not None
+        if not path.endswith(".py"):
+            return
+        if os.path.isfile(os.path.join(self._root, path)):
+            self._imports[path] = await asyncio.to_thread(self._parse, path)
+        else:
+            self._imports.pop(path, None)
+
+    def _parse_workspace(self) -> dict[str, set[str]]:
+        imports = {}
+        for directory, directories, files in os.walk(self._root):
+            directories[:] = [
+                name for name in directories if name not in config.IGNORED_DIRECTORIES
+            ]
+            for name in files:
+                if name.endswith(".py"):
+                    path = self.relative(os.path.join(directory, name))
+                    imports[path] = self._parse(path)
+        return imports
+
+    def _parse(self, path: str) -> set[str]:
+        """The workspace files `path` may import."""
+        try:
+            with open(os.path.join(self._root, path), "rb") as file:
+                tree = ast.parse(file.read(), path)
+        except (OSError, SyntaxError, ValueError):
+            return set()
+
+        package = os.path.dirname(path)
+        found: set[str] = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    found |= self._resolve(package, alias.name.split("."))
+            elif isinstance(node, ast.ImportFrom):
+                if node.level:
+                    parts = package.split(os.sep) if package else []
+                    up = node.level - 1
+                    bases = []
+                    if up <= len(parts):
+                        bases = [os.sep.join(parts[: len(parts) - up])]
+                else:
+                    bases = ["", package]
+                module = node.module.split(".") if node.module else []
+                for base in bases:
+                    found |= self._candidates(base, module)
+                    for alias in node.names:
+                        found |= self._candidates(base, [*module, alias.name])
+        found.discard(path)
+        return found
+
+    def _resolve(self, package: str, parts: list[str]) -> set[str]:
+        return self._candidates("", parts) | self._candidates(package, parts)
+
+    def _candidates(self, base: str, parts: list[str]) -> set[str]:
+        """The existing files along a dotted name: each package's `__init__.py`
+        and the module itself."""
+        found = set()
+        for depth in range(1, len(parts) + 1):
+            stem = os.path.join(base, *parts[:depth])
+            for candidate in (stem + ".py", os.path.join(stem, "__init__.py")):
+                if os.path.isfile(os.path.join(self._root, candidate)):
+                    found.add(os.path.normpath(candidate))
+        return found
+
+    def relative(self, path: str) -> str:
+        """A path as the graph names it, relative to the workspace root."""
+        return os.path.normpath(os.path.relpath(path, self._root))
@@ -0,0 +1,221 @@
+"""InterpreterPool keeps pre-started wrapper interpreters ready to run a module.
+
+Starting a fresh `python3` for every RUN pays for interpreter startup and for the
+wrapper's own imports (runpy, inspect, traceback) on each click. The pool starts
+wrapper processes ahead of time; each one blocks reading a module name from its
+launch pipe. Acquiring a worker writes the module name to that pipe and the
+worker runs it exactly once. Workers are never reused, so the pool is refilled
+in the background after every acquisition.
+
+Each wrapper also inherits the write end of a control pipe, which carries input
+prompts, crash reports, and runtime events out of band from program output (see
+`server.wrappers.control`). The read end is handed to whoever runs the wrapper.
+"""
+
+__author__ = "Kris Jordan <kris@cs.unc.edu>"
+__copyright__ = "Copyright 2024"
+__license__ = "MIT"
+
+import os
+import json
+import asyncio
+from asyncio.subprocess import Process, PIPE
+from collections import deque
+from typing import Any, NamedTuple, Sequence
+
+
+class WrapperProcess(NamedTuple):
+    """A running wrapper and the read end of its control pipe, owned by the caller."""
+
+    process: Process
+    control_fd: int
+
+
+class _Worker:
+    """An idle wrapper process with the write end of its launch pipe and the read
+    end of its control pipe."""
+
+    def __init__(self, process: Process, launch_fd: int, control_fd: int):
+        self.process = process
+        self.launch_fd = launch_fd
+        self.control_fd = control_fd
+
+    def launch(
+        self, module: str, limits: dict[str, int], profile: dict[str, Any] | None
+    ) -> None:
+        """Tell the waiting wrapper which module to run, under what limits, and
+        with which profiler options, if any."""
+        request = json.dumps({"module": module, "limits": limits, "profile": profile})
+        try:
+            os.write(self.launch_fd, f"{request}\n".encode())
+        finally:
+            self._close_launch_fd()
+
+    def retire(self) -> None:
+        """Shut down an idle worker without running anything."""
+        self._close_launch_fd()
+        os.close(self.control_fd)
+        if self.process.returncode is None:
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                ...
+
+    def _close_launch_fd(self) -> None:
+        if self.launch_fd >= 0:
+            os.close(self.launch_fd)
+            self.launch_fd = -1
+
+
+class InterpreterPool:
+    """A pool of pre-started, single-use wrapper interpreters."""
+
+    def __init__(self, size: int, preload: Sequence[str] = ()):
+        """
+        Args:
+            size: How many idle interpreters to keep ready. Zero disables pooling.
+            preload: Modules each idle interpreter imports before waiting.
+        """
+        self._size = size
+        self._preload = tuple(preload)
+        self._idle: deque[_Worker] = deque()
+        self._refill_task: asyncio.Task[None] | None = None
+        self._stopped = False
+        self.hits = 0
+        self.misses = 0
+
+    async def start(self) -> None:
+        """Begin filling the pool in the background."""
+        self._stopped = False
+        self._schedule_refill()
+
+    async def acquire(
+        self,
+        module: str,
+        limits: dict[str, int] | None = None,
+        profile: dict[str, Any] | None = None,
+    ) -> WrapperProcess:
+        """Start running `module`, on an idle interpreter when one is ready.
+
+        Args:
+            module: The dotted name of the module to run.
+            limits: Resource limits the wrapper applies before running the module.
+            profile: Profiler options to run the module under, if any.
+
+        Returns:
+            The running wrapper process and its control pipe.
+        """
+        while self._idle:
+            worker = self._idle.popleft()
+            try:
+                if worker.process.returncode is not None:
+                    raise BrokenPipeError()
+                worker.launch(module, limits or {}, profile)
+            except OSError:
+                worker.retire()
+                continue
+            self.hits += 1
+            self._schedule_refill()
+            return WrapperProcess(worker.process, worker.control_fd)
+
+        self.misses += 1
+        self._schedule_refill()
+        return await open_wrapper_process(module, limits, profile)
+
+    def stats(self) -> dict[str, int]:
+        """Report pool effectiveness for monitoring."""
+        return {
+            "size": self._size,
+            "idle": len(self._idle),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    async def stop(self) -> None:
+        """Stop refilling and shut down every idle interpreter."""
+        self._stopped = True
+        if self._refill_task:
+            self._refill_task.cancel()
+            try:
+                await self._refill_task
+            except asyncio.CancelledError:
+                ...
+        retired: list[asyncio.Future[int]] = []
+        while self._idle:
+            worker = self._idle.popleft()
+            worker.retire()
+            retired.append(asyncio.ensure_future(worker.process.wait()))
+        # Reap them before the loop closes, or their transports outlive it.
+        await asyncio.gather(*retired, return_exceptions=True)
+
+    def _schedule_refill(self) -> None:
+        if self._stopped or self._size <= 0:
+            return
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill())
+
+    async def _refill(self) -> None:
+        while not self._stopped and len(self._idle) < self._size:
+            worker = await _start_waiting_wrapper(self._preload)
+            if self._stopped:
+                worker.retire()
+                break
+            self._idle.append(worker)
+
+
+async def open_wrapper_process(
+    module: str,
+    limits: dict[str, int] | None = None,
+    profile: dict[str, Any] | None = None,
+) -> WrapperProcess:
+    """Open a cold wrapper process that runs `module` immediately."""
+    worker = await _start_waiting_wrapper()
+    try:
+        worker.launch(module, limits or {}, profile)
+    except OSError:
+        worker.retire()
+        raise
+    return WrapperProcess(worker.process, worker.control_fd)
+
+
+async def _start_waiting_wrapper(preload: Sequence[str] = ()) -> _Worker:
+    """Open a wrapper process that waits for a module on its launch pipe."""
+    launch_read_fd, launch_write_fd = os.pipe()
+    control_read_fd, control_write_fd = os.pipe()
+    try:
+        process = await _create_wrapper_process(
+            [
+                "--launch-fd",
+                str(launch_read_fd),
+                "--control-fd",
+                str(control_write_fd),
+                *preload,
+            ],
+            pass_fds=(launch_read_fd, control_write_fd),
+        )
+    except BaseException:
+        os.close(launch_write_fd)
+        os.close(control_read_fd)
+        raise
+    finally:
+        os.close(launch_read_fd)
+        os.close(control_write_fd)
+    return _Worker(process, launch_write_fd, control_read_fd)
+
+
+async def _create_wrapper_process(
+    args: list[str], pass_fds: Sequence[int] = ()
+) -> Process:
+    """Open the wrapper child process with flags for debugging."""
+    return await asyncio.create_subprocess_exec(
+        "python3",
+        "-u",
+        "-Xfrozen_modules=off",
+        "-m",
+        "server.wrappers.module",
+        *args,
+        stdout=PIPE,
+        stderr=PIPE,
+        stdin=PIPE,
+        pass_fds=pass_fds,
+    )
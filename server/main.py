@@ -1,33 +1,98 @@
-"""Main module for the introductory programming web server."""
+"""Main module for the introductory programming web server.
+
+The server may run as several worker processes (`python -m server --workers N`).
+Each worker imports this module and has its own connections and programs. They
+share file changes, diagnostics, and KILL/STDIN for each other's programs over
+the broker. Only the leader worker watches files and precompiles modules.
+"""
 
 __author__ = "Kris Jordan <kris@cs.unc.edu>"
 __copyright__ = "Copyright 2023"
 __license__ = "MIT"
 
 from fastapi import FastAPI, WebSocket
+from fastapi.responses import PlainTextResponse
 from fastapi.concurrency import asynccontextmanager
-from fastapi.staticfiles import StaticFiles
 
 from .web_socket_manager import WebSocketManager
+from .web_socket_event import WebSocketEvent
 from .file_observer import FileObserver
-from .controller import web_socket_controller
+from .precompiler import Precompiler
+from .static_assets import StaticAssets
+from .controller import (
+    web_socket_controller,
+    web_socket_disconnected,
+    routed_event,
+    broker,
+    interpreter_pool,
+    namespace_index,
+    import_graph,
+    test_runner,
+    result_cache,
+    run_scheduler,
+)
+from . import metrics
 
-web_socket_manager = WebSocketManager(web_socket_controller)
+web_socket_manager = WebSocketManager(web_socket_controller, web_socket_disconnected)
 """Web Socket Manager handles connections and dispatches to the controller."""
 
+precompiler = Precompiler(broker.publish)
+"""Compiles saved modules in the background and pushes their syntax errors."""
+
+static_assets = StaticAssets("server/static", html=True)
+"""The front end bundle, precompressed and served with caching headers."""
+
+metrics.RUNS_ACTIVE.set_function(lambda: run_scheduler.stats()["running"])
+metrics.RUNS_QUEUED.set_function(lambda: run_scheduler.stats()["queued"])
+metrics.CLIENT_QUEUE_DEPTH.set_function(web_socket_manager.queue_depths)
+
+
+async def on_broker_message(event: WebSocketEvent) -> None:
+    """Handle an event published by any worker, this one included."""
+    match event.type:
+        case "files_changed":
+            # Keep the namespace index current, notify connected clients, then
+            # start compiling the changed modules if this worker is the leader.
+            await namespace_index.apply(event)
+            await result_cache.apply(event)
+            await import_graph.apply(event)
+            await test_runner.apply(event)
+            await web_socket_manager.notify(event)
+            await precompiler.apply(event)
+        case "DIAGNOSTICS":
+            await web_socket_manager.notify(event)
+        case "KILL" | "STDIN" | "ATTACH" | "DETACH" | "RELAY":
+            await routed_event(event)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
     This function is called before the FastAPI web server begins, yields while
     the web server is running, then shuts down depencies when halting. It is
-    responsible for starting and stopping the file observer and the web socket
-    manager.
+    responsible for building the namespace index and the static assets, and for
+    starting and stopping the broker, the interpreter pool, and the web socket
+    manager. Whichever worker leads also runs the precompiler and file observer.
     """
-    file_observer = FileObserver(".", web_socket_manager.notify)
+    await namespace_index.build()
+    await static_assets.build()
+    file_observers = []
+
+    async def lead() -> None:
+        precompiler.start()
+        file_observers.append(FileObserver(".", broker.publish))
+
+    await broker.start(on_broker_message, lead)
+    await interpreter_pool.start()
     yield
-    file_observer.stop()
+    for file_observer in file_observers:
+        file_observer.stop()
+    await broker.stop()
+    metrics.loop_lag.stop()
+    await precompiler.stop()
+    await interpreter_pool.stop()
     await web_socket_manager.stop()
+    static_assets.stop()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -40,5 +105,13 @@ async def websocket_endpoint(client: WebSocket):
     await web_socket_manager.accept(client)
 
 
-app.mount("/", StaticFiles(directory="server/static", html=True))
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint() -> PlainTextResponse:
+    """Server metrics in the Prometheus text exposition format."""
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+app.mount("/", static_assets)
 """Static files are served from the static HTML directory."""
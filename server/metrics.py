@@ -0,0 +1,213 @@
+"""Server metrics, exposed at `/metrics` in the Prometheus text format.
+
+Instruments are module level and cheap to update from hot paths: a counter
+increment is an integer addition and a histogram observation is a bisect into a
+short list of buckets. Anything that can be read from existing state, such as the
+number of running programs or a client's queue depth, is a gauge with a callback
+that only runs when the endpoint is scraped.
+
+Event loop lag is measured by a sampler that runs only while someone is scraping.
+The first scrape starts it, and it stops after `LoopLagSampler.idle_after` seconds
+without a scrape.
+"""
+
+__author__ = "Kris Jordan <kris@cs.unc.edu>"
+__copyright__ = "Copyright 2024"
+__license__ = "MIT"
+
+import asyncio
+from bisect import bisect_left
+from typing import Callable, Iterable
+
+Labels = tuple[tuple[str, str], ...]
+"""Label names and values of one series, in a fixed order."""
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+"""Histogram bucket upper bounds, in seconds."""
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        _registry.append(self)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+
+
+class Counter(_Metric):
+    """A monotonically increasing count, optionally split by one label."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, label: str | None = None):
+        super().__init__(name, help)
+        self._label = label
+        self._values: dict[str, float] = {} if label else {"": 0}
+
+    def inc(self, amount: float = 1, label: str = "") -> None:
+        self._values[label] = self._values.get(label, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield from super().render()
+        for label, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self._labels(label))} {value}"
+
+    def _labels(self, value: str) -> Labels:
+        return ((self._label, value),) if self._label else ()
+
+
+class Gauge(_Metric):
+    """A value read from a callback at scrape time."""
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        read: Callable[[], float | dict[Labels, float]] | None = None,
+    ):
+        super().__init__(name, help)
+        self._read = read
+
+    def set_function(self, read: Callable[[], float | dict[Labels, float]]) -> None:
+        self._read = read
+
+    def render(self) -> Iterable[str]:
+        if self._read is None:
+            return
+        yield from super().render()
+        values = self._read()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in values.items():
+            yield f"{self.name}{_format_labels(labels)} {value}"
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets."""
+
+    type = "histogram"
+
+    def __init__(
+        self, name: str, help: str, buckets: tuple[float, ...] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, help)
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self._counts[bisect_left(self._buckets, value)] += 1
+        self._sum += value
+
+    def render(self) -> Iterable[str]:
+        yield from super().render()
+        cumulative = 0
+        for bound, count in zip(self._buckets, self._counts):
+            cumulative += count
+            yield f'{self.name}_bucket{{le="{bound}"}} {cumulative}'
+        cumulative += self._counts[-1]
+        yield f'{self.name}_bucket{{le="+Inf"}} {cumulative}'
+        yield f"{self.name}_sum {self._sum}"
+        yield f"{self.name}_count {cumulative}"
+
+
+class LoopLagSampler:
+    """Measures how late the event loop wakes from short sleeps, while scraped."""
+
+    def __init__(self, interval: float = 0.25, idle_after: float = 120.0):
+        self._interval = interval
+        self._idle_after = idle_after
+        self._last_scrape = 0.0
+        self._max_lag = 0.0
+        self._task: asyncio.Task[None] | None = None
+
+    def scrape(self) -> float:
+        """The largest lag since the previous scrape, starting the sampler if idle."""
+        loop = asyncio.get_running_loop()
+        self._last_scrape = loop.time()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._sample())
+        lag, self._max_lag = self._max_lag, 0.0
+        return lag
+
+    def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+
+    async def _sample(self) -> None:
+        loop = asyncio.get_running_loop()
+        while loop.time() - self._last_scrape < self._idle_after:
+            before = loop.time()
+            await asyncio.sleep(self._interval)
+            lag = loop.time() - before - self._interval
+            self._max_lag = max(self._max_lag, lag)
+
+
+_registry: list[_Metric] = []
+
+loop_lag = LoopLagSampler()
+"""Event loop lag sampler, active only while /metrics is scraped."""
+
+RUNS_ACTIVE = Gauge("comp110_runs_active", "Programs currently running.")
+RUNS_QUEUED = Gauge("comp110_runs_queued", "RUN requests waiting for a free slot.")
+RUN_SPAWN_SECONDS = Histogram(
+    "comp110_run_spawn_seconds", "Time to start a program's wrapper process."
+)
+RUN_EXIT_SECONDS = Histogram(
+    "comp110_run_exit_seconds",
+    "Time from a program's exit to its EXIT event, including draining output.",
+)
+OUTPUT_BYTES = Counter(
+    "comp110_output_bytes_total", "Program output bytes sent to clients.", "stream"
+)
+OUTPUT_FRAMES = Counter(
+    "comp110_output_frames_total", "Program output frames sent to clients.", "stream"
+)
+CLIENT_QUEUE_DEPTH = Gauge(
+    "comp110_client_queue_depth", "Notifications waiting in each client's outbox."
+)
+NOTIFY_SECONDS = Histogram(
+    "comp110_notify_seconds", "Time to queue a notification for every client."
+)
+FILE_EVENTS_RECEIVED = Counter(
+    "comp110_file_events_received_total", "File system events from the observer."
+)
+FILE_EVENTS_FORWARDED = Counter(
+    "comp110_file_events_forwarded_total",
+    "File changes forwarded to clients after filtering and coalescing.",
+)
+LS_SECONDS = Histogram("comp110_ls_seconds", "Time to answer an LS request.")
+RESULT_CACHE_LOOKUPS = Counter(
+    "comp110_result_cache_lookups_total",
+    "RUN requests looked up in the result cache, by hit or miss.",
+    "result",
+)
+LOOP_LAG_SECONDS = Gauge(
+    "comp110_event_loop_lag_seconds",
+    "Largest event loop lag seen since the previous scrape.",
+    loop_lag.scrape,
+)
+
+
+def render() -> str:
+    """Every metric in the Prometheus text exposition format."""
+    lines = [line for metric in _registry for line in metric.render()]
+    return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in labels)
+    return f"{{{pairs}}}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
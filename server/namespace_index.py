@@ -0,0 +1,227 @@
+"""NamespaceIndex keeps the workspace's packages and modules in memory.
+
+The index is built by scanning the workspace once at startup. After that it is
+kept current by the FileObserver's change events instead of walking the whole
+workspace on every LS request. Each path named by an event is reconciled against
+the file system, so a dropped or reordered event cannot leave the index wrong.
+
+Every structural change bumps the index's version and is kept in a bounded change
+log. This lets clients that already hold a tree ask for only the changes made
+since their version.
+
+Trees are returned as plain dicts and lists, ready to serialize, rather than as
+models validated node by node. A client may ask for one package and a depth. The
+packages below that depth are collapsed: they are sent with `"collapsed": true`
+and no children, and the client lists them when they are opened. The cost of a
+listing is proportional to the part of the tree it returns.
+"""
+
+__author__ = "Kris Jordan <kris@cs.unc.edu>"
+__copyright__ = "Copyright 2024"
+__license__ = "MIT"
+
+import os
+import asyncio
+from collections import deque
+from typing import Any
+
+from .web_socket_event import WebSocketEvent
+from .config import IGNORED_DIRECTORIES
+
+
+class _Node:
+    """A package (when it has children) or module in the index."""
+
+    __slots__ = ("name", "full_path", "children")
+
+    def __init__(
+        self, name: str, full_path: str, children: "dict[str, _Node] | None" = None
+    ):
+        self.name = name
+        self.full_path = full_path
+        self.children = children
+
+    def to_dict(self, depth: int | None = None) -> dict[str, Any]:
+        """The node as plain data, collapsed if it is a package at depth zero."""
+        if self.children is None:
+            return {"ns_type": "module", "name": self.name, "full_path": self.full_path}
+        node: dict[str, Any] = {
+            "ns_type": "package",
+            "name": self.name,
+            "full_path": self.full_path,
+        }
+        if depth is not None and depth <= 0:
+            node["collapsed"] = True
+            node["children"] = []
+        else:
+            node["children"] = _to_dicts(self.children, depth)
+        return node
+
+
+class NamespaceIndex:
+    """An incrementally maintained, versioned index of the workspace's namespace."""
+
+    def __init__(self, root: str = ".", history: int = 1000):
+        """
+        Args:
+            root: The workspace directory to index.
+            history: How many changes are kept for clients requesting deltas.
+        """
+        self._root = root
+        self._tree = _Node("", root, {})
+        self._changes: deque[tuple[int, dict[str, Any]]] = deque(maxlen=history)
+        self._snapshot: dict[str, Any] | None = None
+        self._lock = asyncio.Lock()
+        self.version = 0
+
+    async def build(self) -> None:
+        """Scan the whole workspace. Called once, before serving LS requests."""
+        self._tree = await asyncio.to_thread(_scan, self._root, self._root)
+        self._changes.clear()
+        self._snapshot = None
+        self.version += 1
+
+    def tree(
+        self, path: str | None = None, depth: int | None = None
+    ) -> dict[str, Any] | None:
+        """The namespace tree, or the package at `path`, listing `depth` levels of
+        packages below it. None if there is no package at `path`.
+
+        The whole tree is rebuilt only after the index changes."""
+        node = self._find(path)
+        if node is None or node.children is None:
+            return None
+        if node is not self._tree:
+            return node.to_dict(depth)
+        if depth is not None:
+            return {"ns_type": "tree", "children": _to_dicts(node.children, depth)}
+        if self._snapshot is None:
+            self._snapshot = {"ns_type": "tree", "children": _to_dicts(node.children)}
+        return self._snapshot
+
+    def changes_since(self, version: int) -> list[dict[str, Any]] | None:
+        """Changes made after `version`, or None if they are no longer known."""
+        if version == self.version:
+            return []
+        if not self._changes or version < self._changes[0][0] - 1:
+            return None
+        if version > self.version:
+            return None
+        return [change for v, change in self._changes if v > version]
+
+    async def apply(self, event: WebSocketEvent) -> None:
+        """Update the index from a FileObserver batch of changes."""
+        async with self._lock:
+            for change in event.data["changes"]:
+                if change["type"] == "file_modified":
+                    continue
+                await self._reconcile(change["path"])
+                if change.get("dest_path"):
+                    await self._reconcile(change["dest_path"])
+
+    async def _reconcile(self, path: str) -> None:
+        """Make the index agree with the file system at `path`."""
+        parts = self._relative_parts(path)
+        if not parts:
+            return
+
+        parent = self._tree
+        for depth, name in enumerate(parts[:-1]):
+            child = parent.children.get(name)  # type: ignore
+            if child is None or child.children is None:
+                # The parent package is unknown; reconcile it as a whole instead.
+                ancestor = os.path.join(self._root, *parts[: depth + 1])
+                return await self._reconcile(ancestor)
+            parent = child
+
+        assert parent.children is not None
+        name = parts[-1]
+        full_path = os.path.join(self._root, *parts)
+        existing = parent.children.get(name)
+        if os.path.isdir(full_path):
+            if existing is not None and existing.children is not None:
+                await self._reconcile_listing(existing)
+                return
+            node = await asyncio.to_thread(_scan, full_path, name)
+        elif os.path.isfile(full_path) and name.endswith(".py"):
+            if existing is not None and existing.children is None:
+                return
+            node = _Node(name, full_path)
+        else:
+            node = None
+
+        if existing is not None:
+            del parent.children[name]
+            self._record({"type": "removed", "full_path": existing.full_path})
+        if node is not None:
+            parent.children[name] = node
+            self._record(
+                {"type": "added", "parent": parent.full_path, "node": node.to_dict()}
+            )
+
+    async def _reconcile_listing(self, package: _Node) -> None:
+        """Reconcile a package's direct children, e.g. after directory_modified."""
+        assert package.children is not None
+        try:
+            names = {
+                entry.name
+                for entry in await asyncio.to_thread(_list_entries, package.full_path)
+            }
+        except OSError:
+            names = set()
+        for name in names ^ set(package.children):
+            await self._reconcile(os.path.join(package.full_path, name))
+
+    def _find(self, path: str | None) -> _Node | None:
+        """The node at a path, either a `full_path` or relative to the root."""
+        if path in (None, "", "/", "."):
+            return self._tree
+        parts = self._relative_parts(path)  # type: ignore
+        node = self._tree if parts else None
+        for name in parts:
+            node = node.children.get(name) if node and node.children else None
+        return node
+
+    def _relative_parts(self, path: str) -> list[str]:
+        relative = os.path.relpath(path, self._root)
+        if relative == "." or relative.startswith(".."):
+            return []
+        parts = relative.split(os.sep)
+        if any(part in IGNORED_DIRECTORIES for part in parts):
+            return []
+        return parts
+
+    def _record(self, change: dict[str, Any]) -> None:
+        self.version += 1
+        self._snapshot = None
+        self._changes.append((self.version, change))
+
+
+def _list_entries(directory: str) -> list[os.DirEntry[str]]:
+    """Entries of a directory that belong in the namespace tree."""
+    with os.scandir(directory) as entries:
+        return [
+            entry
+            for entry in entries
+            if (entry.is_file() and entry.name.endswith(".py"))
+            or (entry.is_dir() and entry.name not in IGNORED_DIRECTORIES)
+        ]
+
+
+def _scan(directory: str, name: str) -> _Node:
+    """Recursively scan a directory into a package node."""
+    children: dict[str, _Node] = {}
+    for entry in _list_entries(directory):
+        if entry.is_dir():
+            children[entry.name] = _scan(entry.path, entry.name)
+        else:
+            children[entry.name] = _Node(entry.name, entry.path)
+    return _Node(name, directory, children)
+
+
+def _to_dicts(
+    children: dict[str, _Node] | None, depth: int | None = None
+) -> list[dict[str, Any]]:
+    """Children as plain data, listing `depth` levels of packages below them."""
+    below = None if depth is None else depth - 1
+    return [children[name].to_dict(below) for name in sorted(children or {})]
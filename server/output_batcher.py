@@ -0,0 +1,118 @@
+"""OutputBatcher merges a run's stdout and stderr into as few frames as possible.
+
+A program printing in a tight loop would otherwise produce one web socket frame per
+line. Output is buffered until the flush latency elapses or the pending bytes reach
+the frame budget, whichever happens first. Order across the two streams is kept by
+only merging consecutive output of the same stream.
+
+Each run may forward a bounded amount of output. Anything past the cap is dropped
+and reported with a marker when the batcher is drained, which happens before an
+input prompt is shown and before the run's EXIT. The cap never splits a UTF-8
+character: one that would straddle it is dropped whole.
+"""
+
+__author__ = "Kris Jordan <kris@cs.unc.edu>"
+__copyright__ = "Copyright 2024"
+__license__ = "MIT"
+
+import asyncio
+from typing import Callable, Coroutine
+
+from . import config
+
+SendFn = Callable[[str, bytes], Coroutine[None, None, None]]
+"""Sends a frame of output for a stream, either "STDOUT" or "STDERR"."""
+
+
+class OutputBatcher:
+    """Coalesces a run's output streams into rate-bounded frames."""
+
+    def __init__(
+        self,
+        send: SendFn,
+        flush_latency: float = config.OUTPUT_FLUSH_LATENCY,
+        frame_bytes: int = config.OUTPUT_FRAME_BYTES,
+        max_bytes: int = config.OUTPUT_MAX_BYTES,
+    ):
+        """
+        Args:
+            send: The async function called with each frame's stream and bytes.
+            flush_latency: Seconds output may wait before it is sent.
+            frame_bytes: Pending bytes that trigger an immediate frame.
+            max_bytes: Total bytes forwarded before further output is dropped.
+        """
+        self._send = send
+        self._flush_latency = flush_latency
+        self._frame_bytes = frame_bytes
+        self._max_bytes = max_bytes
+        self._pending: list[tuple[str, bytearray]] = []
+        self._pending_bytes = 0
+        self._accepted_bytes = 0
+        self._dropped_bytes = 0
+        self._reported_dropped_bytes = 0
+        self._timer: asyncio.TimerHandle | None = None
+        self._flush_task: asyncio.Task[None] | None = None
+        self._lock = asyncio.Lock()
+
+    async def write(self, stream: str, data: bytes) -> None:
+        """Queue output for a stream, sending a frame if the budget is reached."""
+        remaining = self._max_bytes - self._accepted_bytes
+        if len(data) > remaining:
+            kept = utf8_boundary(data[:remaining]) if remaining > 0 else 0
+            self._dropped_bytes += len(data) - kept
+            # The cap counts as reached even when the cut fell short of it, so
+            # later output cannot follow what was dropped.
+            self._accepted_bytes = self._max_bytes - kept
+            if not kept:
+                return
+            data = data[:kept]
+
+        if self._pending and self._pending[-1][0] == stream:
+            self._pending[-1][1].extend(data)
+        else:
+            self._pending.append((stream, bytearray(data)))
+        self._pending_bytes += len(data)
+        self._accepted_bytes += len(data)
+
+        if self._pending_bytes >= self._frame_bytes:
+            await self.flush()
+        elif self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self._flush_latency, self._flush_later)
+
+    async def flush(self) -> None:
+        """Send all pending output now."""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        async with self._lock:
+            pending, self._pending = self._pending, []
+            self._pending_bytes = 0
+            for stream, data in pending:
+                await self._send(stream, bytes(data))
+
+    async def drain(self) -> None:
+        """Send all pending output and report any output dropped since last drain."""
+        await self.flush()
+        dropped = self._dropped_bytes - self._reported_dropped_bytes
+        if dropped > 0:
+            self._reported_dropped_bytes = self._dropped_bytes
+            await self._send(
+                "STDERR", f"[Output limit reached: {dropped} bytes dropped]\n".encode()
+            )
+
+    def _flush_later(self) -> None:
+        self._timer = None
+        self._flush_task = asyncio.create_task(self.flush())
+
+
+def utf8_boundary(data: bytes) -> int:
+    """The length of `data` without a trailing, incomplete UTF-8 character."""
+    for back in range(1, min(4, len(data)) + 1):
+        byte = data[-back]
+        if byte < 0x80:
+            break
+        if byte >= 0xC0:
+            length = 2 if byte < 0xE0 else 3 if byte < 0xF0 else 4
+            return len(data) - back if back < length else len(data)
+    return len(data)
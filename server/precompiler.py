@@ -0,0 +1,158 @@
+"""Precompiler compiles saved modules in the background and reports syntax errors.
+
+When FileObserver reports a created, modified, or moved `.py` file, the file is
+compiled with `py_compile` on a pool of worker processes. This writes its
+`__pycache__` bytecode, so the next RUN imports warm bytecode instead of compiling
+in the child. A syntax error is pushed to clients as a `DIAGNOSTICS` event
+right away instead of after a full process spawn:
+
+    {"type": "DIAGNOSTICS", "data": {"path": "ex/hello.py", "diagnostics": [
+        {"severity": "error", "message": "...", "lineno": 3, "offset": 7,
+         "end_lineno": 3, "end_offset": 9, "text": "..."}]}}
+
+An empty list clears a file's earlier diagnostics. Events are only sent when a
+file's diagnostics change.
+
+Saves of a file that arrive while it is compiling are coalesced. At most one
+more compile of that file follows the current one, and it reads the latest
+contents.
+"""
+
+__author__ = "Kris Jordan <kris@cs.unc.edu>"
+__copyright__ = "Copyright 2024"
+__license__ = "MIT"
+
+import asyncio
+import multiprocessing
+import os
+import py_compile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Coroutine
+
+from .web_socket_event import WebSocketEvent
+from . import config
+
+Diagnostic = dict[str, Any]
+
+NotifyFn = Callable[[WebSocketEvent], Coroutine[None, None, None]]
+
+
+class Precompiler:
+    """Compiles changed modules on worker processes and pushes diagnostics."""
+
+    def __init__(
+        self,
+        notify: NotifyFn,
+        root: str = ".",
+        workers: int = config.PRECOMPILE_WORKERS,
+    ):
+        """
+        Args:
+            notify: Sends a DIAGNOSTICS event to clients.
+            root: Directory paths in events are reported relative to.
+            workers: Compiler processes. Zero disables precompilation.
+        """
+        self._notify = notify
+        self._root = root
+        self._workers = workers
+        self._executor: ProcessPoolExecutor | None = None
+        self._compiling: dict[str, asyncio.Task[None]] = {}
+        self._dirty: set[str] = set()
+        self._diagnostics: dict[str, list[Diagnostic]] = {}
+
+    def start(self) -> None:
+        if self._workers > 0:
+            # Not forked: the server has threads (the file observer) by now.
+            self._executor = ProcessPoolExecutor(
+                self._workers, mp_context=multiprocessing.get_context("forkserver")
+            )
+
+    async def stop(self) -> None:
+        for task in list(self._compiling.values()):
+            task.cancel()
+        await asyncio.gather(*self._compiling.values(), return_exceptions=True)
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def apply(self, event: WebSocketEvent) -> None:
+        """Compile the Python files a FileObserver batch created or changed."""
+        if self._executor is None:
+            return
+        for change in event.data["changes"]:
+            if not change["type"].startswith("file_"):
+                continue
+            if change["type"] in ("file_deleted", "file_moved"):
+                await self._forget(change["path"])
+            if change["type"] != "file_deleted":
+                self._schedule(change.get("dest_path") or change["path"])
+
+    def _schedule(self, path: str) -> None:
+        if not path.endswith(".py"):
+            return
+        if path in self._compiling:
+            self._dirty.add(path)
+            return
+        task = asyncio.create_task(self._compile(path))
+        self._compiling[path] = task
+
+    async def _compile(self, path: str) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                self._dirty.discard(path)
+                assert self._executor
+                try:
+                    found = await loop.run_in_executor(self._executor, _compile, path)
+                except FileNotFoundError:
+                    found = []
+                except Exception as e:
+                    print(e)
+                    return
+                if path not in self._dirty:
+                    break
+            await self._publish(path, found)
+        finally:
+            del self._compiling[path]
+            if path in self._dirty:
+                self._schedule(path)
+
+    async def _forget(self, path: str) -> None:
+        if self._diagnostics.pop(path, None):
+            await self._notify(self._event(path, []))
+
+    async def _publish(self, path: str, found: list[Diagnostic]) -> None:
+        if self._diagnostics.get(path, []) == found:
+            return
+        self._diagnostics[path] = found
+        await self._notify(self._event(path, found))
+
+    def _event(self, path: str, found: list[Diagnostic]) -> WebSocketEvent:
+        relative = os.path.relpath(path, self._root)
+        return WebSocketEvent(
+            type="DIAGNOSTICS", data={"path": relative, "diagnostics": found}
+        )
+
+
+def _compile(path: str) -> list[Diagnostic]:
+    """Compile `path` to its __pycache__ bytecode. Runs in a worker process."""
+    try:
+        py_compile.compile(path, doraise=True)
+    except py_compile.PyCompileError as e:
+        error = e.exc_value
+        if isinstance(error, SyntaxError):
+            return [
+                {
+                    "severity": "error",
+                    "message": error.msg,
+                    "lineno": error.lineno,
+                    "offset": error.offset,
+                    "end_lineno": error.end_lineno,
+                    "end_offset": error.end_offset,
+                    "text": error.text,
+                }
+            ]
+        if isinstance(error, FileNotFoundError):
+            raise error
+        return [{"severity": "error", "message": str(error)}]
+    return []
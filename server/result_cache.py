@@ -0,0 +1,153 @@
+"""ResultCache replays the output of unchanged, non-interactive runs.
+
+A RUN may opt in with `"cache": true`. When a run of a module finishes
+normally, read no input, and had no side effects, its output is recorded. The
+record is keyed by a hash of the module name and the contents of every
+workspace file the run read or imported, as the wrapper reported them. The
+next RUN of that module hashes the same files again. If nothing changed, the
+recorded output and EXIT are streamed back at once instead of starting an
+interpreter:
+
+    {"type": "RUNNING", "data": {"pid": 1073741824, "request_id": 7, "cached": true}}
+
+Replayed runs have pids from `REPLAY_PID_BASE` up, which no process has.
+
+Records are dropped when FileObserver reports a change to a file they depend
+on, and least recently used records are evicted past the size bound.
+"""
+
+__author__ = "Kris Jordan <kris@cs.unc.edu>"
+__copyright__ = "Copyright 2024"
+__license__ = "MIT"
+
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
+from typing import NamedTuple
+
+from .scrollback import Entry
+from .web_socket_event import WebSocketEvent
+from . import config, metrics
+
+REPLAY_PID_BASE = 1 << 30
+"""Above any Linux pid, so a replay is never confused with a process."""
+
+
+class Recording(NamedTuple):
+    """A run's output and events, and how it exited."""
+
+    entries: tuple[Entry, ...]
+    returncode: int
+    files: tuple[str, ...]
+    size: int
+
+
+class ResultCache:
+    """Recordings of runs, keyed by a hash of the files they depended on."""
+
+    def __init__(self, root: str = ".", max_bytes: int = config.RESULT_CACHE_BYTES):
+        """
+        Args:
+            root: The workspace directory that dependency paths are relative to.
+            max_bytes: Output bytes recorded before the least recently used
+                recordings are evicted. Zero disables the cache.
+        """
+        self._root = root
+        self._max_bytes = max_bytes
+        self._files: dict[str, tuple[str, ...]] = {}
+        self._recordings: OrderedDict[str, Recording] = OrderedDict()
+        self._keys_by_file: dict[str, set[str]] = {}
+        self._bytes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_bytes > 0
+
+    async def lookup(self, module: str) -> Recording | None:
+        """The recording of `module` if none of the files it read have changed."""
+        files = self._files.get(module)
+        recording = None
+        if files is not None:
+            key = await asyncio.to_thread(_key, self._root, module, files)
+            recording = self._recordings.get(key) if key else None
+        metrics.RESULT_CACHE_LOOKUPS.inc(label="hit" if recording else "miss")
+        if recording:
+            self._recordings.move_to_end(key)  # type: ignore
+        return recording
+
+    async def store(
+        self,
+        module: str,
+        files: list[str],
+        entries: list[Entry],
+        returncode: int,
+        started_ns: int,
+    ) -> None:
+        """Record a run that began at `started_ns`, unless a file it read was
+        changed after then."""
+        paths = tuple(sorted(files))
+        key = await asyncio.to_thread(_key, self._root, module, paths, started_ns)
+        size = sum(len(entry.data) for entry in entries)
+        if key is None or size > self._max_bytes:
+            return
+        self._remove(key)
+        self._files[module] = paths
+        self._recordings[key] = Recording(tuple(entries), returncode, paths, size)
+        self._bytes += size
+        for path in paths:
+            self._keys_by_file.setdefault(path, set()).add(key)
+        while self._bytes > self._max_bytes:
+            self._remove(next(iter(self._recordings)))
+
+    async def apply(self, event: WebSocketEvent) -> None:
+        """Drop recordings that depend on files in a FileObserver batch."""
+        for change in event.data["changes"]:
+            if change["type"] != "file_modified":
+                # New or moved modules can change what an import finds.
+                self._clear()
+                return
+            path = os.path.normpath(os.path.relpath(change["path"], self._root))
+            for key in list(self._keys_by_file.get(path, ())):
+                self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        recording = self._recordings.pop(key, None)
+        if recording is None:
+            return
+        self._bytes -= recording.size
+        for path in recording.files:
+            keys = self._keys_by_file.get(path)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_file[path]
+
+    def _clear(self) -> None:
+        self._files.clear()
+        self._recordings.clear()
+        self._keys_by_file.clear()
+        self._bytes = 0
+
+
+def _key(
+    root: str, module: str, files: tuple[str, ...], changed_after_ns: int | None = None
+) -> str | None:
+    """A hash of the module name and its files' contents. None if a file was
+    modified after `changed_after_ns`."""
+    digest = hashlib.sha256(module.encode())
+    for path in files:
+        digest.update(b"\0" + path.encode() + b"\0")
+        try:
+            with open(os.path.join(root, path), "rb") as file:
+                if (
+                    changed_after_ns is not None
+                    and os.fstat(file.fileno()).st_mtime_ns > changed_after_ns
+                ):
+                    return None
+                digest.update(hashlib.sha256(file.read()).digest())
+        except FileNotFoundError:
+            digest.update(b"\0missing")
+        except OSError:
+            return None
+    return digest.hexdigest()
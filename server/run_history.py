@@ -0,0 +1,125 @@
+"""RunHistory keeps finished programs and their resource usage for capacity planning.
+
+Every program that exits is recorded with the usage from its EXIT event, its
+return code, and the limit it hit, if any. The most recent records are kept in
+a bounded ring. Totals per module are kept for every program since the server
+started, so they cost memory per module rather than per run:
+
+    {"type": "HISTORY", "data": {"module": "ex04.sort", "limit": 20}}
+
+answers with the most recent runs, newest first, and each module's aggregate.
+Both are optionally limited to one module. Each worker process keeps its own
+history of the programs it ran.
+"""
+
+__author__ = "Kris Jordan <kris@cs.unc.edu>"
+__copyright__ = "Copyright 2024"
+__license__ = "MIT"
+
+import time
+from collections import deque
+from typing import Any
+
+from . import config
+
+
+class _ModuleTotals:
+    """Running totals of one module's programs."""
+
+    __slots__ = (
+        "runs",
+        "failures",
+        "limits_exceeded",
+        "wall_seconds",
+        "max_wall_seconds",
+        "cpu_seconds",
+        "max_rss_bytes",
+        "output_bytes",
+    )
+
+    def __init__(self) -> None:
+        self.runs = 0
+        self.failures = 0
+        self.limits_exceeded = 0
+        self.wall_seconds = 0.0
+        self.max_wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.max_rss_bytes = 0
+        self.output_bytes = 0
+
+    def add(self, record: dict[str, Any]) -> None:
+        self.runs += 1
+        self.failures += record["returncode"] != 0
+        self.limits_exceeded += record["limit"] is not None
+        self.wall_seconds += record["wall_seconds"]
+        self.max_wall_seconds = max(self.max_wall_seconds, record["wall_seconds"])
+        self.cpu_seconds += (record["user_seconds"] or 0) + (
+            record["system_seconds"] or 0
+        )
+        self.max_rss_bytes = max(self.max_rss_bytes, record["max_rss_bytes"] or 0)
+        self.output_bytes += record["stdout_bytes"] + record["stderr_bytes"]
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "failures": self.failures,
+            "limits_exceeded": self.limits_exceeded,
+            "wall_seconds": self.wall_seconds,
+            "mean_wall_seconds": self.wall_seconds / self.runs,
+            "max_wall_seconds": self.max_wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "mean_cpu_seconds": self.cpu_seconds / self.runs,
+            "max_rss_bytes": self.max_rss_bytes,
+            "output_bytes": self.output_bytes,
+        }
+
+
+class RunHistory:
+    """The most recent finished programs, and totals per module for all of them."""
+
+    def __init__(self, size: int = config.RUN_HISTORY_SIZE):
+        """
+        Args:
+            size: Finished programs kept before the oldest are dropped.
+        """
+        self._runs: deque[dict[str, Any]] = deque(maxlen=size)
+        self._modules: dict[str, _ModuleTotals] = {}
+
+    def record(
+        self,
+        module: str,
+        pid: int,
+        returncode: int,
+        usage: dict[str, Any],
+        limit: str | None,
+    ) -> None:
+        """Keep a finished program's usage, from its EXIT event."""
+        record = {
+            "pid": pid,
+            "module": module,
+            "returncode": returncode,
+            "limit": limit,
+            "finished_at": time.time(),
+            **usage,
+        }
+        self._runs.append(record)
+        self._modules.setdefault(module, _ModuleTotals()).add(record)
+
+    def query(
+        self, module: str | None = None, limit: int | None = None
+    ) -> dict[str, Any]:
+        """The most recent runs, newest first, and the totals per module."""
+        runs = []
+        for record in reversed(self._runs):
+            if limit is not None and len(runs) >= limit:
+                break
+            if module is None or record["module"] == module:
+                runs.append(record)
+        return {
+            "runs": runs,
+            "modules": {
+                name: totals.to_dict()
+                for name, totals in sorted(self._modules.items())
+                if module is None or name == module
+            },
+        }
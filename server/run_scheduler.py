@@ -0,0 +1,398 @@
+"""RunScheduler admits RUN requests, limits their resources, and reaps them.
+
+At most `max_concurrent` programs run at once. Requests past the limit wait in a
+queue per client and are admitted round-robin across clients, so one client
+pressing Run repeatedly cannot starve the rest of a class. A queued client
+receives a QUEUED event with the request's place in that order, and then
+RUNNING once its program starts.
+
+Every program runs under the configured CPU time and memory limits, applied by
+the wrapper, and under a wall clock limit enforced here. A program stopped by a
+limit is reported with a LIMIT_EXCEEDED event before its EXIT. Finished programs
+are removed from the registry of running processes as soon as they exit, and
+recorded with their resource usage in the run history.
+
+A program whose client disconnects is detached, not killed, and keeps running
+for a grace period. A client that ATTACHes within it is sent the program's
+scrollback and then its live output. A detached program still running when the
+grace period ends is killed. One that exited while detached is kept until then,
+so a client reattaching can still see how it ended.
+
+A RUN with `"cache": true` is answered from the result cache when the module and
+the files it read are unchanged since a recorded run, without starting a
+program. A RUN with a `profile` option always starts a program, which sends a
+PROFILE event before its EXIT.
+"""
+
+__author__ = "Kris Jordan <kris@cs.unc.edu>"
+__copyright__ = "Copyright 2024"
+__license__ = "MIT"
+
+import asyncio
+import itertools
+import time
+from collections import OrderedDict, deque
+from typing import Any
+from fastapi import WebSocket
+
+from .async_python_subprocess import AsyncPythonSubprocess
+from .interpreter_pool import InterpreterPool
+from .result_cache import REPLAY_PID_BASE, Recording, ResultCache
+from .run_history import RunHistory
+from .web_socket_event import WebSocketEvent
+from .wire import send_event, send_output
+from .wrappers.limits import CPU_LIMIT_SIGNAL, MEMORY_LIMIT_EXIT_CODE
+from . import config, metrics
+
+
+class _PendingRun:
+    """A RUN request waiting for a free slot."""
+
+    __slots__ = ("client", "module", "request_id", "cache", "profile")
+
+    def __init__(
+        self,
+        client: WebSocket,
+        module: str,
+        request_id: int,
+        cache: bool,
+        profile: dict[str, Any] | None,
+    ):
+        self.client = client
+        self.module = module
+        self.request_id = request_id
+        self.cache = cache
+        self.profile = profile
+
+
+class RunScheduler:
+    """Admission control, resource limits, and a registry of running programs."""
+
+    def __init__(
+        self,
+        pool: InterpreterPool | None = None,
+        result_cache: ResultCache | None = None,
+        history: RunHistory | None = None,
+        max_concurrent: int = config.RUN_MAX_CONCURRENT,
+        cpu_seconds: int = config.RUN_CPU_SECONDS,
+        memory_bytes: int = config.RUN_MEMORY_BYTES,
+        wall_seconds: int = config.RUN_WALL_SECONDS,
+        detach_grace_seconds: int = config.RUN_DETACH_GRACE_SECONDS,
+    ):
+        """
+        Args:
+            pool: Interpreter pool programs are started from.
+            result_cache: Recordings that RUN requests opting in are answered from.
+            history: Where finished programs and their usage are recorded.
+            max_concurrent: Programs allowed to run at once.
+            cpu_seconds: CPU time limit per program, zero for unlimited.
+            memory_bytes: Address space limit per program, zero for unlimited.
+            wall_seconds: Wall clock limit per program, zero for unlimited.
+            detach_grace_seconds: How long a program outlives its client's
+                disconnection, zero to kill it right away.
+        """
+        self._pool = pool
+        self._result_cache = result_cache
+        self._history = history
+        self._max_concurrent = max_concurrent
+        self._limits = {"cpu_seconds": cpu_seconds, "memory_bytes": memory_bytes}
+        self._wall_seconds = wall_seconds
+        self._detach_grace_seconds = detach_grace_seconds
+        self._running: dict[int, AsyncPythonSubprocess] = {}
+        self._exited_detached: dict[int, AsyncPythonSubprocess] = {}
+        self._grace_timers: dict[int, asyncio.TimerHandle] = {}
+        self._queues: OrderedDict[WebSocket, deque[_PendingRun]] = OrderedDict()
+        self._starting = 0
+        self._wall_timers: dict[int, asyncio.TimerHandle] = {}
+        self._wall_exceeded: set[int] = set()
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._caching: set[int] = set()
+        self._replay_pids = itertools.count(REPLAY_PID_BASE)
+
+    def get(self, pid: int) -> AsyncPythonSubprocess | None:
+        """The running program with `pid`, if it has not exited."""
+        return self._running.get(pid)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "running": len(self._running),
+            "starting": self._starting,
+            "queued": sum(len(queue) for queue in self._queues.values()),
+        }
+
+    async def submit(
+        self,
+        client: WebSocket,
+        module: str,
+        request_id: int,
+        cache: bool = False,
+        profile: dict[str, Any] | None = None,
+    ) -> None:
+        """Replay a recorded run if allowed, otherwise start a program now if a
+        slot is free, otherwise queue it. A `profile` names the profiler options
+        the wrapper runs the module under."""
+        cache = (
+            cache
+            and profile is None
+            and self._result_cache is not None
+            and self._result_cache.enabled
+        )
+        if cache:
+            assert self._result_cache
+            recording = await self._result_cache.lookup(module)
+            if recording:
+                await self._replay(client, request_id, recording)
+                return
+
+        pending = _PendingRun(client, module, request_id, cache, profile)
+        if not self._queues and self._active() < self._max_concurrent:
+            await self._start(pending)
+            return
+
+        queue = self._queues.setdefault(client, deque())
+        queue.append(pending)
+        await send_event(
+            client,
+            WebSocketEvent(
+                type="QUEUED",
+                data={"request_id": request_id, "position": self._position(client)},
+            ),
+        )
+
+    def cancel(self, client: WebSocket, request_id: int) -> bool:
+        """Withdraw a queued request. Returns whether it was still queued."""
+        queue = self._queues.get(client)
+        if not queue:
+            return False
+        for pending in queue:
+            if pending.request_id == request_id:
+                queue.remove(pending)
+                if not queue:
+                    del self._queues[client]
+                return True
+        return False
+
+    async def attach(self, client: WebSocket, pid: int, since: int) -> bool:
+        """Send `client` a program's scrollback after `since`, then its live
+        output. Returns False if the program is not known here."""
+        run = self._running.get(pid) or self._exited_detached.get(pid)
+        if run is None:
+            return False
+        timer = self._grace_timers.pop(pid, None)
+        if timer:
+            timer.cancel()
+        self._exited_detached.pop(pid, None)
+        await run.attach(client, since)
+        return True
+
+    def disconnect(self, client: WebSocket) -> None:
+        """Forget a client's queued requests and detach its running programs."""
+        self._queues.pop(client, None)
+        loop = asyncio.get_running_loop()
+        for pid, run in list(self._running.items()):
+            if run.client is not client:
+                continue
+            if self._detach_grace_seconds <= 0:
+                run.kill()
+                continue
+            run.detach()
+            self._grace_timers[pid] = loop.call_later(
+                self._detach_grace_seconds, self._grace_expired, pid
+            )
+
+    def _position(self, client: WebSocket) -> int:
+        """Where a client's newest queued request stands in the round-robin order,
+        counting from 1 for the next to start."""
+        turns = len(self._queues[client])
+        position = turns
+        ahead = True
+        for other, queue in self._queues.items():
+            if other is client:
+                ahead = False
+            else:
+                # Clients ahead of this one in the rotation also take this turn.
+                position += min(len(queue), turns if ahead else turns - 1)
+        return position
+
+    def _active(self) -> int:
+        return len(self._running) + self._starting
+
+    async def _start(self, pending: _PendingRun) -> None:
+        run = AsyncPythonSubprocess(
+            pending.module,
+            pending.client,
+            self._pool,
+            limits=self._limits,
+            profile=pending.profile,
+            on_exit=self._reap,
+        )
+        # Shielded, so a request cancelled mid-start cannot leave a program
+        # spawned but never killed.
+        spawn = asyncio.ensure_future(self._spawn(pending, run))
+        try:
+            await asyncio.shield(spawn)
+        except asyncio.CancelledError:
+            if not spawn.done():
+                spawn.add_done_callback(lambda _: self._abandon(run, spawn))
+            raise
+
+    async def _spawn(self, pending: _PendingRun, run: AsyncPythonSubprocess) -> None:
+        """Start a program, register it, and tell its client it is RUNNING."""
+        self._starting += 1
+        started = time.perf_counter()
+        try:
+            pid = await run.start()
+        except BaseException:
+            # Free the slot before admitting, or the failed start still holds it.
+            self._starting -= 1
+            self._admit()
+            raise
+        self._starting -= 1
+
+        metrics.RUN_SPAWN_SECONDS.observe(time.perf_counter() - started)
+        self._running[pid] = run
+        if pending.cache:
+            self._caching.add(pid)
+        if self._wall_seconds > 0:
+            loop = asyncio.get_running_loop()
+            self._wall_timers[pid] = loop.call_later(
+                self._wall_seconds, self._wall_clock_exceeded, pid
+            )
+        await send_event(
+            pending.client,
+            WebSocketEvent(
+                type="RUNNING", data={"pid": pid, "request_id": pending.request_id}
+            ),
+        )
+
+    def _abandon(self, run: AsyncPythonSubprocess, spawn: asyncio.Future) -> None:
+        """Kill a program whose request was cancelled while it started."""
+        if not spawn.cancelled() and spawn.exception() is not None:
+            print(spawn.exception())
+        run.kill()
+
+    def _grace_expired(self, pid: int) -> None:
+        del self._grace_timers[pid]
+        self._exited_detached.pop(pid, None)
+        run = self._running.get(pid)
+        if run:
+            run.kill()
+
+    def _wall_clock_exceeded(self, pid: int) -> None:
+        run = self._running.get(pid)
+        if run:
+            self._wall_exceeded.add(pid)
+            run.kill()
+
+    async def _reap(self, run: AsyncPythonSubprocess, returncode: int) -> None:
+        """Remove an exited program, report a limit it hit, and admit the next."""
+        pid = run.pid
+        assert pid is not None
+        self._running.pop(pid, None)
+        timer = self._wall_timers.pop(pid, None)
+        if timer:
+            timer.cancel()
+        if pid in self._grace_timers:
+            self._exited_detached[pid] = run
+        self._admit()
+
+        limit = self._limit_exceeded(pid, returncode)
+        if self._history:
+            self._history.record(
+                run.module, pid, returncode, run.usage, limit[0] if limit else None
+            )
+        if pid in self._caching:
+            self._caching.discard(pid)
+            if limit is None and returncode >= 0:
+                self._record(run, returncode)
+        if limit:
+            await run.send_event(
+                WebSocketEvent(
+                    type="LIMIT_EXCEEDED",
+                    data={"pid": pid, "limit": limit[0], "value": limit[1]},
+                )
+            )
+
+    def _record(self, run: AsyncPythonSubprocess, returncode: int) -> None:
+        """Keep a finished run's output in the result cache, in the background."""
+        output = run.replayable_output()
+        if output is None or self._result_cache is None:
+            return
+        files, entries = output
+        task = asyncio.create_task(
+            self._result_cache.store(
+                run.module, files, entries, returncode, run.started_ns
+            )
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _replay(
+        self, client: WebSocket, request_id: int, recording: Recording
+    ) -> None:
+        """Send a recorded run's output and EXIT at once."""
+        pid = next(self._replay_pids)
+        await send_event(
+            client,
+            WebSocketEvent(
+                type="RUNNING",
+                data={"pid": pid, "request_id": request_id, "cached": True},
+            ),
+        )
+        for entry in recording.entries:
+            if entry.event:
+                await send_event(
+                    client,
+                    WebSocketEvent(
+                        type=entry.event.type,
+                        data={**entry.event.data, "pid": pid, "seq": entry.seq},
+                    ),
+                )
+            else:
+                await send_output(
+                    client, entry.stream, pid, entry.data, False, entry.seq
+                )
+        await send_event(
+            client,
+            WebSocketEvent(
+                type="EXIT",
+                data={
+                    "pid": pid,
+                    "returncode": recording.returncode,
+                    "seq": len(recording.entries) + 1,
+                    "cached": True,
+                },
+            ),
+        )
+
+    def _limit_exceeded(self, pid: int, returncode: int) -> tuple[str, int] | None:
+        if pid in self._wall_exceeded:
+            self._wall_exceeded.discard(pid)
+            return ("wall_seconds", self._wall_seconds)
+        if returncode == -CPU_LIMIT_SIGNAL:
+            return ("cpu_seconds", self._limits["cpu_seconds"])
+        if returncode == MEMORY_LIMIT_EXIT_CODE and self._limits["memory_bytes"]:
+            return ("memory_bytes", self._limits["memory_bytes"])
+        return None
+
+    def _admit(self) -> None:
+        """Start queued requests, taking turns between clients."""
+        while self._queues and self._active() < self._max_concurrent:
+            client, queue = next(iter(self._queues.items()))
+            pending = queue.popleft()
+            if queue:
+                self._queues.move_to_end(client)
+            else:
+                del self._queues[client]
+            self._starting += 1
+            task = asyncio.create_task(self._start_admitted(pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _start_admitted(self, pending: _PendingRun) -> None:
+        # The slot was reserved when the request was admitted.
+        self._starting -= 1
+        try:
+            await self._start(pending)
+        except Exception as e:
+            print(e)
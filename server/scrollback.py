@@ -0,0 +1,65 @@
+"""Scrollback keeps the recent output and events of a run for reattaching clients.
+
+Everything a run sends its client, output frames and events such as EXIT alike,
+is appended with the next sequence number. A client that reconnects asks for
+the entries after the last sequence number it saw. Memory is bounded: once the
+output held passes the budget, the oldest entries are dropped, and a client
+resuming from before them learns of the gap from the first sequence number it
+is sent.
+"""
+
+__author__ = "Kris Jordan <kris@cs.unc.edu>"
+__copyright__ = "Copyright 2024"
+__license__ = "MIT"
+
+from collections import deque
+from typing import NamedTuple
+
+from .web_socket_event import WebSocketEvent
+from . import config
+
+
+class Entry(NamedTuple):
+    """Output for a stream, or an event when `event` is set."""
+
+    seq: int
+    stream: str
+    data: bytes
+    is_input_prompt: bool = False
+    event: WebSocketEvent | None = None
+
+
+class Scrollback:
+    """A ring buffer of a run's entries, bounded by the bytes of output held."""
+
+    def __init__(self, max_bytes: int = config.RUN_SCROLLBACK_BYTES):
+        """
+        Args:
+            max_bytes: Output bytes held before the oldest entries are dropped.
+        """
+        self._max_bytes = max_bytes
+        self._entries: deque[Entry] = deque()
+        self._bytes = 0
+        self.last_seq = 0
+
+    def append_output(self, stream: str, data: bytes, is_input_prompt: bool) -> Entry:
+        return self._append(Entry(self.last_seq + 1, stream, data, is_input_prompt))
+
+    def append_event(self, event: WebSocketEvent) -> Entry:
+        return self._append(Entry(self.last_seq + 1, "EVENT", b"", event=event))
+
+    def since(self, seq: int) -> list[Entry]:
+        """The entries after `seq` that are still held, oldest first."""
+        if not self._entries:
+            return []
+        start = max(0, seq + 1 - self._entries[0].seq)
+        # A deque indexes quickly near its ends, where live output reads from.
+        return [self._entries[i] for i in range(start, len(self._entries))]
+
+    def _append(self, entry: Entry) -> Entry:
+        self.last_seq = entry.seq
+        self._entries.append(entry)
+        self._bytes += len(entry.data)
+        while self._bytes > self._max_bytes and len(self._entries) > 1:
+            self._bytes -= len(self._entries.popleft().data)
+        return entry
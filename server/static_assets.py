@@ -0,0 +1,277 @@
+"""StaticAssets serves the front end bundle compressed and cache friendly.
+
+Every file is hashed and compressed once, when the server starts, off the event
+loop. gzip is always produced and brotli is added when the optional `brotli`
+package is installed. A `.gz` or `.br` file already next to an asset, such as
+one written by the front end build, is used instead of compressing again.
+Requests get the smallest variant their `Accept-Encoding` allows.
+
+Each variant has a strong ETag derived from its content, so a revalidating
+browser gets `304 Not Modified` without a body. Content hashed filenames from
+the bundler (`assets/index-4f3a9c1b.js`) never change, and are served as
+immutable for a year. Everything else, such as `index.html` or a dashed name like
+`apple-touch-icon.png`, must be revalidated on each use.
+
+The bodies of recently served variants are kept in a small LRU memory cache;
+the rest are read from disk on demand.
+"""
+
+__author__ = "Kris Jordan <kris@cs.unc.edu>"
+__copyright__ = "Copyright 2024"
+__license__ = "MIT"
+
+import asyncio
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, MutableMapping
+
+from . import config
+
+try:
+    import brotli  # type: ignore
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+Scope = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[MutableMapping[str, Any]]]
+Send = Callable[[MutableMapping[str, Any]], Awaitable[None]]
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+_HASHED_NAME = re.compile(
+    r"^assets/.+-(?=[A-Za-z0-9_-]{0,7}[0-9])[A-Za-z0-9_-]{8}\.[A-Za-z0-9]+$"
+)
+"""Vite's output: an 8 character content hash with a digit in it, just before the
+extension, in `assets/`, e.g. `assets/index-4f3a9c1b.js`."""
+
+_COMPRESSIBLE = re.compile(r"^(text/|application/(javascript|json|xml|wasm)|image/svg)")
+
+_COMPRESSORS: dict[str, tuple[str, Callable[[bytes], bytes]]] = {
+    "gzip": (".gz", lambda data: gzip.compress(data, 9, mtime=0)),
+}
+if brotli is not None:
+    _COMPRESSORS["br"] = (".br", lambda data: brotli.compress(data))  # type: ignore
+
+_PREFERENCE = ("br", "gzip", "identity")
+"""Encodings from most to least preferred when a client accepts several."""
+
+
+class _Variant:
+    """One encoding of an asset: where its bytes are and its strong ETag."""
+
+    __slots__ = ("path", "etag", "size")
+
+    def __init__(self, path: str, etag: str, size: int):
+        self.path = path
+        self.etag = etag
+        self.size = size
+
+
+class _Asset:
+    __slots__ = ("media_type", "cache_control", "variants")
+
+    def __init__(self, media_type: str, cache_control: str):
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.variants: dict[str, _Variant] = {}
+
+
+class StaticAssets:
+    """An ASGI app serving a directory of precompressed static files."""
+
+    def __init__(
+        self,
+        directory: str,
+        html: bool = True,
+        cache_bytes: int = config.STATIC_CACHE_BYTES,
+    ):
+        """
+        Args:
+            directory: The directory of files to serve.
+            html: Serve `index.html` for directories and `404.html` when missing.
+            cache_bytes: Memory for the bodies of recently served files.
+        """
+        self._directory = directory
+        self._html = html
+        self._cache_bytes = cache_bytes
+        self._assets: dict[str, _Asset] = {}
+        self._cache: OrderedDict[str, bytes] = OrderedDict()
+        self._cached_bytes = 0
+        self._compressed_directory: str | None = None
+
+    async def build(self) -> None:
+        """Hash and compress every file, in a thread."""
+        self._compressed_directory = tempfile.mkdtemp(prefix="comp110-static-")
+        self._assets = await asyncio.to_thread(self._scan, self._compressed_directory)
+
+    def stop(self) -> None:
+        if self._compressed_directory:
+            shutil.rmtree(self._compressed_directory, ignore_errors=True)
+            self._compressed_directory = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        assert scope["type"] == "http"
+        if scope["method"] not in ("GET", "HEAD"):
+            await _respond(send, 405, [(b"allow", b"GET, HEAD")])
+            return
+
+        status = 200
+        asset = self._lookup(scope["path"])
+        if asset is None and self._html:
+            asset, status = self._assets.get("404.html"), 404
+        if asset is None:
+            await _respond(send, 404, [], b"Not Found")
+            return
+
+        headers = _request_headers(scope)
+        accept_encoding = headers.get("accept-encoding", "")
+        variant_encoding = _negotiate(accept_encoding, asset.variants)
+        variant = asset.variants[variant_encoding]
+        response_headers = [
+            (b"etag", variant.etag.encode()),
+            (b"cache-control", asset.cache_control.encode()),
+            (b"vary", b"Accept-Encoding"),
+        ]
+        if status == 200 and _etag_matches(headers.get("if-none-match"), variant.etag):
+            await _respond(send, 304, response_headers)
+            return
+
+        response_headers.append((b"content-type", asset.media_type.encode()))
+        if variant_encoding != "identity":
+            response_headers.append((b"content-encoding", variant_encoding.encode()))
+        if scope["method"] == "HEAD":
+            response_headers.append((b"content-length", str(variant.size).encode()))
+            await _respond(send, status, response_headers)
+            return
+        body = await self._read(variant)
+        await _respond(send, status, response_headers, body)
+
+    def _lookup(self, path: str) -> _Asset | None:
+        relative = os.path.normpath(path.lstrip("/"))
+        if relative.startswith(".."):
+            return None
+        if relative == ".":
+            relative = ""
+        asset = self._assets.get(relative)
+        if asset is None and self._html:
+            asset = self._assets.get(os.path.join(relative, "index.html"))
+        return asset
+
+    async def _read(self, variant: _Variant) -> bytes:
+        body = self._cache.get(variant.path)
+        if body is not None:
+            self._cache.move_to_end(variant.path)
+            return body
+        body = await asyncio.to_thread(_read_file, variant.path)
+        if len(body) <= self._cache_bytes // 4:
+            self._cache[variant.path] = body
+            self._cached_bytes += len(body)
+            while self._cached_bytes > self._cache_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._cached_bytes -= len(evicted)
+        return body
+
+    def _scan(self, compressed_directory: str) -> dict[str, _Asset]:
+        assets: dict[str, _Asset] = {}
+        for directory, _, files in os.walk(self._directory):
+            for name in files:
+                path = os.path.join(directory, name)
+                relative = os.path.relpath(path, self._directory)
+                if name.endswith((".gz", ".br")):
+                    if os.path.exists(path.rsplit(".", 1)[0]):
+                        continue  # A precompressed sibling, served with its asset.
+                assets[relative] = self._prepare(path, relative, compressed_directory)
+        return assets
+
+    def _prepare(self, path: str, relative: str, compressed_directory: str) -> _Asset:
+        media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if media_type.startswith("text/") or media_type == "application/javascript":
+            media_type += "; charset=utf-8"
+        immutable = _HASHED_NAME.match(relative.replace(os.sep, "/")) is not None
+        asset = _Asset(media_type, IMMUTABLE if immutable else REVALIDATE)
+
+        data = _read_file(path)
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        asset.variants["identity"] = _Variant(path, f'"{digest}"', len(data))
+        small = len(data) < config.STATIC_COMPRESS_MIN_BYTES
+        if small or not _COMPRESSIBLE.match(media_type):
+            return asset
+
+        for encoding, (suffix, compress) in _COMPRESSORS.items():
+            prebuilt = path + suffix
+            if os.path.exists(prebuilt) and (
+                os.path.getmtime(prebuilt) >= os.path.getmtime(path)
+            ):
+                compressed_path, compressed = prebuilt, _read_file(prebuilt)
+            else:
+                compressed = compress(data)
+                compressed_path = os.path.join(compressed_directory, relative + suffix)
+                os.makedirs(os.path.dirname(compressed_path), exist_ok=True)
+                with open(compressed_path, "wb") as file:
+                    file.write(compressed)
+            if len(compressed) < len(data) * 0.9:
+                asset.variants[encoding] = _Variant(
+                    compressed_path, f'"{digest}-{encoding}"', len(compressed)
+                )
+        return asset
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def _request_headers(scope: Scope) -> dict[str, str]:
+    return {
+        name.decode("latin-1"): value.decode("latin-1")
+        for name, value in scope["headers"]
+    }
+
+
+def _negotiate(accept_encoding: str, variants: dict[str, _Variant]) -> str:
+    """The most preferred available encoding the client accepts."""
+    accepted: dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in _PREFERENCE:
+        if encoding not in variants:
+            continue
+        default = accepted.get("*", 1.0 if encoding == "identity" else 0)
+        quality = accepted.get(encoding, default)
+        if quality > 0:
+            return encoding
+    return "identity"
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(",")
+    )
+
+
+async def _respond(
+    send: Send, status: int, headers: list[tuple[bytes, bytes]], body: bytes = b""
+) -> None:
+    if status != 304 and not any(name == b"content-length" for name, _ in headers):
+        headers = [*headers, (b"content-length", str(len(body)).encode())]
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
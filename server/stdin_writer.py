@@ -0,0 +1,78 @@
+"""StdinWriter delivers a run's input to its stdin pipe without blocking the server.
+
+Input is queued and written by a task of its own, which waits on the pipe's
+drain before writing more. A program that stops reading therefore only fills its
+own queue, never the event loop. Input queued while a write is draining is
+joined into a single write, so a large paste sent as many STDIN events costs a
+few pipe writes rather than one per line.
+
+The queue is bounded. Input that would overflow it is refused whole, and the
+caller tells the client, which may send it again once the program catches up.
+Whatever is still queued when the program exits is dropped by `close`.
+"""
+
+__author__ = "Kris Jordan <kris@cs.unc.edu>"
+__copyright__ = "Copyright 2024"
+__license__ = "MIT"
+
+import asyncio
+from asyncio import StreamWriter
+
+from . import config
+
+
+class StdinWriter:
+    """A bounded queue of input drained into a process's stdin by its own task."""
+
+    def __init__(
+        self, stdin: StreamWriter, max_bytes: int = config.RUN_STDIN_BUFFER_BYTES
+    ):
+        """
+        Args:
+            stdin: The process's stdin pipe.
+            max_bytes: Input queued or awaiting the pipe before more is refused.
+        """
+        self._stdin = stdin
+        self._max_bytes = max_bytes
+        self._queue: list[bytes] = []
+        self._ready = asyncio.Event()
+        self.buffered = 0
+        self._task = asyncio.create_task(self._write_pipe())
+
+    @property
+    def max_bytes(self) -> int:
+        return self._max_bytes
+
+    def write(self, data: bytes) -> bool:
+        """Queue input for the process. Returns False, queueing nothing, if it
+        would overflow the buffer."""
+        if self._task.done() or self.buffered + len(data) > self._max_bytes:
+            return False
+        self._queue.append(data)
+        self.buffered += len(data)
+        self._ready.set()
+        return True
+
+    async def close(self) -> None:
+        """Stop writing and drop any input still queued."""
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._queue.clear()
+        self.buffered = 0
+        self._stdin.close()
+
+    async def _write_pipe(self) -> None:
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                while self._queue:
+                    data = b"".join(self._queue)
+                    self._queue.clear()
+                    self._stdin.write(data)
+                    await self._stdin.drain()
+                    self.buffered -= len(data)
+        except (BrokenPipeError, ConnectionResetError):
+            ...  # The program closed its stdin or exited.
+        except Exception as e:
+            print(e)
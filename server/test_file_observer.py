@@ -0,0 +1,94 @@
+"""Tests for how FileObserver coalesces a batch of raw events into changes."""
+
+from watchdog.events import (
+    DirCreatedEvent,
+    DirMovedEvent,
+    FileCreatedEvent,
+    FileDeletedEvent,
+    FileModifiedEvent,
+    FileMovedEvent,
+)
+
+from server.file_observer import _coalesce, is_directory_change
+
+
+def test_created_then_deleted_cancels_out():
+    events = [FileCreatedEvent("/w/a.py"), FileDeletedEvent("/w/a.py")]
+    assert _coalesce(events) == []
+
+
+def test_deleted_then_created_is_modified():
+    events = [FileDeletedEvent("/w/a.py"), FileCreatedEvent("/w/a.py")]
+    assert _coalesce(events) == [{"type": "file_modified", "path": "/w/a.py"}]
+
+
+def test_repeated_modifications_are_one_change():
+    events = [FileModifiedEvent("/w/a.py")] * 3
+    assert _coalesce(events) == [{"type": "file_modified", "path": "/w/a.py"}]
+
+
+def test_created_then_modified_stays_created():
+    events = [FileCreatedEvent("/w/a.py"), FileModifiedEvent("/w/a.py")]
+    assert _coalesce(events) == [{"type": "file_created", "path": "/w/a.py"}]
+
+
+def test_move_chain_folds_into_one_move():
+    events = [
+        FileMovedEvent("/w/a.py", "/w/b.py"),
+        FileMovedEvent("/w/b.py", "/w/c.py"),
+    ]
+    assert _coalesce(events) == [
+        {"type": "file_moved", "path": "/w/a.py", "dest_path": "/w/c.py"}
+    ]
+
+
+def test_move_chain_back_to_its_origin_is_modified():
+    events = [
+        FileMovedEvent("/w/a.py", "/w/b.py"),
+        FileMovedEvent("/w/b.py", "/w/a.py"),
+    ]
+    assert _coalesce(events) == [{"type": "file_modified", "path": "/w/a.py"}]
+
+
+def test_moved_then_deleted_deletes_the_origin():
+    events = [FileMovedEvent("/w/a.py", "/w/b.py"), FileDeletedEvent("/w/b.py")]
+    assert _coalesce(events) == [{"type": "file_deleted", "path": "/w/a.py"}]
+
+
+def test_created_then_moved_is_created_at_the_destination():
+    events = [FileCreatedEvent("/w/a.py"), FileMovedEvent("/w/a.py", "/w/b.py")]
+    assert _coalesce(events) == [{"type": "file_created", "path": "/w/b.py"}]
+
+
+def test_editor_save_through_a_temporary_file_is_created():
+    events = [FileMovedEvent("/w/a.py.tmp", "/w/a.py")]
+    assert _coalesce(events) == [{"type": "file_created", "path": "/w/a.py"}]
+
+
+def test_renamed_out_of_view_is_deleted():
+    events = [FileMovedEvent("/w/a.py", "/w/a.txt")]
+    assert _coalesce(events) == [{"type": "file_deleted", "path": "/w/a.py"}]
+
+
+def test_moved_into_an_ignored_directory_is_deleted():
+    events = [FileMovedEvent("/w/a.py", "/w/__pycache__/a.py")]
+    assert _coalesce(events) == [{"type": "file_deleted", "path": "/w/a.py"}]
+
+
+def test_changes_are_ordered_by_their_last_event():
+    events = [
+        FileModifiedEvent("/w/a.py"),
+        FileModifiedEvent("/w/b.py"),
+        FileDeletedEvent("/w/a.py"),
+    ]
+    assert [change["path"] for change in _coalesce(events)] == ["/w/b.py", "/w/a.py"]
+
+
+def test_directory_changes_are_named_for_directories():
+    changes = _coalesce([DirCreatedEvent("/w/pkg"), DirMovedEvent("/w/old", "/w/new")])
+    assert [change["type"] for change in changes] == [
+        "directory_created",
+        "directory_moved",
+    ]
+    assert all(is_directory_change(change) for change in changes)
+    assert not is_directory_change({"type": "file_created", "path": "/w/a.py"})
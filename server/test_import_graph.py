@@ -0,0 +1,118 @@
+"""Tests for how ImportGraph resolves imports to workspace files."""
+
+import asyncio
+import os
+
+from server.import_graph import ImportGraph
+from server.web_socket_event import WebSocketEvent
+
+
+def _workspace(root, files: dict[str, str]) -> ImportGraph:
+    for path, source in files.items():
+        (root / path).parent.mkdir(parents=True, exist_ok=True)
+        (root / path).write_text(source)
+    return ImportGraph(str(root))
+
+
+def _path(path: str) -> str:
+    return path.replace("/", os.sep)
+
+
+def test_import_resolves_from_the_root_and_the_importing_directory(tmp_path):
+    graph = _workspace(
+        tmp_path,
+        {
+            "helper.py": "",
+            "ex01/helper.py": "",
+            "ex01/test_helper.py": "import helper\nimport os\n",
+        },
+    )
+    assert graph._parse(_path("ex01/test_helper.py")) == {
+        "helper.py",
+        _path("ex01/helper.py"),
+    }
+
+
+def test_dotted_import_includes_each_package(tmp_path):
+    graph = _workspace(
+        tmp_path,
+        {
+            "pkg/__init__.py": "",
+            "pkg/sub/__init__.py": "",
+            "pkg/sub/mod.py": "",
+            "main.py": "import pkg.sub.mod\n",
+        },
+    )
+    assert graph._parse("main.py") == {
+        _path("pkg/__init__.py"),
+        _path("pkg/sub/__init__.py"),
+        _path("pkg/sub/mod.py"),
+    }
+
+
+def test_relative_imports_resolve_from_the_package(tmp_path):
+    graph = _workspace(
+        tmp_path,
+        {
+            "pkg/core.py": "",
+            "pkg/sub/util.py": "",
+            "pkg/sub/mod.py": "from . import util\nfrom ..core import VALUE\n",
+        },
+    )
+    assert graph._parse(_path("pkg/sub/mod.py")) == {
+        _path("pkg/sub/util.py"),
+        _path("pkg/core.py"),
+    }
+
+
+def test_from_import_of_a_submodule_names_the_submodule(tmp_path):
+    graph = _workspace(
+        tmp_path,
+        {
+            "pkg/__init__.py": "",
+            "pkg/shapes.py": "",
+            "main.py": "from pkg import shapes, missing\n",
+        },
+    )
+    assert graph._parse("main.py") == {
+        _path("pkg/__init__.py"),
+        _path("pkg/shapes.py"),
+    }
+
+
+def test_relative_import_past_the_root_resolves_to_nothing(tmp_path):
+    graph = _workspace(tmp_path, {"a.py": "from ... import b\n", "b.py": ""})
+    assert graph._parse("a.py") == set()
+
+
+def test_unparsable_files_and_self_imports_import_nothing(tmp_path):
+    graph = _workspace(tmp_path, {"bad.py": "import (\n", "me.py": "import me\n"})
+    assert graph._parse("bad.py") == set()
+    assert graph._parse("me.py") == set()
+
+
+def test_affected_tests_import_a_changed_file_transitively(tmp_path):
+    graph = _workspace(
+        tmp_path,
+        {
+            "shapes.py": "",
+            "area.py": "import shapes\n",
+            "test_area.py": "import area\n",
+            "test_other.py": "import os\n",
+        },
+    )
+    tests = {"test_area.py", "test_other.py"}
+    assert asyncio.run(graph.affected(tests, {"shapes.py"})) == {"test_area.py"}
+    assert asyncio.run(graph.affected(tests, {"test_other.py"})) == {"test_other.py"}
+
+
+def test_a_modified_file_is_parsed_again(tmp_path):
+    graph = _workspace(tmp_path, {"shapes.py": "", "test_shapes.py": "import os\n"})
+    tests = {"test_shapes.py"}
+    assert asyncio.run(graph.affected(tests, {"shapes.py"})) == set()
+
+    (tmp_path / "test_shapes.py").write_text("import shapes\n")
+    change = {"type": "file_modified", "path": str(tmp_path / "test_shapes.py")}
+    event = WebSocketEvent(type="files_changed", data={"changes": [change]})
+    asyncio.run(graph.apply(event))
+    assert asyncio.run(graph.affected(tests, {"shapes.py"})) == tests
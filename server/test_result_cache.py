@@ -0,0 +1,119 @@
+"""Tests for when ResultCache replays a recording and when it must not."""
+
+import asyncio
+import os
+import time
+
+from server.result_cache import ResultCache
+from server.scrollback import Entry
+from server.web_socket_event import WebSocketEvent
+from server.wrappers.dependencies import DependencyRecorder
+
+
+def _write(path, text: str) -> None:
+    path.write_text(text)
+    # Later than any recording's start, as a save after the run would be.
+    later = time.time_ns() + 1_000_000_000
+    os.utime(path, ns=(later, later))
+
+
+def _store(cache: ResultCache, module: str, files: list[str], output: bytes) -> None:
+    entries = [Entry(1, "STDOUT", output)]
+    asyncio.run(cache.store(module, files, entries, 0, time.time_ns()))
+
+
+def _replayed(cache: ResultCache, module: str) -> bytes | None:
+    recording = asyncio.run(cache.lookup(module))
+    return recording.entries[0].data if recording else None
+
+
+def _changed(*changes: tuple[str, str]) -> WebSocketEvent:
+    return WebSocketEvent(
+        type="files_changed",
+        data={"changes": [{"type": kind, "path": path} for kind, path in changes]},
+    )
+
+
+def test_unchanged_files_replay(tmp_path):
+    (tmp_path / "main.py").write_text("print('hi')\n")
+    cache = ResultCache(str(tmp_path))
+    _store(cache, "main", ["main.py"], b"hi\n")
+    assert _replayed(cache, "main") == b"hi\n"
+
+
+def test_a_changed_file_misses_before_its_event_arrives(tmp_path):
+    (tmp_path / "main.py").write_text("import helper\n")
+    (tmp_path / "helper.py").write_text("X = 1\n")
+    cache = ResultCache(str(tmp_path))
+    _store(cache, "main", ["main.py", "helper.py"], b"1\n")
+    _write(tmp_path / "helper.py", "X = 2\n")
+    assert _replayed(cache, "main") is None
+
+
+def test_saved_main_module_is_not_replayed_stale(tmp_path, monkeypatch):
+    # The main module runs from warm bytecode and never enters sys.modules, so
+    # only its spec names its source among the run's dependencies.
+    (tmp_path / "cachemod.py").write_text("print('v3')\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    recorder = DependencyRecorder(str(tmp_path), str(tmp_path / "server"))
+    recorder.add_module("cachemod")
+    files = recorder.report()["files"]
+    assert files == ["cachemod.py"]
+
+    cache = ResultCache(str(tmp_path))
+    _store(cache, "cachemod", files, b"v3\n")
+    assert _replayed(cache, "cachemod") == b"v3\n"
+    # Saved within FileObserver's debounce, before any event drops the record.
+    _write(tmp_path / "cachemod.py", "print('v5')\n")
+    assert _replayed(cache, "cachemod") is None
+
+
+def test_a_file_changed_during_the_run_is_not_recorded(tmp_path):
+    (tmp_path / "main.py").write_text("print('hi')\n")
+    started_ns = time.time_ns()
+    _write(tmp_path / "main.py", "print('bye')\n")
+    cache = ResultCache(str(tmp_path))
+    entries = [Entry(1, "STDOUT", b"hi\n")]
+    asyncio.run(cache.store("main", ["main.py"], entries, 0, started_ns))
+    assert _replayed(cache, "main") is None
+
+
+def test_a_modified_file_drops_only_the_recordings_that_read_it(tmp_path):
+    for name in ("a.py", "b.py", "shared.py"):
+        (tmp_path / name).write_text("")
+    cache = ResultCache(str(tmp_path))
+    _store(cache, "a", ["a.py", "shared.py"], b"a\n")
+    _store(cache, "b", ["b.py"], b"b\n")
+    asyncio.run(cache.apply(_changed(("file_modified", str(tmp_path / "shared.py")))))
+    assert _replayed(cache, "a") is None
+    assert _replayed(cache, "b") == b"b\n"
+
+
+def test_a_created_file_drops_every_recording(tmp_path):
+    (tmp_path / "a.py").write_text("")
+    cache = ResultCache(str(tmp_path))
+    _store(cache, "a", ["a.py"], b"a\n")
+    asyncio.run(cache.apply(_changed(("file_created", str(tmp_path / "new.py")))))
+    assert _replayed(cache, "a") is None
+
+
+def test_a_missing_dependency_that_appears_misses(tmp_path):
+    (tmp_path / "a.py").write_text("")
+    cache = ResultCache(str(tmp_path))
+    _store(cache, "a", ["a.py", "gone.txt"], b"a\n")
+    assert _replayed(cache, "a") == b"a\n"
+    _write(tmp_path / "gone.txt", "now here\n")
+    assert _replayed(cache, "a") is None
+
+
+def test_least_recently_used_recordings_are_evicted(tmp_path):
+    for name in ("a.py", "b.py", "c.py"):
+        (tmp_path / name).write_text("")
+    cache = ResultCache(str(tmp_path), max_bytes=8)
+    _store(cache, "a", ["a.py"], b"aaaa")
+    _store(cache, "b", ["b.py"], b"bbbb")
+    assert _replayed(cache, "a") == b"aaaa"
+    _store(cache, "c", ["c.py"], b"cccc")
+    assert _replayed(cache, "b") is None
+    assert _replayed(cache, "a") == b"aaaa"
+    assert _replayed(cache, "c") == b"cccc"
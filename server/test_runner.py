@@ -0,0 +1,316 @@
+"""TestRunner answers TEST requests by running pytest across worker processes.
+
+    {"type": "TEST", "data": {"path": "exercises/ex05", "request_id": 3}}
+
+The test files under the path are split between up to `workers` pytest
+processes, balanced by how long each file took last time. Each process loads
+the `server.wrappers.pytest_events` plugin, which streams every result back on
+a pipe as it happens. Results are forwarded as TEST_RESULT events between a
+TEST_STARTED naming the selected files and a TEST_DONE with the totals.
+
+After the first run of a path, later runs select only the affected tests: test
+files that import, directly or not, a file changed since the previous run of
+that path, plus the files that failed in it. A changed `conftest.py`, a new or
+moved package, or `"all": true` runs everything again. Test processes run under
+the same CPU, memory, and wall clock limits as a RUN.
+"""
+
+__author__ = "Kris Jordan <kris@cs.unc.edu>"
+__copyright__ = "Copyright 2024"
+__license__ = "MIT"
+
+import asyncio
+import json
+import os
+import sys
+import time
+from asyncio import StreamReader, StreamReaderProtocol
+from asyncio.subprocess import Process
+from collections import Counter
+from fastapi import WebSocket
+
+from .file_observer import is_directory_change
+from .import_graph import ImportGraph
+from .web_socket_event import WebSocketEvent
+from .wire import send_event
+from .wrappers.control import EVENT, FRAME_HEADER
+from . import config
+
+STDERR_MAX_BYTES = 4000
+"""Most of a pytest process's stderr reported when it ends abnormally."""
+
+_NORMAL_EXIT_CODES = (0, 1, 5)
+"""pytest exit codes for all passed, some failed, and nothing collected."""
+
+
+class TestRunner:
+    """Runs the tests affected by recent changes on a pool of pytest processes."""
+
+    def __init__(
+        self,
+        graph: ImportGraph,
+        root: str = ".",
+        workers: int = config.TEST_WORKERS,
+        cpu_seconds: int = config.RUN_CPU_SECONDS,
+        memory_bytes: int = config.RUN_MEMORY_BYTES,
+        wall_seconds: int = config.RUN_WALL_SECONDS,
+    ):
+        """
+        Args:
+            graph: The workspace import graph tests are selected with.
+            root: The workspace directory pytest runs in.
+            workers: pytest processes a single TEST is split across.
+            cpu_seconds: CPU time limit per process, zero for unlimited.
+            memory_bytes: Address space limit per process, zero for unlimited.
+            wall_seconds: Wall clock limit per process, zero for unlimited.
+        """
+        self._graph = graph
+        self._root = root
+        self._workers = max(1, workers)
+        self._limits = {"cpu_seconds": cpu_seconds, "memory_bytes": memory_bytes}
+        self._wall_seconds = wall_seconds
+        self._changed: dict[str, set[str]] = {}
+        self._failed: dict[str, set[str]] = {}
+        self._durations: dict[str, float] = {}
+        self._processes: dict[tuple[WebSocket, int], set[Process]] = {}
+
+    async def run(
+        self, client: WebSocket, path: str, request_id: int, run_all: bool = False
+    ) -> None:
+        """Run the affected tests under `path`, streaming results to `client`."""
+        started = time.perf_counter()
+        path = self._graph.relative(path)
+        tests = {
+            file
+            for file in await self._graph.files()
+            if _is_test_file(file) and _is_under(file, path)
+        }
+        changed = self._changed.get(path)
+        self._changed[path] = set()
+        try:
+            selected = await self._select(path, tests, changed, run_all)
+            await send_event(
+                client,
+                WebSocketEvent(
+                    type="TEST_STARTED",
+                    data={
+                        "request_id": request_id,
+                        "path": path,
+                        "files": sorted(selected),
+                        "unaffected": len(tests) - len(selected),
+                    },
+                ),
+            )
+            totals: Counter[str] = Counter()
+            failed: set[str] = set()
+            errors = await asyncio.gather(
+                *(
+                    self._run_chunk(client, request_id, chunk, totals, failed)
+                    for chunk in self._partition(selected)
+                )
+            )
+        except BaseException:
+            # The changes this run would have covered still need testing.
+            if changed is not None:
+                self._changed[path] |= changed
+            raise
+        finally:
+            self._processes.pop((client, request_id), None)
+
+        self._failed[path] = failed
+        await send_event(
+            client,
+            WebSocketEvent(
+                type="TEST_DONE",
+                data={
+                    "request_id": request_id,
+                    "path": path,
+                    **totals,
+                    "duration": time.perf_counter() - started,
+                    "errors": [error for error in errors if error],
+                },
+            ),
+        )
+
+    def cancel(self, client: WebSocket, request_id: int) -> bool:
+        """Kill a test run's processes. Returns whether it was running."""
+        processes = self._processes.get((client, request_id))
+        for process in processes or ():
+            _kill(process)
+        return processes is not None
+
+    def disconnect(self, client: WebSocket) -> None:
+        """Kill a disconnected client's test runs."""
+        for key, processes in list(self._processes.items()):
+            if key[0] is client:
+                for process in processes:
+                    _kill(process)
+
+    async def apply(self, event: WebSocketEvent) -> None:
+        """Note changed files for each path tested so far."""
+        for change in event.data["changes"]:
+            if is_directory_change(change):
+                self._changed.clear()  # Every path runs in full next.
+                return
+            for key in ("path", "dest_path"):
+                if change.get(key):
+                    path = self._graph.relative(change[key])
+                    for changed in self._changed.values():
+                        changed.add(path)
+
+    async def _select(
+        self, path: str, tests: set[str], changed: set[str] | None, run_all: bool
+    ) -> set[str]:
+        if run_all or changed is None:
+            return tests
+        if any(os.path.basename(file) == "conftest.py" for file in changed):
+            return tests
+        affected = await self._graph.affected(tests, changed)
+        return affected | (self._failed.get(path, set()) & tests)
+
+    def _partition(self, files: set[str]) -> list[list[str]]:
+        """Split files between the workers, longest first onto the least loaded."""
+        if not files:
+            return []
+        chunks: list[tuple[float, list[str]]] = [
+            (0.0, []) for _ in range(min(self._workers, len(files)))
+        ]
+        for file in sorted(files, key=lambda f: -self._durations.get(f, 1.0)):
+            load, chunk = min(chunks, key=lambda c: c[0])
+            chunks.remove((load, chunk))
+            chunk.append(file)
+            chunks.append((load + self._durations.get(file, 1.0), chunk))
+        return [chunk for _, chunk in chunks]
+
+    async def _run_chunk(
+        self,
+        client: WebSocket,
+        request_id: int,
+        files: list[str],
+        totals: Counter[str],
+        failed: set[str],
+    ) -> str | None:
+        """Run some test files in one pytest process. Returns an error, if any."""
+        read_fd, write_fd = os.pipe()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable,
+                "-m",
+                "pytest",
+                "-p",
+                "server.wrappers.pytest_events",
+                "-p",
+                "no:cacheprovider",
+                "-q",
+                "--rootdir",
+                self._root,
+                *files,
+                cwd=self._root,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+                pass_fds=(write_fd,),
+                env={
+                    **os.environ,
+                    "COMP110_TEST_EVENTS_FD": str(write_fd),
+                    "COMP110_TEST_LIMITS": json.dumps(self._limits),
+                },
+            )
+        except BaseException:
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
+        self._processes.setdefault((client, request_id), set()).add(process)
+
+        durations: Counter[str] = Counter()
+        reader, transport = await _open_pipe(read_fd)
+        try:
+            results = asyncio.create_task(
+                self._forward(client, request_id, reader, totals, failed, durations)
+            )
+            assert process.stderr
+            stderr = asyncio.create_task(process.stderr.read())
+            timeout = self._wall_seconds if self._wall_seconds > 0 else None
+            try:
+                await asyncio.wait_for(process.wait(), timeout)
+            except asyncio.TimeoutError:
+                _kill(process)
+                await process.wait()
+            await results
+            output = (await stderr)[-STDERR_MAX_BYTES:]
+        finally:
+            transport.close()
+        self._durations.update(durations)
+
+        if process.returncode in _NORMAL_EXIT_CODES:
+            return None
+        message = output.decode(errors="replace").strip()
+        return f"pytest exited with {process.returncode}: {message}".strip()
+
+    async def _forward(
+        self,
+        client: WebSocket,
+        request_id: int,
+        reader: StreamReader,
+        totals: Counter[str],
+        failed: set[str],
+        durations: Counter[str],
+    ) -> None:
+        """Send each result the plugin reports to the client as it arrives."""
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                kind, length = FRAME_HEADER.unpack(header)
+                payload = await reader.readexactly(length)
+                if kind != EVENT:
+                    continue
+                event = json.loads(payload)
+                result = event["data"]
+                file = result["nodeid"].split("::")[0]
+                totals[result["outcome"]] += 1
+                durations[file] += result["duration"]
+                if result["outcome"] in ("failed", "error"):
+                    failed.add(file)
+                await send_event(
+                    client,
+                    WebSocketEvent(
+                        type=event["type"], data={**result, "request_id": request_id}
+                    ),
+                )
+        except asyncio.IncompleteReadError:
+            ...
+        except Exception as e:
+            print(e)
+
+
+async def _open_pipe(fd: int) -> tuple[StreamReader, asyncio.BaseTransport]:
+    reader = StreamReader()
+    loop = asyncio.get_running_loop()
+    try:
+        pipe = os.fdopen(fd, "rb", buffering=0)
+    except BaseException:
+        os.close(fd)
+        raise
+    transport, _ = await loop.connect_read_pipe(
+        lambda: StreamReaderProtocol(reader), pipe
+    )
+    return reader, transport
+
+
+def _kill(process: Process) -> None:
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            ...
+
+
+def _is_test_file(path: str) -> bool:
+    name = os.path.basename(path)
+    return name.endswith(".py") and (
+        name.startswith("test_") or name.endswith("_test.py")
+    )
+
+
+def _is_under(path: str, directory: str) -> bool:
+    return directory == "." or path == directory or path.startswith(directory + os.sep)
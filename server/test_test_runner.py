@@ -0,0 +1,71 @@
+"""Tests for which test files a TEST request selects after changes."""
+
+import asyncio
+
+from server import test_runner
+from server.import_graph import ImportGraph
+from server.web_socket_event import WebSocketEvent
+
+TESTS = {"test_area.py", "test_other.py"}
+
+
+def _runner(root) -> test_runner.TestRunner:
+    (root / "shapes.py").write_text("")
+    (root / "test_area.py").write_text("import shapes\n")
+    (root / "test_other.py").write_text("")
+    (root / "conftest.py").write_text("")
+    return test_runner.TestRunner(ImportGraph(str(root)), str(root))
+
+
+def _select(
+    runner: test_runner.TestRunner, changed: set[str] | None, run_all: bool = False
+) -> set[str]:
+    return asyncio.run(runner._select(".", TESTS, changed, run_all))
+
+
+def _changed(runner: test_runner.TestRunner, *changes: dict[str, str]) -> None:
+    event = WebSocketEvent(type="files_changed", data={"changes": list(changes)})
+    asyncio.run(runner.apply(event))
+
+
+def test_a_path_tested_for_the_first_time_runs_in_full(tmp_path):
+    assert _select(_runner(tmp_path), None) == TESTS
+
+
+def test_only_tests_importing_a_changed_file_run(tmp_path):
+    runner = _runner(tmp_path)
+    assert _select(runner, {"shapes.py"}) == {"test_area.py"}
+    assert _select(runner, set()) == set()
+
+
+def test_run_all_and_a_changed_conftest_run_in_full(tmp_path):
+    runner = _runner(tmp_path)
+    assert _select(runner, set(), run_all=True) == TESTS
+    assert _select(runner, {"conftest.py"}) == TESTS
+
+
+def test_tests_that_failed_last_time_run_again(tmp_path):
+    runner = _runner(tmp_path)
+    runner._failed["."] = {"test_other.py"}
+    assert _select(runner, {"shapes.py"}) == TESTS
+
+
+def test_changes_are_noted_for_each_path_tested(tmp_path):
+    runner = _runner(tmp_path)
+    runner._changed["."] = set()
+    _changed(
+        runner,
+        {
+            "type": "file_moved",
+            "path": str(tmp_path / "a.py"),
+            "dest_path": str(tmp_path / "b.py"),
+        },
+    )
+    assert runner._changed["."] == {"a.py", "b.py"}
+
+
+def test_a_directory_change_runs_every_path_in_full(tmp_path):
+    runner = _runner(tmp_path)
+    runner._changed["."] = {"shapes.py"}
+    _changed(runner, {"type": "directory_created", "path": str(tmp_path / "pkg")})
+    assert runner._changed.get(".") is None
@@ -3,15 +3,175 @@ WebSocketManager is responsible for maintaining a set of connected clients.
 
 It accepts new clients, notifying all clients of events, and removes clients
 when they disconnect. It can be shutdown using `stop` to close all clients.
+
+Notifications are fanned out through a bounded outbox per client, each drained by
+its own sender task, so a slow or half-dead client never delays the others. A
+backed up outbox coalesces repeated modifications of the same paths and
+drops its oldest notifications when full. A client that stays stuck on a single
+send past a threshold is evicted.
+
+Requests from a client are pipelined: each one is handled in its own task so a
+slow LS or RUN never holds up the requests behind it. Control requests (KILL) are
+handled immediately, bypassing the per-client limit on requests in flight. STDIN
+for a given pid is handled strictly in order. A client with too many requests
+pending is answered BUSY, naming the refused request, until some finish. All of
+a client's tasks are cancelled when it disconnects.
 """
 __author__ = "Kris Jordan <kris@cs.unc.edu>"
 __copyright__ = "Copyright 2023"
 __license__ = "MIT"
 
-from typing import Callable, Coroutine
-from fastapi import WebSocket
+import asyncio
+import itertools
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Coroutine, Hashable
+from fastapi import WebSocket, WebSocketDisconnect
 
 from .web_socket_event import WebSocketEvent
+from .wire import Message, encoding_for, negotiate, send, send_event
+from . import config, metrics
+
+ReceiveHandler = Callable[[WebSocket, WebSocketEvent], Coroutine[None, None, None]]
+
+CONTROL_EVENTS = frozenset(("KILL",))
+"""Event types handled immediately, ahead of any queued requests."""
+
+
+def _ordering_key(event: WebSocketEvent) -> Hashable | None:
+    """Requests sharing a key are handled one at a time, in the order received."""
+    if event.type == "STDIN":
+        return ("STDIN", event.data.get("pid"))
+    return None
+
+
+class _RequestDispatcher:
+    """Handles one client's requests concurrently, in lanes where order matters."""
+
+    def __init__(
+        self,
+        client: WebSocket,
+        handler: ReceiveHandler,
+        max_in_flight: int,
+        max_pending: int,
+    ):
+        self._client = client
+        self._handler = handler
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._max_pending = max_pending
+        self._pending = 0
+        self._lanes: dict[Hashable, deque[WebSocketEvent]] = {}
+        self._tasks: set[asyncio.Task[None]] = set()
+
+    async def dispatch(self, event: WebSocketEvent) -> None:
+        if event.type in CONTROL_EVENTS:
+            self._spawn(self._handle(event))
+            return
+        if self._pending >= self._max_pending:
+            await send_event(
+                self._client,
+                WebSocketEvent(
+                    type="BUSY",
+                    data={
+                        "type": event.type,
+                        "request_id": event.data.get("request_id"),
+                        "pending": self._pending,
+                    },
+                ),
+            )
+            return
+        self._pending += 1
+        key = _ordering_key(event)
+        if key is None:
+            self._spawn(self._handle_in_slot(event))
+        elif key in self._lanes:
+            self._lanes[key].append(event)
+        else:
+            self._lanes[key] = deque((event,))
+            self._spawn(self._drain_lane(key))
+
+    async def close(self) -> None:
+        """Cancel every request still being handled."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._lanes.clear()
+
+    def _spawn(self, coroutine: Coroutine[None, None, None]) -> None:
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drain_lane(self, key: Hashable) -> None:
+        lane = self._lanes[key]
+        try:
+            while lane:
+                await self._handle_in_slot(lane.popleft())
+        finally:
+            del self._lanes[key]
+
+    async def _handle_in_slot(self, event: WebSocketEvent) -> None:
+        try:
+            async with self._slots:
+                await self._handle(event)
+        finally:
+            self._pending -= 1
+
+    async def _handle(self, event: WebSocketEvent) -> None:
+        try:
+            await self._handler(self._client, event)
+        except Exception as e:
+            print(e)
+
+
+class _ClientOutbox:
+    """A bounded queue of notifications for one client and the task sending them."""
+
+    def __init__(self, client: WebSocket, max_size: int):
+        self.client = client
+        self.dropped = 0
+        self._max_size = max_size
+        self._queue: OrderedDict[Hashable, Message] = OrderedDict()
+        self._ready = asyncio.Event()
+        self._sending_since: float | None = None
+        self._sender = asyncio.create_task(self._send_loop())
+
+    def put(self, key: Hashable, message: Message) -> None:
+        """Queue a message. A queued message with the same key is replaced."""
+        if self._queue.pop(key, None) is None and len(self._queue) >= self._max_size:
+            self._queue.popitem(last=False)
+            self.dropped += 1
+        self._queue[key] = message
+        self._ready.set()
+
+    def depth(self) -> int:
+        """Messages waiting to be sent."""
+        return len(self._queue)
+
+    def stalled_for(self) -> float:
+        """Seconds the current send has been in progress, zero when idle."""
+        if self._sending_since is None:
+            return 0.0
+        return asyncio.get_running_loop().time() - self._sending_since
+
+    def close(self) -> None:
+        self._sender.cancel()
+
+    async def _send_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                await self._ready.wait()
+                while self._queue:
+                    _, message = self._queue.popitem(last=False)
+                    self._sending_since = loop.time()
+                    await send(self.client, message)
+                    self._sending_since = None
+                self._ready.clear()
+        except asyncio.CancelledError:
+            ...
+        except Exception as e:
+            print(e)
 
 
 class WebSocketManager:
@@ -24,12 +184,22 @@ class WebSocketManager:
 
     def __init__(
         self,
-        receive_handler: Callable[
-            [WebSocket, WebSocketEvent], Coroutine[None, None, None]
-        ],
+        receive_handler: ReceiveHandler,
+        disconnect_handler: Callable[[WebSocket], None] | None = None,
+        queue_size: int = config.CLIENT_QUEUE_SIZE,
+        evict_after: float = config.CLIENT_EVICT_AFTER,
+        max_in_flight: int = config.CLIENT_MAX_IN_FLIGHT,
+        max_pending: int = config.CLIENT_MAX_PENDING,
     ):
-        self._clients: set[WebSocket] = set()
+        self._clients: dict[WebSocket, _ClientOutbox] = {}
         self._receive_handler = receive_handler
+        self._disconnect_handler = disconnect_handler
+        self._queue_size = queue_size
+        self._evict_after = evict_after
+        self._max_in_flight = max_in_flight
+        self._max_pending = max_pending
+        self._sequence = itertools.count()
+        self._closing: set[asyncio.Task[None]] = set()
 
     async def accept(self, client: WebSocket) -> None:
         """
@@ -39,31 +209,62 @@ class WebSocketManager:
             client: The fastapi.WebSocket client to accept.
         """
         await client.accept()
-        self._clients.add(client)
+        encoding = await negotiate(client)
+        self._clients[client] = _ClientOutbox(client, self._queue_size)
+        dispatcher = _RequestDispatcher(
+            client, self._receive_handler, self._max_in_flight, self._max_pending
+        )
         try:
             while True:
-                data = await client.receive_text()
-                event = WebSocketEvent.model_validate_json(data)
-                await self._receive_handler(client, event)
+                message = await client.receive()
+                if message["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(message.get("code", 1000))
+                data = message.get("text")
+                event = encoding.decode(data if data is not None else message["bytes"])
+                await dispatcher.dispatch(event)
         except Exception as e:
             print(e)
             pass
         finally:
-            self._clients.remove(client)
+            await dispatcher.close()
+            outbox = self._clients.pop(client, None)
+            if outbox:
+                outbox.close()
+            if self._disconnect_handler:
+                self._disconnect_handler(client)
 
     async def notify(self, event: WebSocketEvent) -> None:
         """
         Notify all clients of a new event.
 
+        The event is encoded once per encoding in use and queued for every client
+        without waiting on any of them.
+
         Args:
             event: The event to notify clients of.
 
         Returns:
             None
         """
-        json = event.model_dump_json()
-        for client in self._clients:
-            await client.send_text(json)
+        started = time.perf_counter()
+        messages: dict[str, Message] = {}
+        key = self._coalesce_key(event)
+        for outbox in list(self._clients.values()):
+            if outbox.stalled_for() > self._evict_after:
+                self._evict(outbox)
+                continue
+            encoding = encoding_for(outbox.client)
+            if encoding.name not in messages:
+                messages[encoding.name] = encoding.encode(event)
+            outbox.put(key, messages[encoding.name])
+        metrics.NOTIFY_SECONDS.observe(time.perf_counter() - started)
+
+    def queue_depths(self) -> dict[metrics.Labels, float]:
+        """Each connected client's outbox depth, labeled by client address."""
+        return {
+            (("client", _address(client)),): outbox.depth()
+            for client, outbox in self._clients.items()
+        }
 
     async def stop(self) -> None:
         """
@@ -74,9 +275,40 @@ class WebSocketManager:
 
         Returns:
             None"""
-        for client in self._clients:
+        for client, outbox in list(self._clients.items()):
+            outbox.close()
             try:
                 await client.close()
             except Exception:
                 ...
         self._clients.clear()
+
+    def _coalesce_key(self, event: WebSocketEvent) -> Hashable:
+        """Only the latest pending modification of the same paths needs to be sent."""
+        if event.type == "files_changed":
+            changes = event.data["changes"]
+            if all(change["type"].endswith("_modified") for change in changes):
+                return frozenset((c["type"], c["path"]) for c in changes)
+        elif event.type == "DIAGNOSTICS":
+            return ("DIAGNOSTICS", event.data["path"])
+        elif event.type.endswith("_modified") and "path" in event.data:
+            return frozenset(((event.type, event.data["path"]),))
+        return next(self._sequence)
+
+    def _evict(self, outbox: _ClientOutbox) -> None:
+        """Disconnect a client that has stopped keeping up."""
+        self._clients.pop(outbox.client, None)
+        outbox.close()
+        task = asyncio.create_task(self._close_quietly(outbox.client))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _close_quietly(self, client: WebSocket) -> None:
+        try:
+            await client.close()
+        except Exception:
+            ...
+
+
+def _address(client: WebSocket) -> str:
+    return f"{client.client.host}:{client.client.port}" if client.client else "unknown"
@@ -0,0 +1,190 @@
+"""Wire encodings for events sent to and received from web socket clients.
+
+JSON text frames are the default. A client may opt into a compact encoding when it
+connects with `/ws?encoding=<name>`:
+
+- `binary`: program output is sent as a binary frame. Each frame has a fixed
+  six byte header (stream id, flags, pid as a big-endian uint32) followed by the
+  raw UTF-8 output. All other events remain JSON text frames. Binary output
+  frames carry no sequence number: each is one past the frame or event before it.
+- `msgpack`: every event, in both directions, is a MessagePack map in a binary
+  frame. This requires the optional `msgpack` package.
+
+When a client asks for an encoding, the server's first frame is a JSON `ENCODING`
+event naming the encoding it will use. An unknown or unavailable encoding falls
+back to JSON.
+
+Program output is the hot path. Its frames are built directly from the pid and
+text, without constructing and validating a generic WebSocketEvent.
+
+A run's output frames and events carry `seq`, the run's sequence number. A
+client that reconnects sends it in an ATTACH to resume where it left off.
+"""
+
+__author__ = "Kris Jordan <kris@cs.unc.edu>"
+__copyright__ = "Copyright 2024"
+__license__ = "MIT"
+
+import json
+import struct
+from typing import Any
+from weakref import WeakKeyDictionary
+from fastapi import WebSocket
+
+from .web_socket_event import WebSocketEvent
+
+try:
+    import msgpack  # type: ignore
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+Message = str | bytes
+"""A text or binary web socket frame."""
+
+OUTPUT_HEADER = struct.Struct("!BBI")
+"""Binary output frame header: stream id, flags, pid."""
+
+STREAM_IDS = {"STDOUT": 1, "STDERR": 2}
+"""Stream ids used in binary output frame headers."""
+
+FLAG_INPUT_PROMPT = 0x01
+"""Header flag set when a STDOUT frame is an input prompt."""
+
+
+class JsonEncoding:
+    """The default encoding: every event is a JSON text frame."""
+
+    name = "json"
+
+    def encode(self, event: WebSocketEvent) -> Message:
+        return event.model_dump_json()
+
+    def encode_output(
+        self,
+        stream: str,
+        pid: int,
+        output: bytes,
+        is_input_prompt: bool = False,
+        seq: int | None = None,
+    ) -> Message:
+        data: dict[str, Any] = {
+            "pid": pid,
+            "data": output.decode(errors="replace"),
+        }
+        if stream == "STDOUT":
+            data["is_input_prompt"] = is_input_prompt
+        if seq is not None:
+            data["seq"] = seq
+        return json.dumps(
+            {"type": stream, "data": data}, ensure_ascii=False, separators=(",", ":")
+        )
+
+    def decode(self, message: Message) -> WebSocketEvent:
+        return WebSocketEvent.model_validate_json(message)
+
+
+class BinaryOutputEncoding(JsonEncoding):
+    """JSON events with program output sent as raw bytes behind a fixed header."""
+
+    name = "binary"
+
+    def encode_output(
+        self,
+        stream: str,
+        pid: int,
+        output: bytes,
+        is_input_prompt: bool = False,
+        seq: int | None = None,
+    ) -> Message:
+        flags = FLAG_INPUT_PROMPT if is_input_prompt else 0
+        return OUTPUT_HEADER.pack(STREAM_IDS[stream], flags, pid) + output
+
+
+class MessagePackEncoding(JsonEncoding):
+    """Every event, in both directions, as a MessagePack binary frame."""
+
+    name = "msgpack"
+
+    def encode(self, event: WebSocketEvent) -> Message:
+        return msgpack.packb(event.model_dump(mode="json"))  # type: ignore
+
+    def encode_output(
+        self,
+        stream: str,
+        pid: int,
+        output: bytes,
+        is_input_prompt: bool = False,
+        seq: int | None = None,
+    ) -> Message:
+        data: dict[str, Any] = {"pid": pid, "data": output.decode(errors="replace")}
+        if stream == "STDOUT":
+            data["is_input_prompt"] = is_input_prompt
+        if seq is not None:
+            data["seq"] = seq
+        return msgpack.packb({"type": stream, "data": data})  # type: ignore
+
+    def decode(self, message: Message) -> WebSocketEvent:
+        if isinstance(message, str):
+            return WebSocketEvent.model_validate_json(message)
+        return WebSocketEvent.model_validate(msgpack.unpackb(message))  # type: ignore
+
+
+JSON = JsonEncoding()
+"""The default encoding."""
+
+ENCODINGS: dict[str, JsonEncoding] = {JSON.name: JSON, "binary": BinaryOutputEncoding()}
+"""Encodings available to clients, by name."""
+
+if msgpack is not None:
+    ENCODINGS["msgpack"] = MessagePackEncoding()
+
+_client_encodings: "WeakKeyDictionary[WebSocket, JsonEncoding]" = WeakKeyDictionary()
+
+
+async def negotiate(client: WebSocket) -> JsonEncoding:
+    """Choose the encoding requested by an accepted client's `encoding` parameter."""
+    requested = client.query_params.get("encoding")
+    encoding = ENCODINGS.get(requested or JSON.name, JSON)
+    _client_encodings[client] = encoding
+    if requested is not None:
+        event = WebSocketEvent(type="ENCODING", data={"encoding": encoding.name})
+        await client.send_text(JSON.encode(event))
+    return encoding
+
+
+def encoding_for(client: WebSocket) -> JsonEncoding:
+    """The encoding negotiated by a client."""
+    return _client_encodings.get(client, JSON)
+
+
+async def send(client: WebSocket, message: Message) -> None:
+    """Send an encoded message as a text or binary frame."""
+    if isinstance(message, str):
+        await client.send_text(message)
+    else:
+        await client.send_bytes(message)
+
+
+async def send_event(client: WebSocket, event: WebSocketEvent) -> None:
+    """Encode and send an event in the client's encoding."""
+    await send(client, encoding_for(client).encode(event))
+
+
+async def send_output(
+    client: WebSocket,
+    stream: str,
+    pid: int,
+    output: bytes,
+    is_input_prompt: bool = False,
+    seq: int | None = None,
+) -> None:
+    """Encode and send program output in the client's encoding."""
+    encoding = encoding_for(client)
+    await send(
+        client, encoding.encode_output(stream, pid, output, is_input_prompt, seq)
+    )
+
+
+def assign_encoding(client: Any, name: str) -> None:
+    """Encode messages for `client` as another connection negotiated."""
+    _client_encodings[client] = ENCODINGS.get(name, JSON)
@@ -0,0 +1,91 @@
+"""The control pipe carries runtime events from the wrapper to the server.
+
+Program output stays on stdout and stderr as raw bytes. Everything else the
+wrapper needs to tell the server travels out of band on an inherited pipe, so
+student output can never be mistaken for a control message. Each frame is a
+five byte header (frame kind, payload length as a big-endian uint32) followed by
+the payload:
+
+- `PROMPT`: JSON `{"prompt": str, "stdout_offset": int}`. The program is waiting
+  on input(). The prompt is shown after the first `stdout_offset` bytes of stdout,
+  which is everything the program printed before it asked.
+- `EXCEPTION`: the crash report's JSON text.
+- `EVENT`: JSON `{"type": str, "data": dict}`, a runtime event forwarded to the
+  client as is.
+- `DEPENDENCIES`: JSON `{"files": [str], "side_effects": bool}`, sent as the
+  program ends: the workspace files it read or imported, and whether it did
+  anything besides print output.
+- `PROFILE`: JSON, the profile of a RUN with the `profile` option, sent as the
+  program ends. See `server.wrappers.profiler`.
+- `USAGE`: JSON, the program's CPU time, peak memory, and context switches, sent
+  as it ends. See `server.wrappers.limits.usage`.
+"""
+
+import io
+import json
+import os
+import struct
+import sys
+from typing import Any
+
+FRAME_HEADER = struct.Struct("!BI")
+"""Control frame header: frame kind, payload length."""
+
+PROMPT = 1
+EXCEPTION = 2
+EVENT = 3
+DEPENDENCIES = 4
+PROFILE = 5
+USAGE = 6
+
+
+def encode_frame(kind: int, payload: bytes) -> bytes:
+    """A control frame of `kind` carrying `payload`."""
+    return FRAME_HEADER.pack(kind, len(payload)) + payload
+
+
+class CountingStdout(io.FileIO):
+    """Unbuffered stdout that counts the bytes the program has written."""
+
+    def __init__(self) -> None:
+        super().__init__(sys.stdout.fileno(), "wb", closefd=False)
+        self.written = 0
+
+    def write(self, data: Any) -> int | None:
+        count = super().write(data)
+        self.written += count or 0
+        return count
+
+
+class ControlChannel:
+    """The wrapper's end of the control pipe."""
+
+    def __init__(self, fd: int):
+        os.set_inheritable(fd, False)
+        self._fd = fd
+        self._stdout = CountingStdout()
+        sys.stdout = io.TextIOWrapper(
+            self._stdout,
+            encoding=sys.stdout.encoding,
+            errors=sys.stdout.errors,
+            write_through=True,
+        )
+
+    def input(self, prompt: Any = "") -> str:
+        """Replaces builtins.input: send the prompt out of band, then read a line."""
+        sys.stdout.flush()
+        payload = {"prompt": str(prompt), "stdout_offset": self._stdout.written}
+        self.send(PROMPT, json.dumps(payload).encode())
+        line = sys.stdin.readline()
+        if not line:
+            raise EOFError("EOF when reading a line")
+        return line[:-1] if line.endswith("\n") else line
+
+    def send_event(self, type: str, data: dict[str, Any]) -> None:
+        """Forward a runtime event to the client."""
+        self.send(EVENT, json.dumps({"type": type, "data": data}).encode())
+
+    def send(self, kind: int, payload: bytes) -> None:
+        frame = memoryview(encode_frame(kind, payload))
+        while frame:
+            frame = frame[os.write(self._fd, frame) :]
@@ -0,0 +1,333 @@
+"""Crash reports with bounded summaries of each frame's local variables.
+
+A report is written once, as JSON text, into a single buffer. Locals are not
+serialized wholesale. Each one is summarized within limits on depth, items per
+container, and string length, and the whole report has a byte budget that is
+shared fairly between frames. Containers past a limit become a summary object:
+`{"type": ..., "length": ..., "preview": ...}`. numpy arrays and pandas objects
+get a shape and a small preview. numpy and pandas are never imported here; they
+are recognized only if the program already imported them.
+
+An object that appears in several frames, such as a list passed down a chain of
+calls, is summarized once and its JSON text is reused.
+"""
+
+import dataclasses
+import json
+import math
+import os
+import sys
+import sysconfig
+import types
+from typing import Any, Iterable
+
+REPORT_MAX_BYTES = 256 * 1024
+"""Budget for a whole report. Locals are truncated to stay near it."""
+
+MAX_DEPTH = 3
+"""Container nesting summarized before values are reduced to type and length."""
+
+MAX_ITEMS = 20
+"""Items shown per container, array, or data frame preview."""
+
+MAX_STRING = 200
+"""Characters shown per string."""
+
+MAX_MESSAGE = 4096
+"""Characters shown of the exception message."""
+
+HIDDEN_PREFIXES = tuple(
+    dict.fromkeys(
+        (
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep,
+            "/workspace/server",
+            "/usr/lib",
+            "<frozen ",
+            *(
+                sysconfig.get_path(name) + os.sep
+                for name in ("stdlib", "platstdlib", "purelib", "platlib")
+            ),
+        )
+    )
+)
+"""Files of the server, Python, and installed packages, whose frames are not
+the student's and are left out of crash reports and profiles."""
+
+_SCALARS = (str, int, float, bool, type(None))
+
+_NAMED = (
+    type,
+    types.ModuleType,
+    types.FunctionType,
+    types.BuiltinFunctionType,
+    types.MethodType,
+)
+
+
+class CrashReport:
+    """Writes an exception and its stack frames as one bounded JSON document."""
+
+    def __init__(
+        self,
+        max_bytes: int = REPORT_MAX_BYTES,
+        max_depth: int = MAX_DEPTH,
+        max_items: int = MAX_ITEMS,
+        max_string: int = MAX_STRING,
+    ):
+        self._max_bytes = max_bytes
+        self._max_depth = max_depth
+        self._max_items = max_items
+        self._max_string = max_string
+        self._parts: list[str] = []
+        self._written = 0
+        self._budget = max_bytes
+        self._memo: dict[tuple[int, int], tuple[Any, str]] = {}
+        self._path: set[int] = set()
+
+    def write(
+        self,
+        error_type: str,
+        message: str,
+        frames: list[tuple[dict[str, Any], Iterable[tuple[str, Any]]]],
+    ) -> str:
+        """The report's JSON text for an exception and its (frame info, locals)."""
+        self._raw('{"type":')
+        self._raw(json.dumps(error_type))
+        self._raw(',"message":')
+        self._raw(json.dumps(message[:MAX_MESSAGE]))
+        self._raw(',"stack_trace":[')
+        for index, (info, local_items) in enumerate(frames):
+            if index:
+                self._raw(",")
+            self._raw(json.dumps(info)[:-1])
+            self._raw(',"locals":{')
+            # Each remaining frame gets an equal share of what is left, so the
+            # innermost frame is not starved by large globals further out.
+            share = (self._max_bytes - self._written) // (len(frames) - index)
+            self._budget = self._written + max(share, 0)
+            self._write_items(
+                ((json.dumps(str(name)), value) for name, value in local_items), 0
+            )
+            self._raw("}}")
+        self._raw("]}")
+        return "".join(self._parts)
+
+    def _raw(self, text: str) -> None:
+        self._parts.append(text)
+        self._written += len(text)
+
+    def _exhausted(self) -> bool:
+        return self._written >= self._budget
+
+    def _value(self, value: Any, depth: int) -> None:
+        if isinstance(value, _SCALARS):
+            self._scalar(value)
+            return
+
+        key = (id(value), depth)
+        memo = self._memo.get(key)
+        if memo is not None and memo[0] is value:
+            self._raw(memo[1])
+            return
+        if id(value) in self._path:
+            self._summary(value, {"repr": "[Circular reference]"})
+            return
+
+        start = len(self._parts)
+        self._path.add(id(value))
+        try:
+            self._container(value, depth)
+        except Exception:
+            # Summaries touch user objects (len, attributes, properties) that may
+            # raise; fall back to the type alone rather than losing the report.
+            self._rewind(start)
+            self._summary(value, {})
+        finally:
+            self._path.discard(id(value))
+
+        text = "".join(self._parts[start:])
+        self._parts[start:] = [text]
+        # Keep a reference so the id cannot be reused by another object.
+        self._memo[key] = (value, text)
+
+    def _scalar(self, value: str | int | float | bool | None) -> None:
+        if isinstance(value, str):
+            if len(value) > self._max_string:
+                more = len(value) - self._max_string
+                value = f"{value[: self._max_string]}... ({more} more characters)"
+            self._raw(json.dumps(value))
+        elif isinstance(value, float) and not math.isfinite(value):
+            self._summary(value, {"repr": repr(value)})
+        elif isinstance(value, int) and not isinstance(value, bool):
+            if value.bit_length() > 64 * 64:
+                self._summary(value, {"repr": f"<{value.bit_length()} bit integer>"})
+            else:
+                self._raw(str(value))
+        else:
+            self._raw(json.dumps(value))
+
+    def _container(self, value: Any, depth: int) -> None:
+        numpy = sys.modules.get("numpy")
+        pandas = sys.modules.get("pandas")
+        if numpy is not None and isinstance(value, numpy.ndarray):
+            self._array(value, depth)
+        elif numpy is not None and isinstance(value, numpy.generic):
+            self._value(value.item(), depth)
+        elif pandas is not None and isinstance(value, pandas.DataFrame):
+            self._data_frame(value, depth)
+        elif pandas is not None and isinstance(value, pandas.Series):
+            self._series(value, depth)
+        elif isinstance(value, (list, tuple)):
+            self._sequence(value, depth)
+        elif isinstance(value, dict):
+            self._mapping(value, depth)
+        elif isinstance(value, (set, frozenset)):
+            self._sized(value, depth, {"length": len(value)}, value)
+        elif dataclasses.is_dataclass(value) and not isinstance(value, type):
+            fields = [
+                (field.name, getattr(value, field.name))
+                for field in dataclasses.fields(value)
+            ]
+            self._object(value, depth, fields)
+        elif isinstance(value, _NAMED):
+            self._summary(value, {"name": value.__name__})
+        elif _has_instance_dict(value):
+            self._object(value, depth, list(vars(value).items()))
+        else:
+            self._summary(value, {})
+
+    def _sequence(self, value: list[Any] | tuple[Any, ...], depth: int) -> None:
+        if len(value) <= self._max_items and depth < self._max_depth:
+            start = len(self._parts)
+            self._raw("[")
+            for index, item in enumerate(value):
+                if index:
+                    self._raw(",")
+                self._value(item, depth + 1)
+                if self._exhausted() and index + 1 < len(value):
+                    break
+            else:
+                self._raw("]")
+                return
+            # Out of budget partway through: restart as a truncated summary. Items
+            # already summarized are memoized, so the preview does not redo them.
+            self._rewind(start)
+        self._sized(value, depth, {"length": len(value)}, value)
+
+    def _mapping(self, value: dict[Any, Any], depth: int) -> None:
+        if len(value) <= self._max_items and depth < self._max_depth:
+            start = len(self._parts)
+            self._raw("{")
+            if self._write_items(_keyed(value), depth + 1):
+                self._raw("}")
+                return
+            self._rewind(start)
+        self._summary(value, {"length": len(value)}, close=False)
+        if depth < self._max_depth:
+            self._raw(',"preview":{')
+            self._write_items(_keyed(value), depth + 1, self._max_items)
+            self._raw("}")
+        self._raw("}")
+
+    def _object(self, value: Any, depth: int, fields: list[tuple[str, Any]]) -> None:
+        self._summary(value, {}, close=False)
+        if depth < self._max_depth:
+            self._raw(',"fields":{')
+            self._write_items(
+                ((json.dumps(name), item) for name, item in fields),
+                depth + 1,
+                self._max_items,
+            )
+            self._raw("}")
+        self._raw("}")
+
+    def _array(self, value: Any, depth: int) -> None:
+        info = {"shape": list(value.shape), "dtype": str(value.dtype)}
+        self._summary(value, info, close=False)
+        if depth < self._max_depth and value.size:
+            self._raw(',"preview":')
+            self._value(value.ravel()[: self._max_items].tolist(), depth + 1)
+        self._raw("}")
+
+    def _series(self, value: Any, depth: int) -> None:
+        info = {"length": len(value), "dtype": str(value.dtype)}
+        self._summary(value, info, close=False)
+        if depth < self._max_depth and len(value):
+            self._raw(',"preview":')
+            self._value(value.head(self._max_items).tolist(), depth + 1)
+        self._raw("}")
+
+    def _data_frame(self, value: Any, depth: int) -> None:
+        columns = [str(column) for column in value.columns[: self._max_items]]
+        info = {"shape": list(value.shape), "columns": columns}
+        self._summary(value, info, close=False)
+        if depth < self._max_depth and len(value):
+            rows = value.iloc[: self._max_items, : self._max_items]
+            self._raw(',"preview":')
+            self._value(rows.values.tolist(), depth + 1)
+        self._raw("}")
+
+    def _sized(
+        self, value: Any, depth: int, info: dict[str, Any], items: Iterable[Any]
+    ) -> None:
+        self._summary(value, info, close=False)
+        if depth < self._max_depth:
+            self._raw(',"preview":[')
+            for index, item in enumerate(items):
+                if index == self._max_items or (index and self._exhausted()):
+                    break
+                if index:
+                    self._raw(",")
+                self._value(item, depth + 1)
+            self._raw("]")
+        self._raw("}")
+
+    def _summary(self, value: Any, info: dict[str, Any], close: bool = True) -> None:
+        text = json.dumps({"type": type(value).__name__, **info})
+        self._raw(text if close else text[:-1])
+
+    def _write_items(
+        self,
+        items: Iterable[tuple[str, Any]],
+        depth: int,
+        limit: int | None = None,
+    ) -> bool:
+        """Write `"key":value` pairs. Returns False if any were left out."""
+        for index, (key, item) in enumerate(items):
+            if index == limit or (index and self._exhausted()):
+                self._raw(',"...":"[Truncated]"' if index else '"...":"[Truncated]"')
+                return False
+            if index:
+                self._raw(",")
+            self._raw(key)
+            self._raw(":")
+            self._value(item, depth)
+        return True
+
+    def _rewind(self, start: int) -> None:
+        """Discard the output parts from index `start` on."""
+        self._written -= sum(len(part) for part in self._parts[start:])
+        del self._parts[start:]
+
+
+def _keyed(value: dict[Any, Any]) -> Iterable[tuple[str, Any]]:
+    for key, item in value.items():
+        if isinstance(key, str):
+            yield json.dumps(key), item
+        elif isinstance(key, _SCALARS):
+            yield json.dumps(str(key)), item
+        else:
+            yield json.dumps(repr(key)[:MAX_STRING]), item
+
+
+def _has_instance_dict(value: Any) -> bool:
+    """Whether `value` is an instance of a class from the program, not the stdlib."""
+    package = type(value).__module__.partition(".")[0]
+    return package not in sys.stdlib_module_names and isinstance(
+        getattr(value, "__dict__", None), dict
+    )
+
+
+def is_hidden_frame(filename: str) -> bool:
+    """Whether a frame in `filename` is left out of reports."""
+    return filename.startswith(HIDDEN_PREFIXES)
@@ -0,0 +1,98 @@
+"""Records what a run depended on, so the server can decide to cache its output.
+
+A run's output can be replayed when it came only from the code and files it
+read. An audit hook notes every file opened for reading under the workspace, and
+any side effect that replaying would not repeat: writing a file, starting a
+process, or opening a connection. The workspace modules the run imported are
+read from sys.modules when it ends, since a module imported from warm bytecode
+never opens its source. The main module is added by name, since runpy runs it
+without entering it in sys.modules.
+"""
+
+import importlib.util
+import os
+import sys
+from typing import Any
+
+_WRITE_FLAGS = os.O_WRONLY | os.O_RDWR | os.O_APPEND | os.O_CREAT | os.O_TRUNC
+
+_SIDE_EFFECT_EVENTS = frozenset(
+    (
+        "os.system",
+        "os.exec",
+        "os.posix_spawn",
+        "os.spawn",
+        "subprocess.Popen",
+        "socket.connect",
+        "socket.sendto",
+        "webbrowser.open",
+    )
+)
+"""Audit events that make a run's effects more than its output."""
+
+
+class DependencyRecorder:
+    """Notes the workspace files a run reads and whether it had side effects."""
+
+    def __init__(self, root: str, excluded: str):
+        """
+        Args:
+            root: The workspace directory. Only files under it are dependencies.
+            excluded: A directory under the root that is never a dependency.
+        """
+        self._root = os.path.abspath(root)
+        self._excluded = os.path.abspath(excluded)
+        self._files: set[str] = set()
+        self.side_effects = False
+
+    def start(self) -> None:
+        sys.addaudithook(self._audit)
+
+    def report(self) -> dict[str, Any]:
+        """The workspace files read and imported, relative to the root."""
+        for module in list(sys.modules.values()):
+            path = getattr(module, "__file__", None)
+            if isinstance(path, str):
+                self._add(path)
+        return {"files": sorted(self._files), "side_effects": self.side_effects}
+
+    def add_module(self, name: str) -> None:
+        """Depend on a module's source file, whether or not it was imported."""
+        try:
+            spec = importlib.util.find_spec(name)
+        except (ImportError, ValueError):
+            return
+        if spec and spec.origin:
+            self._add(spec.origin)
+
+    def _audit(self, event: str, args: tuple[Any, ...]) -> None:
+        try:
+            self._record(event, args)
+        except Exception:
+            # An exception here would surface in the program's own call.
+            self.side_effects = True
+
+    def _record(self, event: str, args: tuple[Any, ...]) -> None:
+        if event == "open":
+            path, mode, flags = args
+            if not isinstance(path, (str, bytes)):
+                return
+            path = os.fsdecode(path)
+            if path == os.devnull:
+                return
+            if "__pycache__" in path:
+                return  # Bytecode written by the import system.
+            writes = any(c in mode for c in "wax+") if mode else flags & _WRITE_FLAGS
+            if writes:
+                self.side_effects = True
+            else:
+                self._add(path)
+        elif event in _SIDE_EFFECT_EVENTS:
+            self.side_effects = True
+
+    def _add(self, path: str) -> None:
+        path = os.path.abspath(path)
+        if path.startswith(self._root + os.sep) and not path.startswith(
+            self._excluded + os.sep
+        ):
+            self._files.add(os.path.relpath(path, self._root))
@@ -0,0 +1,61 @@
+"""Resource limits the wrapper applies to itself before running a student module.
+
+The server sends the limits along with the module name. CPU time is limited with
+RLIMIT_CPU: the soft limit delivers SIGXCPU, which terminates the process, and the
+hard limit one second later kills it outright. Memory is limited with RLIMIT_AS;
+a MemoryError that escapes the program exits with MEMORY_LIMIT_EXIT_CODE so the
+server can tell it apart from other crashes.
+
+`usage` reports what the program used, for the server's run accounting.
+"""
+
+import resource
+import signal
+
+CPU_LIMIT_SIGNAL = signal.SIGXCPU
+"""Signal that terminates a program exceeding its CPU time limit."""
+
+MEMORY_LIMIT_EXIT_CODE = 86
+"""Exit code of a program that ran out of its memory limit."""
+
+
+def apply_limits(limits: dict[str, int]) -> None:
+    """Apply `cpu_seconds` and `memory_bytes` limits; zero or missing is unlimited."""
+    cpu_seconds = limits.get("cpu_seconds", 0)
+    if cpu_seconds > 0:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+
+    memory_bytes = limits.get("memory_bytes", 0)
+    if memory_bytes > 0:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+
+
+def usage(since: dict[str, float] | None = None) -> dict[str, float]:
+    """This process's resource usage, less what it had used at `since`.
+
+    Peak memory is the process's own peak, which `since` does not change."""
+    rusage = resource.getrusage(resource.RUSAGE_SELF)
+    used = {
+        "user_seconds": rusage.ru_utime,
+        "system_seconds": rusage.ru_stime,
+        "max_rss_bytes": _peak_rss_bytes(rusage),
+        "voluntary_switches": rusage.ru_nvcsw,
+        "involuntary_switches": rusage.ru_nivcsw,
+    }
+    for name, value in (since or {}).items():
+        if name != "max_rss_bytes":
+            used[name] -= value
+    return used
+
+
+def _peak_rss_bytes(rusage: resource.struct_rusage) -> int:
+    """Peak resident memory. Linux keeps ru_maxrss across exec, so it can be the
+    server's own peak, while VmHWM starts over with the new program."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        ...
+    return rusage.ru_maxrss * 1024
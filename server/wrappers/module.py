@@ -1,31 +1,99 @@
+import builtins
+import os
 import runpy
 import sys
 import traceback
 import json
 import inspect
+from importlib import import_module
 from typing import Any
+from server.wrappers.limits import (
+    apply_limits,
+    usage,
+    MEMORY_LIMIT_EXIT_CODE,
+)
+from server.wrappers.crash_report import CrashReport, is_hidden_frame
+from server.wrappers.control import (
+    ControlChannel,
+    DEPENDENCIES,
+    EXCEPTION,
+    PROFILE,
+    USAGE,
+)
+from server.wrappers.dependencies import DependencyRecorder
+from server.wrappers.profiler import Profiler
 
 if len(sys.argv) < 2:
     raise Exception("The module name must be passed as first argument to this wrapper.")
 
+limits: dict[str, int] = {}
+control: ControlChannel | None = None
+dependencies: DependencyRecorder | None = None
+profiler: Profiler | None = None
+usage_at_launch: dict[str, float] | None = None
+
+if sys.argv[1] == "--launch-fd":
+    # Pooled interpreter: warm up, then block until the server names a module.
+    # Usage: --launch-fd <fd> --control-fd <fd> [preload ...]
+    for preload in sys.argv[5:]:
+        try:
+            import_module(preload)
+        except ImportError:
+            ...
+    with os.fdopen(int(sys.argv[2]), "rb") as launch_pipe:
+        launch = launch_pipe.readline()
+    if not launch.strip():
+        sys.exit(0)
+    launch_request = json.loads(launch)
+    usage_at_launch = usage()  # Warming up is not the program's doing.
+    limits = launch_request.get("limits", {})
+    apply_limits(limits)
+    control = ControlChannel(int(sys.argv[4]))
+    builtins.input = control.input
+    sys.argv = [sys.argv[0], launch_request["module"]]
+    dependencies = DependencyRecorder(".", os.path.dirname(os.path.dirname(__file__)))
+    dependencies.start()
+    if launch_request.get("profile") is not None:
+        profiler = Profiler(launch_request["profile"])
+
 module_name = sys.argv[1]
 
 
-def audit_hook(event: str, args: tuple[Any, ...]):
-    if event == "builtins.input":
-        sys.stdout.buffer.write(b"\xff\xff\xff\xff")
-        sys.stdout.write(f"{len(args[0])}\n")
+def report_dependencies() -> None:
+    if control and dependencies:
+        dependencies.add_module(module_name)
+        control.send(DEPENDENCIES, json.dumps(dependencies.report()).encode())
+
+
+def report_usage() -> None:
+    if control:
+        control.send(USAGE, json.dumps(usage(usage_at_launch)).encode())
 
 
-sys.addaudithook(audit_hook)
+def report_profile() -> None:
+    if control and profiler:
+        profiler.stop()
+        control.send(PROFILE, json.dumps(profiler.report()).encode())
+
 
 try:
+    if profiler:
+        profiler.start()
     runpy.run_module(module_name, run_name="__main__")
+    report_profile()
+    report_dependencies()
+    report_usage()
+except SystemExit:
+    report_profile()
+    report_dependencies()
+    report_usage()
+    raise
 except Exception as e:
+    report_profile()
     tb_info = traceback.extract_tb(e.__traceback__)
     frames = inspect.getinnerframes(e.__traceback__)  # type: ignore
 
-    stack_trace: list[dict[str, Any]] = []
+    frames_info: list[tuple[dict[str, Any], list[tuple[str, Any]]]] = []
 
     info_frames = [frame for frame in tb_info]
     stack_frames = [frame for frame in frames]
@@ -34,63 +102,35 @@ except Exception as e:
         frame = info_frames[i]
         stack_frame = stack_frames[i]
 
-        if (
-            frame.filename.startswith("/workspace/server")
-            or frame.filename.startswith("/usr/lib")
-            or frame.filename.startswith("<frozen importlib")
-        ):
+        if is_hidden_frame(frame.filename):
             continue
 
-        arguments = inspect.getargvalues(stack_frame.frame)
-
-        locals: dict[str, Any] = {}
-        for local in stack_frame.frame.f_locals:
-            value = stack_frame.frame.f_locals[local]
-            try:
-                json.dumps(value)
-                locals[local] = value
-                # except (TypeError, OverflowError):
-                #     try:
-                #         value_type = type(value)
-
-                #             attributes = [
-                #                 attr for attr in dir(value) if not attr.startswith("_")
-                #             ]
-                #             simple_object: dict[str, Any] = {}
-
-                #             for attr in attributes:
-                #                 simple_object[attr] = getattr(value, attr)
-
-                #             locals[local] = {
-                #                 "type": type(value).__name__,
-                #                 "repr": attributes,
-                #             }
-                #         else:
-                #             locals[local] = repr(value)
-            except (TypeError, OverflowError):
-                locals[local] = "[See value in Debugger]"
-                continue
-
-        stack_trace.append(
-            {
-                "filename": frame.filename.replace("/workspace/", ""),
-                "lineno": frame.lineno,
-                "name": frame.name,
-                "line": "".join(stack_frame.code_context),  # type: ignore
-                "end_lineno": frame.end_lineno,
-                "colno": frame.colno,
-                "end_colno": frame.end_colno,
-                "locals": locals,
-            }
+        frames_info.append(
+            (
+                {
+                    "filename": frame.filename.replace("/workspace/", ""),
+                    "lineno": frame.lineno,
+                    "name": frame.name,
+                    "line": "".join(stack_frame.code_context or []),
+                    "end_lineno": frame.end_lineno,
+                    "colno": frame.colno,
+                    "end_colno": frame.end_colno,
+                },
+                [
+                    (name, value)
+                    for name, value in list(stack_frame.frame.f_locals.items())
+                    if not (name.startswith("__") and name.endswith("__"))
+                ],
+            )
         )
 
-    error_info = {
-        "type": type(e).__name__,
-        "message": str(e),
-        "stack_trace": stack_trace,
-    }
-
-    json_error_info = json.dumps(error_info)
-
-    sys.stderr.write(f"{json_error_info}\n")
+    report = CrashReport().write(type(e).__name__, str(e), frames_info)
+    if control:
+        report_dependencies()
+        control.send(EXCEPTION, report.encode())
+        report_usage()
+    else:
+        sys.stderr.write(f"{report}\n")
+    if isinstance(e, MemoryError) and limits.get("memory_bytes"):
+        sys.exit(MEMORY_LIMIT_EXIT_CODE)
     sys.exit(1)
@@ -0,0 +1,237 @@
+"""Profiles a run and reports where its time and memory went.
+
+A RUN with the `profile` option runs its module under a profiler:
+
+    {"type": "RUN", "data": {"module": "ex04.sort", "request_id": 1,
+     "profile": {"mode": "sampling", "memory": true}}}
+
+In either mode a SIGPROF timer samples the running stack every few milliseconds
+of CPU time. Each sample is charged to the innermost frame in a student's file,
+so time spent in a library is charged to the line that called it. Those samples
+give the line-level hotspots. In `sampling` mode, the default, they also give
+the time of each function. In `cprofile` mode functions are timed exactly by
+cProfile instead, at some cost in speed. With `memory`, tracemalloc records the
+peak memory traced. A sample that finds traced memory doubled since the last
+snapshot takes another, so the lines holding the most memory are reported as of
+near the peak rather than at exit, when most of it may have been freed.
+
+Frames of the server, Python, and installed packages are left out the same way
+crash reports leave them out. The report is small, a few dozen entries at most,
+and is sent to the server once as the program ends.
+"""
+
+import cProfile
+import linecache
+import os
+import pstats
+import signal
+import time
+import tracemalloc
+from collections import Counter
+from types import FrameType
+from typing import Any
+
+from server.wrappers.crash_report import is_hidden_frame
+
+SAMPLE_INTERVAL = 0.005
+"""CPU seconds between stack samples."""
+
+TOP_FUNCTIONS = 15
+"""Functions listed by self time and by cumulative time."""
+
+TOP_LINES = 15
+"""Lines listed by time spent on them."""
+
+TOP_ALLOCATIONS = 10
+"""Lines listed by the memory they held near the peak."""
+
+SNAPSHOT_MIN_BYTES = 1024 * 1024
+"""Traced memory below which no snapshot is taken before exit."""
+
+_Function = tuple[str, int, str]
+"""A function's file, first line, and name."""
+
+
+class Profiler:
+    """Samples, and optionally cProfiles and traces memory of, a running module."""
+
+    def __init__(self, options: dict[str, Any]):
+        """
+        Args:
+            options: `mode`, either "sampling" or "cprofile", and `memory`.
+        """
+        self._mode = "cprofile" if options.get("mode") == "cprofile" else "sampling"
+        self._memory = bool(options.get("memory"))
+        self._profile: cProfile.Profile | None = None
+        self._samples = 0
+        self._sampling = False
+        self._self: Counter[_Function] = Counter()
+        self._cumulative: Counter[_Function] = Counter()
+        self._lines: Counter[tuple[str, int]] = Counter()
+        self._wall = 0.0
+        self._cpu = 0.0
+        self._snapshot: tracemalloc.Snapshot | None = None
+        self._snapshot_bytes = 0
+        self._peak_bytes = 0
+
+    def start(self) -> None:
+        if self._memory:
+            tracemalloc.start()
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, SAMPLE_INTERVAL, SAMPLE_INTERVAL)
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        if self._mode == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def stop(self) -> None:
+        if self._profile:
+            self._profile.disable()
+        self._cpu = time.process_time() - self._cpu
+        self._wall = time.perf_counter() - self._wall
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        if self._memory and tracemalloc.is_tracing():
+            current, self._peak_bytes = tracemalloc.get_traced_memory()
+            if current >= self._snapshot_bytes:
+                self._take_snapshot(current)
+            tracemalloc.stop()
+
+    def report(self) -> dict[str, Any]:
+        """The profile as JSON-ready data."""
+        if self._profile:
+            self_time, cumulative = self._profiled_functions()
+        else:
+            self_time, cumulative = self._sampled_functions()
+        return {
+            "mode": self._mode,
+            "wall_seconds": self._wall,
+            "cpu_seconds": self._cpu,
+            "samples": self._samples,
+            "sample_interval": SAMPLE_INTERVAL,
+            "self": self_time,
+            "cumulative": cumulative,
+            "lines": [
+                {
+                    "file": _display(file),
+                    "line": line,
+                    "seconds": count * SAMPLE_INTERVAL,
+                    "code": linecache.getline(file, line).strip(),
+                }
+                for (file, line), count in self._lines.most_common(TOP_LINES)
+            ],
+            "memory": self._memory_report() if self._memory else None,
+        }
+
+    def _sample(self, signum: int, frame: FrameType | None) -> None:
+        """Charge a sample to the innermost student frame and its callers."""
+        if self._sampling:
+            return  # The timer fired again during a slow snapshot.
+        self._sampling = True
+        try:
+            self._samples += 1
+            if self._memory:
+                current = tracemalloc.get_traced_memory()[0]
+                if current >= max(2 * self._snapshot_bytes, SNAPSHOT_MIN_BYTES):
+                    self._take_snapshot(current)
+            self._charge(frame)
+        finally:
+            self._sampling = False
+
+    def _charge(self, frame: FrameType | None) -> None:
+        innermost = True
+        seen: set[_Function] = set()
+        while frame is not None:
+            code = frame.f_code
+            if not is_hidden_frame(code.co_filename):
+                function = (code.co_filename, code.co_firstlineno, code.co_name)
+                if innermost:
+                    self._self[function] += 1
+                    self._lines[(code.co_filename, frame.f_lineno)] += 1
+                    innermost = False
+                if function not in seen:
+                    seen.add(function)
+                    self._cumulative[function] += 1
+            frame = frame.f_back
+
+    def _take_snapshot(self, traced_bytes: int) -> None:
+        self._snapshot = None  # Free the last one first.
+        self._snapshot = tracemalloc.take_snapshot()
+        self._snapshot_bytes = traced_bytes
+
+    def _sampled_functions(self) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+        def entries(counts: Counter[_Function]) -> list[dict[str, Any]]:
+            return [
+                _function_entry(
+                    function,
+                    None,
+                    self._self[function] * SAMPLE_INTERVAL,
+                    self._cumulative[function] * SAMPLE_INTERVAL,
+                )
+                for function, _ in counts.most_common(TOP_FUNCTIONS)
+            ]
+
+        return entries(self._self), entries(self._cumulative)
+
+    def _profiled_functions(self) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+        assert self._profile
+        stats: dict[_Function, Any] = pstats.Stats(self._profile).stats  # type: ignore
+        entries = []
+        for function, (_, calls, self_time, cumulative, callers) in stats.items():
+            file = function[0]
+            if file == "~":
+                # A builtin is the student's when a student's function called it.
+                if all(is_hidden_frame(caller[0]) for caller in callers):
+                    continue
+            elif is_hidden_frame(file):
+                continue
+            entries.append(_function_entry(function, calls, self_time, cumulative))
+        by_self = sorted(entries, key=lambda entry: -entry["self_seconds"])
+        by_cumulative = sorted(entries, key=lambda entry: -entry["cumulative_seconds"])
+        return by_self[:TOP_FUNCTIONS], by_cumulative[:TOP_FUNCTIONS]
+
+    def _memory_report(self) -> dict[str, Any]:
+        allocations = []
+        if self._snapshot:
+            for statistic in self._snapshot.statistics("lineno"):
+                frame = statistic.traceback[0]
+                if is_hidden_frame(frame.filename):
+                    continue
+                allocations.append(
+                    {
+                        "file": _display(frame.filename),
+                        "line": frame.lineno,
+                        "bytes": statistic.size,
+                        "count": statistic.count,
+                        "code": linecache.getline(frame.filename, frame.lineno).strip(),
+                    }
+                )
+                if len(allocations) == TOP_ALLOCATIONS:
+                    break
+        return {
+            "peak_bytes": self._peak_bytes,
+            "snapshot_bytes": self._snapshot_bytes,
+            "allocations": allocations,
+        }
+
+
+def _function_entry(
+    function: _Function, calls: int | None, self_time: float, cumulative: float
+) -> dict[str, Any]:
+    file, line, name = function
+    return {
+        "file": _display(file) if file != "~" else None,
+        "line": line,
+        "function": name,
+        "calls": calls,
+        "self_seconds": self_time,
+        "cumulative_seconds": cumulative,
+    }
+
+
+def _display(file: str) -> str:
+    """A file as the student knows it, relative to the workspace."""
+    if os.path.isabs(file) and file.startswith(os.getcwd() + os.sep):
+        return os.path.relpath(file)
+    return file.replace("/workspace/", "")
@@ -0,0 +1,74 @@
+"""A pytest plugin streaming each test's result to the server as it finishes.
+
+The server loads it with `-p server.wrappers.pytest_events` and passes the write
+end of a pipe in `COMP110_TEST_EVENTS_FD`. Results are control pipe EVENT
+frames, so they are framed exactly like a RUN's runtime events:
+
+    {"type": "TEST_RESULT", "data": {"nodeid": "ex/test_a.py::test_one",
+     "outcome": "failed", "when": "call", "duration": 0.01, "message": "..."}}
+
+Resource limits in `COMP110_TEST_LIMITS` are applied before any test is
+collected, as the wrapper applies them to a RUN.
+"""
+
+import json
+import os
+from typing import Any
+
+import pytest
+
+from server.wrappers.control import EVENT, encode_frame
+from server.wrappers.limits import apply_limits
+
+MESSAGE_MAX_CHARS = 4000
+"""Longest failure message sent for a single test."""
+
+_fd: int | None = None
+
+
+def pytest_configure(config: pytest.Config) -> None:
+    global _fd
+    if "COMP110_TEST_EVENTS_FD" in os.environ:
+        _fd = int(os.environ["COMP110_TEST_EVENTS_FD"])
+        os.set_inheritable(_fd, False)
+    apply_limits(json.loads(os.environ.get("COMP110_TEST_LIMITS", "{}")))
+
+
+def pytest_collectreport(report: pytest.CollectReport) -> None:
+    if report.failed:
+        _send(report.nodeid, "error", "collect", 0.0, report.longreprtext)
+
+
+def pytest_runtest_logreport(report: pytest.TestReport) -> None:
+    if report.when == "call":
+        outcome = report.outcome
+        if report.skipped and hasattr(report, "wasxfail"):
+            outcome = "xfailed"
+        _send(report.nodeid, outcome, "call", report.duration, _message(report))
+    elif report.failed:
+        _send(report.nodeid, "error", report.when, report.duration, _message(report))
+    elif report.skipped:
+        _send(report.nodeid, "skipped", report.when, report.duration, _message(report))
+
+
+def _message(report: pytest.TestReport) -> str:
+    if report.skipped and isinstance(report.longrepr, tuple):
+        return str(report.longrepr[2])
+    return report.longreprtext if report.failed else ""
+
+
+def _send(nodeid: str, outcome: str, when: str, duration: float, message: str) -> None:
+    if _fd is None:
+        return
+    data: dict[str, Any] = {
+        "nodeid": nodeid,
+        "outcome": outcome,
+        "when": when,
+        "duration": duration,
+        "message": message[:MESSAGE_MAX_CHARS],
+    }
+    frame = memoryview(
+        encode_frame(EVENT, json.dumps({"type": "TEST_RESULT", "data": data}).encode())
+    )
+    while frame:
+        frame = frame[os.write(_fd, frame) :]